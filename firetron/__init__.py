@@ -1,4 +1,15 @@
 from ._findff import get_firefox_exe
-from ._createlnk import create_lnk
-from ._freeze import create_app
+from ._createlnk import create_lnk, create_lnks, update_lnk, read_lnk, lnk_matches
+from ._freeze import create_app, create_apps
+from ._delta import create_patch, apply_patch
 from ._icon import Icon
+from ._profile import create_profile_template, copy_profile_template
+from ._timing import read_startup_timing, timing_env
+from ._server import notify_ready
+from ._httpserver import StaticServer, serve_static, precompress
+from ._bridge import Bridge
+from ._instance import send_to_instance
+from ._launch import launch_app
+from ._pool import AppDirPool
+from ._fakeruntime import create_fake_runtime
+from ._monitor import Monitor
@@ -0,0 +1,317 @@
+"""
+Command line interface for firetron. Run ``python -m firetron --help``
+for usage. Options for ``build`` can also be given in a JSON config file,
+which can specify multiple builds:
+
+    {"jar": true, "jobs": 2, "builds": [
+        {"target_dir": "dist/foo", "name": "foo", "app": "foo/assets"},
+        {"target_dir": "dist/bar", "name": "bar", "app": "https://bar.com"}
+    ]}
+
+Options on the command line override the top-level options in the config
+file; options of an individual build override both. With ``--bundle``, the
+builds are apps in one bundle in the target directory, which share one
+frozen runtime (see ``create_apps()``).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import concurrent.futures
+from collections import OrderedDict
+
+from . import _bench
+from ._icon import Icon
+from ._freeze import create_app, create_apps
+from ._launch import launch_app
+from ._timing import read_startup_timing
+from ._delta import create_patch, apply_patch
+
+# Compression presets for the XUL app content
+PRESETS = OrderedDict()
+PRESETS['none'] = dict(jar=False, minify=False)  # loose files, fastest build
+PRESETS['jar'] = dict(jar=True, minify=False)  # one archive, fastest load
+PRESETS['small'] = dict(jar=True, minify=True)  # one archive, minified assets
+
+BUILD_ARGS = ('target_dir', 'name', 'app', 'title', 'icon', 'include_firefox', 'jar',
+              'minify', 'warm_profile', 'memory_profile', 'server', 'server_timeout',
+              'single_instance', 'cache_dir', 'reproducible', 'bridge')
+
+# Options of a bundle as a whole, the other options are per app
+BUNDLE_ARGS = ('target_dir', 'include_firefox', 'warm_profile', 'cache_dir', 'reproducible')
+
+
+def main(argv=None):
+    parser = _create_parser()
+    argv = sys.argv[1:] if argv is None else argv
+    # Use options from the config file as defaults
+    pre_args, _ = parser.parse_known_args(argv)
+    config = {}
+    if getattr(pre_args, 'config', None):
+        with open(pre_args.config, 'rb') as f:
+            config = json.loads(f.read().decode())
+        pre_args.parser.set_defaults(**{k: v for k, v in config.items() if k != 'builds'})
+    args = parser.parse_args(argv)
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        return 1
+    return args.func(args, config)
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(prog='firetron', description='Create and run '
+                                     'desktop apps that use Firefox as a runtime.')
+    subparsers = parser.add_subparsers(title='commands')
+
+    # Build
+    p = subparsers.add_parser('build', help='create a distributable app')
+    p.set_defaults(func=cmd_build, parser=p)
+    p.add_argument('target_dir', nargs='?', help='the directory to create the app in')
+    p.add_argument('name', nargs='?', help='the name of the app (and executable)')
+    p.add_argument('app', nargs='?', help='a URL or a directory with static assets')
+    p.add_argument('--config', help='a JSON file with (more) options and builds')
+    p.add_argument('--title', help='the window title (default the name)')
+    p.add_argument('--icon', help='an icon file (png, ico or bmp)')
+    p.add_argument('--include-firefox', nargs='?', const=True, default=False, metavar='DIR',
+                   help='include the Firefox runtime (the installed one, or from DIR)')
+    p.add_argument('--preset', choices=list(PRESETS), default='none',
+                   help='compression preset for the app content (default none)')
+    p.add_argument('--jar', action='store_true', default=None,
+                   help='pack the app content in a jar (overrides the preset)')
+    p.add_argument('--minify', action='store_true', default=None,
+                   help='minify the static assets (overrides the preset)')
+    p.add_argument('--warm-profile', action='store_true',
+                   help='pre-warm the profile template by starting Firefox once')
+    p.add_argument('--memory-profile', default='default',
+                   help='the memory profile: default, lean or minimal')
+    p.add_argument('--server', help='the command line of the server (a Python script is frozen along)')
+    p.add_argument('--server-timeout', type=float, default=10,
+                   help='seconds to wait for the server to be ready (default 10)')
+    p.add_argument('--single-instance', action='store_true',
+                   help='open new windows in the running instance')
+    p.add_argument('--bridge', action='store_true',
+                   help='let the server exchange messages with the app (firetron.Bridge)')
+    p.add_argument('--incremental', action='store_true',
+                   help='update an existing build in place')
+    p.add_argument('--cache-dir', help='a directory to keep PyInstaller work files in')
+    p.add_argument('--reproducible', action='store_true', default=None,
+                   help='fix timestamps for a reproducible build (default if '
+                   'SOURCE_DATE_EPOCH is set)')
+    p.add_argument('--bundle', action='store_true',
+                   help='build the apps in the config as one bundle in target_dir, '
+                   'sharing one frozen runtime')
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                   help='the number of builds to run in parallel (default 1)')
+    p.add_argument('--timing-report', metavar='FILE',
+                   help='write the duration of each build stage to a JSON file')
+
+    # Launch
+    p = subparsers.add_parser('launch', help='launch an app for development')
+    p.set_defaults(func=cmd_launch, parser=p)
+    p.add_argument('app', help='a URL or a directory with static assets')
+    p.add_argument('--config', help='a JSON file with (more) options')
+    p.add_argument('--title', help='the window title')
+    p.add_argument('--size', default='640x480', help='the window size (default 640x480)')
+    p.add_argument('--pos', help='the window position, e.g. 100x100')
+    p.add_argument('--windowmode', default='normal',
+                   help='normal, maximized, fullscreen or kiosk')
+    p.add_argument('--icon', help='an icon file (png, ico or bmp)')
+    p.add_argument('--exe', help='the runtime executable (default the installed Firefox)')
+    p.add_argument('--watch', help='reload when files in this directory change')
+    p.add_argument('--headless', action='store_true', help='run without a display')
+    p.add_argument('--timing', action='store_true', help='report the startup timing')
+
+    # Icon
+    p = subparsers.add_parser('icon', help='convert icon files')
+    p.set_defaults(func=cmd_icon, parser=p)
+    p.add_argument('sources', nargs='+', help='image files (png, ico or bmp) to combine')
+    p.add_argument('-o', '--output', required=True,
+                   help='the file to write (ico, icns, png or bmp)')
+
+    # Patch
+    p = subparsers.add_parser('patch', help='create an update patch between two builds')
+    p.set_defaults(func=cmd_patch, parser=p)
+    p.add_argument('old_dir', help='the build of the previous version')
+    p.add_argument('new_dir', help='the build of the new version')
+    p.add_argument('-o', '--output', required=True, help='the patch file to write')
+
+    p = subparsers.add_parser('apply-patch', help='apply an update patch to a build')
+    p.set_defaults(func=cmd_apply_patch, parser=p)
+    p.add_argument('patch', help='the patch file')
+    p.add_argument('target_dir', help='the build to update')
+
+    # Bench
+    p = subparsers.add_parser('bench', help='run a benchmark')
+    p.set_defaults(func=cmd_bench, parser=p)
+    p.add_argument('what', choices=['launch', 'memory', 'codecs', 'build'],
+                   help='what to benchmark')
+    p.add_argument('--config', help='a JSON file with (more) options')
+    p.add_argument('-n', type=int, default=3, help='the number of runs (default 3)')
+    p.add_argument('-j', '--jobs', type=int, default=4,
+                   help='the number of parallel builds (default 4)')
+    p.add_argument('--url', default='about:blank', help='the URL to load')
+    p.add_argument('--exe', help='the runtime executable (default the installed Firefox)')
+    p.add_argument('--fake', action='store_true', help='use a fake runtime')
+    p.add_argument('--sizes', help='comma separated image sizes for the codecs bench')
+    p.add_argument('--baseline', help='a baseline file to check the codecs bench against')
+    p.add_argument('--save-baseline', help='write the codecs bench result as a baseline')
+    p.add_argument('--check-throughput', action='store_true',
+                   help='also check throughput against the baseline, relative to the '
+                   'speed of this machine')
+    p.add_argument('--report', metavar='FILE', help='write the result to a JSON file')
+
+    return parser
+
+
+def cmd_build(args, config):
+    common = {k: v for k, v in vars(args).items() if k not in ('func', 'parser', 'config')}
+    builds = [dict(common, **build) for build in config.get('builds', [{}])]
+    for build in builds:
+        for key in ('target_dir', 'name', 'app'):
+            if not build.get(key):
+                args.parser.error('build needs a %s (as argument or in the config)' % key)
+
+    t0 = time.perf_counter()
+    report = OrderedDict()
+    jobs = max(1, min(args.jobs, len(builds)))
+    if args.bundle:
+        report['bundle'] = _build_bundle(builds)
+    elif jobs == 1:
+        for build in builds:
+            report[build['name']] = _build(build)
+    else:
+        # Processes instead of threads, because PyInstaller has global state
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = [executor.submit(_build, build) for build in builds]
+            for build, future in zip(builds, futures):
+                report[build['name']] = future.result()
+
+    # Report timing
+    print('===== Timing')
+    for name, stages in report.items():
+        items = ['%s %0.2f s' % item for item in stages.items()]
+        print('%s: %s (total %0.2f s)' % (name, ', '.join(items), sum(stages.values())))
+    report['wall'] = time.perf_counter() - t0
+    print('Done in %0.2f s' % report['wall'])
+    if args.timing_report:
+        with open(args.timing_report, 'wb') as f:
+            f.write(json.dumps(report, indent=2).encode())
+    return 0
+
+
+def _build(build):
+    """ Run one build, given the options as a dict. Returns the stage timings.
+    """
+    return create_app(clean=not build.get('incremental'), **_create_app_kwargs(build))
+
+
+def _build_bundle(builds):
+    """ Build the apps of a bundle, given the options of each app as a
+    dict. The bundle options must be the same for all apps. Returns the
+    stage timings.
+    """
+    apps = [_create_app_kwargs(build) for build in builds]
+    shared = {k: v for k, v in apps[0].items() if k in BUNDLE_ARGS}
+    options = [dict({k: kwargs.get(k) for k in BUNDLE_ARGS},
+                    incremental=bool(build.get('incremental')))
+               for build, kwargs in zip(builds, apps)]
+    for build, opts in zip(builds[1:], options[1:]):
+        for key, value in opts.items():
+            if value != options[0][key]:
+                raise ValueError('All apps in a bundle must have the same %s, but %r has '
+                                 '%r instead of %r' % (key, build.get('name'), value,
+                                                       options[0][key]))
+    apps = [{k: v for k, v in kwargs.items() if k not in BUNDLE_ARGS} for kwargs in apps]
+    return create_apps(apps=apps, clean=not builds[0].get('incremental'), **shared)
+
+
+def _create_app_kwargs(build):
+    """ Get the keyword arguments for ``create_app()`` from build options.
+    """
+    kwargs = {k: v for k, v in build.items() if k in BUILD_ARGS}
+    for key, val in PRESETS[build.get('preset') or 'none'].items():
+        if kwargs.get(key) is None:
+            kwargs[key] = val
+    if kwargs.get('icon'):
+        icons = kwargs['icon']
+        kwargs['icon'] = Icon(*([icons] if isinstance(icons, str) else icons))
+    return kwargs
+
+
+def cmd_launch(args, config):
+    timing_file = None
+    if args.timing:
+        timing_file = os.path.join(tempfile.gettempdir(),
+                                   'firetron_timing_%i.json' % os.getpid())
+    size = tuple(int(x) for x in args.size.lower().split('x'))
+    pos = tuple(int(x) for x in args.pos.lower().split('x')) if args.pos else None
+    app = launch_app(args.app, title=args.title, size=size, pos=pos,
+                     windowmode=args.windowmode, icon=Icon(args.icon) if args.icon else None,
+                     exe=args.exe, watch=args.watch, timing_file=timing_file,
+                     headless=args.headless)
+    try:
+        if timing_file:
+            for key, val in read_startup_timing(timing_file).items():
+                print('%s: %0.1f ms' % (key, val))
+        while app.is_alive():
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.close()
+        if timing_file and os.path.isfile(timing_file):
+            os.remove(timing_file)
+    return 0
+
+
+def cmd_icon(args, config):
+    icon = Icon(*args.sources)
+    icon.write(args.output)
+    print('Wrote %s with sizes %s' % (args.output, ', '.join(map(str, icon.image_sizes()))))
+    return 0
+
+
+def cmd_patch(args, config):
+    create_patch(args.old_dir, args.new_dir, args.output)
+    print('Wrote %s (%i bytes)' % (args.output, os.path.getsize(args.output)))
+    return 0
+
+
+def cmd_apply_patch(args, config):
+    changed = apply_patch(args.patch, args.target_dir)
+    print('Updated %s: %i files changed' % (args.target_dir, len(changed)))
+    return 0
+
+
+def cmd_bench(args, config):
+    if args.what == 'launch':
+        result = _bench.bench_launch(args.n, args.url, args.exe, fake=args.fake)
+    elif args.what == 'memory':
+        result = _bench.bench_memory_profiles(args.url, args.exe)
+    elif args.what == 'build':
+        result = _bench.bench_create_app(args.n, args.jobs)
+    else:
+        sizes = _bench.VALID_SIZES
+        if args.sizes:
+            sizes = tuple(int(x) for x in args.sizes.split(','))
+        result = _bench.bench_codecs(sizes, args.n)
+        if args.save_baseline:
+            _bench.save_codec_baseline(result, args.save_baseline)
+        if args.baseline:
+            regressions = _bench.check_codec_baseline(result, args.baseline,
+                                                      args.check_throughput)
+            for regression in regressions:
+                print('Regression: ' + regression)
+            if regressions:
+                return 1
+    if args.report:
+        with open(args.report, 'wb') as f:
+            f.write(json.dumps(result, indent=2).encode())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,483 @@
+"""
+Benchmarks and measurement harnesses. These run against the locally
+installed Firefox, or against any runtime stand-in given as ``exe``.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import shutil
+import tempfile
+import importlib
+import contextlib
+import tracemalloc
+import concurrent.futures
+import subprocess
+from collections import OrderedDict
+
+from ._proc import get_tree_rss
+from ._findff import get_firefox_exe
+from ._createxul import create_xul_app, MEMORY_PREFS
+from ._launch import launch_app
+from ._timing import read_startup_timing
+from ._fakeruntime import create_fake_runtime
+from ._freeze import create_app
+from ._png import write_png, read_png, _png_scanline
+from ._icon import Icon, VALID_SIZES
+
+
+def bench_memory(app_dir, exe=None, instances=3, duration=5.0, interval=0.25):
+    """ Launch ``instances`` instances of the XUL app at ``app_dir`` side by
+    side, and sample the resident memory of each instance (the process
+    tree) during ``duration`` seconds. Returns a list with a dict per
+    instance, with fields "pid", "peak_rss" and "mean_rss" (in bytes).
+    """
+    exe = exe or get_firefox_exe()
+    tempdir = tempfile.mkdtemp(prefix='firetron_bench_')
+    procs, samples = [], []
+    try:
+        for i in range(instances):
+            profile_dir = os.path.join(tempdir, 'profile%i' % i)
+            os.mkdir(profile_dir)
+            cmd = [exe, '--app', os.path.join(app_dir, 'application.ini'),
+                   '-no-remote', '-profile', profile_dir]
+            procs.append(subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                                          stderr=subprocess.DEVNULL))
+            samples.append([])
+        etime = time.time() + duration
+        while time.time() < etime:
+            for p, s in zip(procs, samples):
+                if p.poll() is None:
+                    s.append(get_tree_rss(p.pid))
+            time.sleep(interval)
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+        for p in procs:
+            try:
+                p.wait(5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    results = []
+    for p, s in zip(procs, samples):
+        s = s or [0]
+        results.append(dict(pid=p.pid, peak_rss=max(s), mean_rss=sum(s) / len(s)))
+    return results
+
+
+def bench_memory_profiles(url='about:blank', exe=None, instances=3, duration=5.0):
+    """ Measure the resident memory per app instance for each memory
+    profile (see ``MEMORY_PREFS``). Returns a dict that maps the profile
+    name to the result of ``bench_memory()``.
+    """
+    tempdir = tempfile.mkdtemp(prefix='firetron_bench_')
+    results = {}
+    try:
+        for profile in MEMORY_PREFS:
+            app_dir = os.path.join(tempdir, profile)
+            create_xul_app(app_dir, 'bench', 'bench_' + profile, url, '',
+                           memory_profile=profile)
+            results[profile] = bench_memory(app_dir, exe, instances, duration)
+            mean = sum(r['mean_rss'] for r in results[profile]) / instances
+            print('%s: %0.1f MiB per instance' % (profile, mean / 2**20))
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+    return results
+
+
+def bench_launch(n=10, url='about:blank', exe=None, headless=True, pool=None, fake=False):
+    """ Launch an app ``n`` times in sequence, and measure the startup
+    breakdown (see ``read_startup_timing()``) and the time to close
+    the runtime. With ``fake``, a fake runtime is used, so that the launch
+    path can be measured without Firefox or a display. Returns a dict that
+    maps each phase to the mean duration in ms.
+    """
+    tempdir = tempfile.mkdtemp(prefix='firetron_bench_')
+    results = []
+    try:
+        if fake:
+            exe = create_fake_runtime(os.path.join(tempdir, 'fakeruntime'))
+        for i in range(n):
+            timing_file = os.path.join(tempdir, 'timing%i.json' % i)
+            t0 = time.perf_counter()
+            app = launch_app(url, exe=exe, timing_file=timing_file, pool=pool,
+                             headless=headless)
+            t1 = time.perf_counter()
+            try:
+                timing = read_startup_timing(timing_file)
+            finally:
+                t2 = time.perf_counter()
+                app.close()
+                t3 = time.perf_counter()
+            timing['launch_call'] = (t1 - t0) * 1000
+            timing['close'] = (t3 - t2) * 1000
+            results.append(timing)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    summary = OrderedDict()
+    for timing in results:
+        for key in timing:
+            summary[key] = summary.get(key, 0) + timing[key] / len(results)
+    for key, val in summary.items():
+        print('%s: %0.1f ms' % (key, val))
+    return summary
+
+
+PNG_FILTERS = 'none', 'sub', 'up', 'average', 'paeth'
+
+# Allowed ratio to the baseline before a result counts as a regression
+CODEC_THRESHOLDS = dict(mbps=0.8, peak_mem=1.25, size=1.0)
+
+# The codecs bench case that measures the speed of the machine
+CALIBRATION_CASE = 'calibration'
+
+
+def bench_codecs(sizes=VALID_SIZES, repeat=3):
+    """ Measure the pure-Python image codecs on synthetic RGB and RGBA
+    images of the given sizes: ``write_png()``, ``read_png()`` and
+    ``_png_scanline()`` for each PNG filter type, and ``Icon`` to/from
+    ICO, ICNS and BMP. Returns a dict that maps each case (e.g.
+    "read_png/rgba/256/paeth") to a dict with "mbps" (throughput of raw
+    pixel data, best of ``repeat``), "peak_mem" (bytes, via tracemalloc)
+    and "size" (output size in bytes). The "calibration" case runs a fixed
+    pure-Python workload, to compare throughput across machines.
+    """
+    results = OrderedDict()
+
+    def run(name, func, nbytes):
+        results[name] = _measure_codec(func, nbytes, repeat)
+        r = results[name]
+        print('%s: %0.2f MB/s, %0.1f KiB peak, %i bytes' %
+              (name, r['mbps'], r['peak_mem'] / 1024, r['size']))
+
+    data = _synthetic_image(64, 4)
+    run(CALIBRATION_CASE, lambda: _calibration_work(data), len(data))
+
+    for size in sizes:
+        for channels, mode in ((3, 'rgb'), (4, 'rgba')):
+            im = _synthetic_image(size, channels)
+            shape = size, size, channels
+            run('write_png/%s/%i' % (mode, size),
+                lambda: write_png(im, shape), len(im))
+            for filter_type, filter_name in enumerate(PNG_FILTERS):
+                png = _filtered_png(im, shape, filter_type)
+                run('read_png/%s/%i/%s' % (mode, size, filter_name),
+                    lambda: read_png(png)[0], len(im))
+                stride = size * channels + 1
+                raw = zlib.decompress(_png_idat(png))
+                lines = [raw[i*stride:(i+1)*stride] for i in range(size)]
+                run('png_scanline/%s/%i/%s' % (mode, size, filter_name),
+                    lambda: _unfilter_lines(lines, channels), len(im))
+
+    # Icons, from RGBA images. The names include the sizes in the container,
+    # so that runs with different sizes are not compared.
+    icon = Icon()
+    for size in sizes:
+        icon.add(bytes(_synthetic_image(size, 4)))
+    ico_sizes = [size for size in sorted(sizes) if size <= 256]
+    if ico_sizes:
+        ico = icon._to_ico()
+        nbytes = sum(size * size * 4 for size in ico_sizes)
+        suffix = '-'.join(map(str, ico_sizes))
+        run('ico/write/' + suffix, icon._to_ico, nbytes)
+        run('ico/read/' + suffix, lambda: Icon().from_bytes('.ico', ico), nbytes)
+    icns_sizes = [size for size in sorted(sizes) if size in (16, 32, 48, 128)]
+    if icns_sizes:
+        nbytes = sum(size * size * 4 for size in icns_sizes)
+        run('icns/write/' + '-'.join(map(str, icns_sizes)), icon._to_icns, nbytes)
+    for size in sizes:
+        im = icon._ims[size]
+        bmp = icon._to_bmp(im, file_header=True)
+        run('bmp/write/%i' % size, lambda: icon._to_bmp(im, file_header=True), len(im))
+        run('bmp/read/%i' % size, lambda: Icon()._from_bmp(bmp), len(im))
+
+    return results
+
+
+def save_codec_baseline(results, filename, thresholds=None):
+    """ Store the result of ``bench_codecs()`` as a baseline (a JSON file),
+    with the given regression thresholds (default ``CODEC_THRESHOLDS``).
+    """
+    baseline = OrderedDict(thresholds=thresholds or CODEC_THRESHOLDS, results=results)
+    with open(filename, 'wb') as f:
+        f.write(json.dumps(baseline, indent=2).encode())
+
+
+def check_codec_baseline(results, filename, check_throughput=False):
+    """ Compare the result of ``bench_codecs()`` to a baseline file. Returns
+    a list of messages, one per regression: peak memory or output size above
+    the baseline by more than the file's thresholds. Cases not present in
+    the baseline are ignored.
+
+    Throughput depends on the machine and its load, so it is only checked
+    if ``check_throughput`` is True. It is then compared relative to the
+    calibration case, i.e. a machine that is twice as fast is expected to
+    run each case twice as fast.
+    """
+    with open(filename, 'rb') as f:
+        baseline = json.loads(f.read().decode())
+    thresholds = baseline['thresholds']
+    speed = 1.0
+    if check_throughput:
+        if CALIBRATION_CASE not in results or CALIBRATION_CASE not in baseline['results']:
+            raise ValueError('Cannot check throughput without a calibration case')
+        speed = (results[CALIBRATION_CASE]['mbps'] /
+                 baseline['results'][CALIBRATION_CASE]['mbps'])
+    regressions = []
+    for name, base in baseline['results'].items():
+        r = results.get(name)
+        if r is None or name == CALIBRATION_CASE:
+            continue
+        if check_throughput and r['mbps'] < base['mbps'] * speed * thresholds['mbps']:
+            regressions.append('%s: %0.2f MB/s, baseline %0.2f MB/s (%0.2f MB/s at the '
+                               'speed of this machine)' %
+                               (name, r['mbps'], base['mbps'], base['mbps'] * speed))
+        if r['peak_mem'] > base['peak_mem'] * thresholds['peak_mem']:
+            regressions.append('%s: %i bytes peak memory, baseline %i' %
+                               (name, r['peak_mem'], base['peak_mem']))
+        if r['size'] > base['size'] * thresholds['size']:
+            regressions.append('%s: output of %i bytes, baseline %i' %
+                               (name, r['size'], base['size']))
+    return regressions
+
+
+def _measure_codec(func, nbytes, repeat):
+    """ Get throughput, peak memory and output size for one codec call.
+    Memory is measured in a separate run, because tracemalloc slows
+    things down.
+    """
+    best = float('inf')
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        out = func()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    size = len(out) if isinstance(out, (bytes, bytearray)) else 0
+    return dict(mbps=nbytes / max(best, 1e-9) / 1e6, peak_mem=peak, size=size)
+
+
+def _calibration_work(data):
+    """ A fixed pure-Python workload, similar to PNG filtering.
+    """
+    out = bytearray(len(data))
+    prev = 0
+    for i, b in enumerate(data):
+        prev = out[i] = (b + prev) & 0xff
+    return out
+
+
+def _synthetic_image(size, channels):
+    """ Create an image with gradients and some texture, so that the PNG
+    filters and compression have something realistic to work with.
+    """
+    im = bytearray(size * size * channels)
+    i = 0
+    for y in range(size):
+        for x in range(size):
+            texture = ((x * 7) ^ (y * 13)) & 0x1f
+            im[i] = (x * 255 // size + texture) & 0xff
+            im[i + 1] = (y * 255 // size) & 0xff
+            im[i + 2] = ((x + y) * 127 // size + texture) & 0xff
+            if channels == 4:
+                im[i + 3] = 255 if (x - size // 2) ** 2 + (y - size // 2) ** 2 < size * size // 4 else 0
+            i += channels
+    return im
+
+
+def _filtered_png(im, shape, filter_type):
+    """ Create a PNG in which all scanlines use the given filter type
+    (``write_png()`` only writes unfiltered scanlines).
+    """
+    h, w, channels = shape
+    stride = w * channels
+    prev = bytearray(stride)
+    lines = []
+    for y in range(h):
+        line = im[y*stride:(y+1)*stride]
+        out = bytearray(stride)
+        for i in range(stride):
+            a = line[i - channels] if i >= channels else 0
+            b = prev[i]
+            c = prev[i - channels] if i >= channels else 0
+            if filter_type == 0:
+                pred = 0
+            elif filter_type == 1:
+                pred = a
+            elif filter_type == 2:
+                pred = b
+            elif filter_type == 3:
+                pred = (a + b) >> 1
+            else:
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                pred = a if (pa <= pb and pa <= pc) else (b if pb <= pc else c)
+            out[i] = (line[i] - pred) & 0xff
+        lines.append(bytes([filter_type]) + bytes(out))
+        prev = line
+
+    def chunk(name, data):
+        crc = zlib.crc32(data, zlib.crc32(name)) & 0xffffffff
+        return struct.pack('>I', len(data)) + name + data + struct.pack('>I', crc)
+
+    ctyp = 6 if channels == 4 else 2
+    ihdr = struct.pack('>IIBBBBB', w, h, 8, ctyp, 0, 0, 0)
+    return (b'\x89PNG\x0d\x0a\x1a\x0a' + chunk(b'IHDR', ihdr) +
+            chunk(b'IDAT', zlib.compress(b''.join(lines), 9)) + chunk(b'IEND', b''))
+
+
+def _png_idat(png):
+    # Get the data of the (single) IDAT chunk
+    i = png.index(b'IDAT')
+    n = struct.unpack('>I', png[i-4:i])[0]
+    return png[i+4:i+4+n]
+
+
+def _unfilter_lines(lines, channels):
+    prev = bytearray(len(lines[0]) - 1)
+    out = bytearray()
+    for line in lines:
+        prev = _png_scanline(line, channels, prev)
+        out += prev
+    return out
+
+
+def bench_create_app(n=3, jobs=4, files=100, file_size=256 * 1024, include_firefox=True):
+    """ Measure ``create_app()`` end to end, without PyInstaller or Firefox:
+    a fake PyInstaller (see ``_fake_pyinstaller()``) produces an executable
+    with ``files`` libraries of ``file_size`` bytes, and (with
+    ``include_firefox``) a synthetic runtime of the same size is included.
+    Builds are done ``n`` times from scratch ("full"), ``n`` times in place
+    ("incremental"), and ``jobs`` at the same time ("parallel"). Returns a
+    dict that maps each scenario to a dict with the mean duration of each
+    stage in ms, plus "total" (and "wall" for the parallel builds).
+    """
+    tempdir = tempfile.mkdtemp(prefix='firetron_bench_')
+    results = OrderedDict()
+    try:
+        # Stand-ins for PyInstaller, the Firefox runtime and the app
+        runtime_dir = os.path.join(tempdir, 'runtime')
+        if include_firefox:
+            _create_synthetic_tree(runtime_dir, ['firefox'], files, file_size)
+        app_dir = os.path.join(tempdir, 'assets')
+        os.mkdir(app_dir)
+        with open(os.path.join(app_dir, 'index.html'), 'wb') as f:
+            f.write(b'<html><script src="app.js"></script><body>bench</body></html>')
+        with open(os.path.join(app_dir, 'app.js'), 'wb') as f:
+            f.write(b'console.log("bench");\n' * 1000)
+
+        def build(target_dir, clean=True):
+            return create_app(target_dir, 'bench', app_dir, clean=clean,
+                              include_firefox=include_firefox and runtime_dir)
+
+        # Silence the builds (once, not per build, since builds run in threads)
+        fake_dir = os.path.join(tempdir, 'fake')
+        with _fake_pyinstaller(fake_dir, files, file_size), \
+                contextlib.redirect_stdout(io.StringIO()):
+            results['full'] = _mean_stages(
+                [build(os.path.join(tempdir, 'full')) for i in range(n)])
+            results['incremental'] = _mean_stages(
+                [build(os.path.join(tempdir, 'full'), clean=False) for i in range(n)])
+            t0 = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+                futures = [executor.submit(build, os.path.join(tempdir, 'parallel%i' % i))
+                           for i in range(jobs)]
+                timings = [future.result() for future in futures]
+            results['parallel'] = _mean_stages(timings)
+            results['parallel']['wall'] = (time.perf_counter() - t0) * 1000
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    for scenario, summary in results.items():
+        print('%s: %s' % (scenario, ', '.join('%s %0.1f ms' % item for item in summary.items())))
+    return results
+
+
+def _mean_stages(timings):
+    """ Get the mean duration of each stage in ms from a list of the
+    results of ``create_app()``.
+    """
+    summary = OrderedDict()
+    for timing in timings:
+        for key, val in timing.items():
+            summary[key] = summary.get(key, 0) + val * 1000 / len(timings)
+    summary['total'] = sum(summary.values())
+    return summary
+
+
+def _create_synthetic_tree(path, exe_names, files, file_size, subdir=''):
+    """ Create a directory with executables and ``files`` files of
+    ``file_size`` bytes in ``subdir``, to stand in for a frozen app or
+    a runtime.
+    """
+    os.makedirs(os.path.join(path, subdir), exist_ok=True)
+    data = (b'firetron' * (file_size // 8 + 1))[:file_size]
+    for exe_name in exe_names:
+        with open(os.path.join(path, exe_name), 'wb') as f:
+            f.write(exe_name.encode() + data[:1024])
+    for i in range(files):
+        with open(os.path.join(path, subdir, 'lib%03i.so' % i), 'wb') as f:
+            f.write(data)
+
+
+class _FakePyInstaller(object):
+    """ Stand-in for PyInstaller, producing output in the same layout.
+    """
+
+    def __init__(self, files, file_size):
+        self._files = files
+        self._file_size = file_size
+
+    def run(self, args):
+        options = {}
+        for i, arg in enumerate(args[:-1]):
+            if arg.startswith('--'):
+                options[arg] = args[i + 1]
+        name = options['--name']
+        os.makedirs(options['--workpath'], exist_ok=True)
+        with open(os.path.join(options['--specpath'], name + '.spec'), 'wb') as f:
+            f.write(('# spec for %s\n' % args[0]).encode())
+        ext = '.exe' * sys.platform.startswith('win')
+        _create_synthetic_tree(os.path.join(options['--distpath'], name), [name + ext],
+                               self._files, self._file_size, '_internal')
+
+
+@contextlib.contextmanager
+def _fake_pyinstaller(path, files, file_size):
+    """ Context manager that puts a ``PyInstaller`` package that runs
+    ``_FakePyInstaller`` in ``path``, on the import path of this process and
+    of the PyInstaller subprocesses of ``create_app()``.
+    """
+    package_dir = os.path.join(path, 'PyInstaller')
+    os.makedirs(package_dir, exist_ok=True)
+    with open(os.path.join(package_dir, '__init__.py'), 'wb') as f:
+        f.write(b'')
+    with open(os.path.join(package_dir, '__main__.py'), 'wb') as f:
+        f.write(('import sys\nfrom firetron._bench import _FakePyInstaller\n'
+                 '_FakePyInstaller(%i, %i).run(sys.argv[1:])\n' % (files, file_size)).encode())
+    # The subprocess must be able to import firetron too
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pythonpath = os.environ.get('PYTHONPATH')
+    os.environ['PYTHONPATH'] = os.pathsep.join([path, root] + [pythonpath] * bool(pythonpath))
+    sys.path.insert(0, path)
+    importlib.invalidate_caches()
+    try:
+        yield
+    finally:
+        sys.path.remove(path)
+        if pythonpath is None:
+            os.environ.pop('PYTHONPATH', None)
+        else:
+            os.environ['PYTHONPATH'] = pythonpath
@@ -0,0 +1,214 @@
+"""
+A binary message bridge between a firetron app and its server process.
+The primary window of the app listens on a local socket, and passes the
+port and a token to the server process via the environment (see
+``firetron_bridge`` in main.js); the server connects with ``Bridge()``.
+
+Each frame is a 4-byte big-endian length (of the rest of the frame), a
+kind byte, and the payload. Messages are bytes (sent as is) or json
+serializable objects. Messages that are sent while a write is in progress
+are written together, so that bursts of small messages need few system
+calls. Both sides apply backpressure: ``send()`` blocks while too much
+data is waiting to be written, and the socket is not read while too many
+received messages are waiting to be handled.
+"""
+
+import os
+import json
+import queue
+import socket
+import struct
+import threading
+
+BRIDGE_PORT_ENV = 'FIRETRON_BRIDGE_PORT'
+BRIDGE_TOKEN_ENV = 'FIRETRON_BRIDGE_TOKEN'
+
+KIND_BINARY, KIND_JSON, KIND_TOKEN = 0, 1, 2
+
+HEADER = struct.Struct('>IB')
+MAX_FRAME_SIZE = 2**30
+
+_CLOSED = object()
+
+
+class Bridge(object):
+    """ Connect to the bridge of the app that started this process. The
+    ``port`` and ``token`` are read from the environment if not given.
+
+    Received messages are passed to ``callback`` (in a background thread)
+    if given, and are otherwise available via ``recv()``. At most
+    ``max_queue`` received messages are kept; after that, the app is not
+    read until ``recv()`` is called. ``send()`` blocks while more than
+    ``max_buffer`` bytes are waiting to be written.
+    """
+
+    def __init__(self, port=None, token=None, callback=None, max_buffer=4 * 2**20,
+                 max_queue=1000, timeout=10):
+        if port is None:
+            port = os.getenv(BRIDGE_PORT_ENV)
+        if token is None:
+            token = os.getenv(BRIDGE_TOKEN_ENV, '')
+        if not port:
+            raise RuntimeError('No bridge to connect to: %s is not set (the app must '
+                               'be created with bridge=True)' % BRIDGE_PORT_ENV)
+        self._port = int(port)
+        self._sock = socket.create_connection(('127.0.0.1', self._port), timeout)
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._callback = callback
+        self._max_buffer = max_buffer
+        self._inbox = queue.Queue(max_queue)
+        self._cond = threading.Condition()
+        self._frames = []  # frames waiting for the writer thread
+        self._unwritten = 0  # bytes not yet written, including the current write
+        self._closed = False
+        self._queue_frame(_frame(KIND_TOKEN, token.encode()))
+        self._threads = [threading.Thread(target=self._write_loop),
+                         threading.Thread(target=self._read_loop)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __repr__(self):
+        return '<Bridge on port %i at 0x%x>' % (self._port, id(self))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            message = self.recv()
+            if message is None:
+                return
+            yield message
+
+    @property
+    def closed(self):
+        """ Whether the bridge is closed (by either side).
+        """
+        return self._closed
+
+    @property
+    def buffered_amount(self):
+        """ The number of bytes that are waiting to be written.
+        """
+        return self._unwritten
+
+    def send(self, message):
+        """ Send a message (bytes, or a json serializable object) to the
+        app. Blocks while the write buffer is full.
+        """
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            frame = _frame(KIND_BINARY, bytes(message))
+        else:
+            frame = _frame(KIND_JSON, json.dumps(message, separators=(',', ':')).encode())
+        self._queue_frame(frame)
+
+    def flush(self, timeout=None):
+        """ Wait until all sent messages have been written. Returns False
+        on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._unwritten or self._closed, timeout)
+
+    def recv(self, timeout=None):
+        """ Get the next received message. Returns None on timeout, or if
+        the bridge is closed and all messages have been received.
+        """
+        try:
+            message = self._inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if message is _CLOSED:
+            self._inbox.put(_CLOSED)  # for the next call
+            return None
+        return message
+
+    def close(self, timeout=1.0):
+        """ Write pending messages (waiting at most ``timeout`` seconds),
+        and close the connection.
+        """
+        self.flush(timeout)
+        self._shutdown()
+
+    def _queue_frame(self, frame):
+        with self._cond:
+            self._cond.wait_for(lambda: self._unwritten < self._max_buffer or self._closed)
+            if self._closed:
+                raise RuntimeError('Cannot send: the bridge is closed')
+            self._frames.append(frame)
+            self._unwritten += len(frame)
+            self._cond.notify_all()
+
+    def _shutdown(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._frames or self._closed)
+                if self._closed:
+                    return
+                # Write all pending frames in one go
+                frames, self._frames = self._frames, []
+            data = b''.join(frames)
+            try:
+                self._sock.sendall(data)
+            except OSError:
+                self._shutdown()
+                return
+            with self._cond:
+                self._unwritten -= len(data)
+                self._cond.notify_all()
+
+    def _read_loop(self):
+        buffer = bytearray()
+        try:
+            while not self._closed:
+                data = self._sock.recv(2**16)
+                if not data:
+                    break
+                buffer += data
+                # Handle all complete frames in the buffer
+                pos = 0
+                while len(buffer) - pos >= 4:
+                    size = struct.unpack_from('>I', buffer, pos)[0]
+                    if not 1 <= size <= MAX_FRAME_SIZE:
+                        raise ValueError('Invalid bridge frame size %i' % size)
+                    if len(buffer) - pos - 4 < size:
+                        break
+                    kind = buffer[pos + 4]
+                    payload = bytes(buffer[pos + 5:pos + 4 + size])
+                    pos += 4 + size
+                    if kind == KIND_JSON:
+                        self._handle(json.loads(payload.decode()))
+                    elif kind == KIND_BINARY:
+                        self._handle(payload)
+                del buffer[:pos]
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._shutdown()
+            self._inbox.put(_CLOSED)
+
+    def _handle(self, message):
+        if self._callback is not None:
+            self._callback(message)
+        else:
+            self._inbox.put(message)  # blocks when full, so we stop reading
+
+
+def _frame(kind, payload):
+    return HEADER.pack(len(payload) + 1, kind) + payload
@@ -1,21 +1,28 @@
 """
-This module provides the ``create_lnk()`` function for writing Windows
-shortcuts (.lnk files).
+This module provides the ``create_lnk()`` and ``create_lnks()`` functions
+for writing Windows shortcuts (.lnk files), and ``read_lnk()`` and
+``lnk_matches()`` for reading and checking them (on any platform).
 
 This module is inspired by the pylnk module (from 2011) by Tim-Christian
 Mundt, and would not have been possible without it. The current module
-is written for Python3 and has better support for Unicode paths, but
-it only deals with writing (not reading) shortcut files.
+is written for Python3 and has better support for Unicode paths. The
+reader covers the header, the target id list and the string data, which
+is what the writer produces; other data (e.g. link info and extra data
+blocks) is skipped.
 """
 
 import os
 import re
+import ntpath
+import stat
 import time
 from io import BytesIO
-from struct import pack
-from datetime import datetime
+from struct import pack, unpack_from, error as struct_error
+from datetime import datetime, timezone
 from collections import OrderedDict
 
+from ._fileutils import get_source_date_epoch
+
 
 def create_lnk(
     path,
@@ -26,11 +33,14 @@ def create_lnk(
     comment=None,
     icon=None,
     run_mode=None,
+    timestamp=None,
+    cache=None,
 ):
     """ Create a .lnk file (i.e. a Windows shortcut).
     
     Arguments:
-        path (str): The path to the .lnk file to write.
+        path (str, file, None): The path to the .lnk file to write, or a
+            file object to write to. If None, the bytes are returned.
         target (str): The target file. Optional.
         arguments (str): The CLI arguments to call the target with. Optional.
         relative_path (str): The relative path to the target. Optional.
@@ -38,13 +48,26 @@ def create_lnk(
         comment (str): A descriptive comment for the shortcut. Optional.
         icon (str): The icon to use for the shortcut. Optional.
         run_mode (str): Must be "normal" (default), "maximized" or "minimized".
+        timestamp (float, datetime): If given, this time is used for all
+            timestamps in the file (instead of the current time and the
+            file times of the target path), so the output is reproducible.
+            Defaults to the SOURCE_DATE_EPOCH environment variable, if set.
+        cache (dict): A dict to memoize the encoding of the target's path
+            levels across calls (see ``create_lnks()``). Optional.
     """
 
-    if not isinstance(path, str) and path.endswith(".lnk"):
-        raise ValueError("Link path must be a string ending with .lnk")
+    if isinstance(path, str):
+        if not path.endswith(".lnk"):
+            raise ValueError("Link path must be a string ending with .lnk")
+    elif not (path is None or hasattr(path, "write")):
+        raise ValueError("Link path must be a str, file object, or None")
 
     # Set create, access, modify times
-    ctime = datetime.now()
+    if timestamp is None:
+        timestamp = get_source_date_epoch()
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+    ctime = datetime.now() if timestamp is None else timestamp
     atime = ctime
     mtime = ctime
 
@@ -79,35 +102,279 @@ def create_lnk(
     for pos, val in enumerate(flags.values()):
         flags_int = flags_int | (int(bool(val)) << pos)
 
+    f = BytesIO()
+    f.write(b"L\x00\x00\x00")
+    f.write(b"\x01\x14\x02")
+    f.write(b"\x00\x00\x00\x00\x00\xc0\x00\x00\x00\x00\x00\x00F")
+    f.write(pack("<I", flags_int))
+    f.write(pack("<I", 0))  # file attr flags (readonly, directory, etc.)
+    _write_windows_time(f, ctime)
+    _write_windows_time(f, atime)
+    _write_windows_time(f, mtime)
+    f.write(pack("<I", 0))  # file size - zero seems to work fine
+    f.write(pack("<I", 0))  # icon index
+    f.write(pack("<I", run_modes[run_mode]))
+    f.write(pack("<BB", 0, 0))  # stub hot key info (two bytes)
+    f.write(b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00")  # reserved
+    if target:
+        blob = _create_target_id_list(target, timestamp, cache)
+        f.write(pack("<H", len(blob)))
+        f.write(blob)
+    if flags["has_comment"]:
+        _write_str_w_size(f, comment, is_unicode)
+    if flags["has_relative_path"]:
+        _write_str_w_size(f, relative_path, is_unicode)
+    if flags["has_work_dir"]:
+        _write_str_w_size(f, work_dir, is_unicode)
+    if flags["has_arguments"]:
+        _write_str_w_size(f, arguments, is_unicode)
+    if flags["has_icon"]:
+        _write_str_w_size(f, icon, is_unicode)
+    f.write(b"\x00\x00\x00\x00")  # header_size
+
+    if path is None:
+        return f.getvalue()
+    elif isinstance(path, str):
+        with open(path, "wb") as file:
+            file.write(f.getvalue())
+    else:
+        path.write(f.getvalue())
+
+
+def create_lnks(items, timestamp=None, cache=None):
+    """ Create multiple .lnk files. Each item in ``items`` is a dict with
+    the arguments for ``create_lnk()``. The encoding of path levels (and
+    the stat calls that it needs) is shared between the shortcuts, which
+    makes this much faster when many shortcuts point into the same tree.
+    The ``timestamp`` is applied to all items that do not specify one.
+    Pass a dict as ``cache`` to also share the encoding between batches.
+    Returns a list with the result of each ``create_lnk()`` call.
+    """
+    cache = {} if cache is None else cache
+    results = []
+    for item in items:
+        kwargs = dict(item)
+        kwargs.setdefault("timestamp", timestamp)
+        kwargs["cache"] = cache
+        results.append(create_lnk(**kwargs))
+    return results
+
+
+def update_lnk(path, **kwargs):
+    """ Create a .lnk file like ``create_lnk()``, but only write it if its
+    contents changed (e.g. the target, arguments or icon), disregarding
+    the timestamps in the header. Returns whether the file was written.
+    """
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            old_data = f.read()
+        params = {k: v for k, v in kwargs.items() if k not in ("timestamp", "cache")}
+        try:
+            if lnk_matches(old_data, **params):
+                return False
+        except ValueError:
+            pass  # not a valid shortcut, overwrite it
+    data = create_lnk(None, **kwargs)
     with open(path, "wb") as f:
-        f.write(b"L\x00\x00\x00")
-        f.write(b"\x01\x14\x02")
-        f.write(b"\x00\x00\x00\x00\x00\xc0\x00\x00\x00\x00\x00\x00F")
-        f.write(pack("<I", flags_int))
-        f.write(pack("<I", 0))  # file attr flags (readonly, directory, etc.)
-        _write_windows_time(f, ctime)
-        _write_windows_time(f, atime)
-        _write_windows_time(f, mtime)
-        f.write(pack("<I", 0))  # file size - zero seems to work fine
-        f.write(pack("<I", 0))  # icon index
-        f.write(pack("<I", run_modes[run_mode]))
-        f.write(pack("<BB", 0, 0))  # stub hot key info (two bytes)
-        f.write(b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00")  # reserved
-        if target:
-            blob = _create_target_id_list(target)
-            f.write(pack("<H", len(blob)))
-            f.write(blob)
-        if flags["has_comment"]:
-            _write_str_w_size(f, comment, is_unicode)
-        if flags["has_relative_path"]:
-            _write_str_w_size(f, relative_path, is_unicode)
-        if flags["has_work_dir"]:
-            _write_str_w_size(f, work_dir, is_unicode)
-        if flags["has_arguments"]:
-            _write_str_w_size(f, arguments, is_unicode)
-        if flags["has_icon"]:
-            _write_str_w_size(f, icon, is_unicode)
-        f.write(b"\x00\x00\x00\x00")  # header_size
+        f.write(data)
+    return True
+
+
+FLAG_NAMES = (
+    "has_target",
+    "has_link_info",
+    "has_comment",
+    "has_relative_path",
+    "has_work_dir",
+    "has_arguments",
+    "has_icon",
+    "is_unicode",
+    "force_no_link_info",
+)
+
+STRING_NAMES = ("comment", "relative_path", "work_dir", "arguments", "icon")
+
+RUN_MODE_NAMES = {1: "normal", 3: "maximized", 7: "minimized"}
+
+LNK_HEADER = b"L\x00\x00\x00\x01\x14\x02\x00\x00\x00\x00\x00\xc0\x00\x00\x00\x00\x00\x00F"
+
+
+def read_lnk(data):
+    """ Read a .lnk file (i.e. a Windows shortcut).
+
+    Arguments:
+        data (str, bytes, memoryview): The filename of the shortcut, or
+            its contents.
+
+    Returns a dict with the fields "flags" (a dict of bools), "attributes",
+    "ctime", "atime", "mtime" (timestamps), "file_size", "icon_index",
+    "run_mode", "hotkey", "target" and "target_levels" (a list of dicts
+    with "type", "name" and "size"), and the strings "comment",
+    "relative_path", "work_dir", "arguments" and "icon" (None if absent).
+    Raises ValueError if the data is not a valid shortcut.
+    """
+    return dict(_iter_lnk(_get_view(data)))
+
+
+def lnk_matches(data, target=None, arguments=None, relative_path=None,
+                work_dir=None, comment=None, icon=None, run_mode=None):
+    """ Get whether the given .lnk file (a filename or bytes) matches the
+    given parameters (see ``create_lnk()``), disregarding timestamps and
+    file sizes. The shortcut is decoded lazily, and only up to the first
+    difference.
+    """
+    run_mode = (run_mode or "normal").lower()
+    expected = dict(run_mode=run_mode, comment=comment, work_dir=work_dir,
+                    relative_path=relative_path, arguments=arguments, icon=icon)
+    expected = {k: (v or None) for k, v in expected.items()}
+    if target:
+        expected["target_levels"] = _get_level_names(target)
+    else:
+        expected["target_levels"] = []
+    for key, val in _iter_lnk(_get_view(data)):
+        if key == "target_levels":
+            val = [level["name"] for level in val]
+        if key in expected and val != expected[key]:
+            return False
+    return True
+
+
+def _get_view(data):
+    if isinstance(data, str):
+        with open(data, "rb") as f:
+            data = f.read()
+    return memoryview(data).cast("B")
+
+
+def _iter_lnk(view):
+    """ Decode the shortcut, yielding (name, value) tuples in file order.
+    """
+    if len(view) < 76 or view[:20] != LNK_HEADER:
+        raise ValueError("Not a valid .lnk file")
+    try:
+        flags_int, attributes = unpack_from("<II", view, 20)
+        flags = {name: bool(flags_int & (1 << i)) for i, name in enumerate(FLAG_NAMES)}
+        yield "flags", flags
+        yield "attributes", attributes
+        for i, name in enumerate(("ctime", "atime", "mtime")):
+            yield name, _read_windows_time(view, 28 + i * 8)
+        file_size, icon_index, run_mode, hotkey = unpack_from("<IIIH", view, 52)
+        yield "file_size", file_size
+        yield "icon_index", icon_index
+        yield "run_mode", RUN_MODE_NAMES.get(run_mode, run_mode)
+        yield "hotkey", hotkey
+        pos = 76
+        # Target id list
+        levels = []
+        if flags["has_target"]:
+            size = unpack_from("<H", view, pos)[0]
+            levels = _read_target_id_list(view[pos + 2 : pos + 2 + size])
+            pos += 2 + size
+        yield "target_levels", levels
+        yield "target", _join_levels(levels)
+        # Link info (not written by create_lnk)
+        if flags["has_link_info"] and not flags["force_no_link_info"]:
+            pos += unpack_from("<I", view, pos)[0]
+        # String data
+        for name in STRING_NAMES:
+            val = None
+            if flags["has_" + name]:
+                n = unpack_from("<H", view, pos)[0]
+                nbytes = n * 2 if flags["is_unicode"] else n
+                raw = bytes(view[pos + 2 : pos + 2 + nbytes])
+                if len(raw) < nbytes:
+                    raise ValueError("Unexpected end of .lnk file")
+                val = raw.decode("utf-16-le" if flags["is_unicode"] else "cp1252")
+                pos += 2 + nbytes
+            yield name, val
+    except (struct_error, IndexError):
+        raise ValueError("Unexpected end of .lnk file")
+
+
+def _read_windows_time(view, pos):
+    x = unpack_from("<Q", view, pos)[0]
+    return x / 10000000 - 11644473600 if x else None
+
+
+def _read_target_id_list(view):
+    """ Decode the items in the target id list (the inverse of
+    ``_create_target_id_list()``).
+    """
+    levels = []
+    pos = 0
+    while pos + 2 <= len(view):
+        size = unpack_from("<H", view, pos)[0]
+        if size == 0:
+            break
+        elif size < 3 or pos + size > len(view):
+            raise ValueError("Invalid target id list in .lnk file")
+        item = view[pos + 2 : pos + size]
+        pos += size
+        code = item[0]
+        if code == 0x1F:
+            levels.append(dict(type="root", name="", size=0))
+        elif code == 0x2F:
+            name = bytes(item[1:]).split(b"\x00")[0].decode("cp1252")
+            levels.append(dict(type="drive", name=name, size=0))
+        elif code & 0x70 == 0x30:
+            levels.append(_read_path_level(item))
+        else:
+            levels.append(dict(type="unknown", name="", size=0))
+    return levels
+
+
+def _read_path_level(item):
+    """ Decode a file or folder item. The long name is taken from the
+    extension block if present, otherwise the short name is used.
+    """
+    code, size = item[0], unpack_from("<I", item, 2)[0]
+    entry_type = "folder" if code & 0x01 else "file"
+    if code & 0x04:  # Unicode short name
+        end = 12
+        while end + 1 < len(item) and item[end : end + 2] != b"\x00\x00":
+            end += 2
+        name = bytes(item[12:end]).decode("utf-16-le")
+    else:
+        raw = bytes(item[12:]).split(b"\x00")[0]
+        name = raw.decode("cp1252")
+    # The last two bytes are the offset of the extension block (counting
+    # the item's size field)
+    ext = unpack_from("<H", item, len(item) - 2)[0] - 2
+    if 0 < ext and ext + 8 <= len(item) and unpack_from("<H", item, ext + 6)[0] == 0xBEEF:
+        version = unpack_from("<H", item, ext + 2)[0]
+        start = ext + (20 if version < 7 else 46 if version < 8 else 50)
+        end = start
+        while end + 1 < len(item) - 2 and item[end : end + 2] != b"\x00\x00":
+            end += 2
+        if start < end:
+            name = bytes(item[start:end]).decode("utf-16-le")
+    return dict(type=entry_type, name=name, size=size)
+
+
+def _join_levels(levels):
+    names = [level["name"] for level in levels if level["type"] != "root"]
+    if not names:
+        return None
+    elif levels[0]["type"] in ("root", "drive"):
+        return names[0] + "\\".join(names[1:])
+    return "/".join(names) or "/"
+
+
+def _get_level_names(path):
+    """ Get the names of the path levels as they are stored in a shortcut.
+    """
+    # Windows paths can be checked on any platform
+    pathmodule = ntpath if re.match(r"\w:", path) else os.path
+    levels = [path]
+    while pathmodule.split(levels[0])[1]:
+        levels.insert(0, pathmodule.split(levels[0])[0])
+    names = []
+    if re.match(r"(\w)[:/\\]*$", levels[0].strip()):
+        names.append("")  # root
+        driveletter = levels.pop(0).strip().rstrip("/\\:")
+        names.append(driveletter + ":\\")
+    names.extend(pathmodule.basename(level) for level in levels)
+    return names
 
 
 def _get_path_levels(p):
@@ -118,17 +385,15 @@ def _get_path_levels(p):
     yield p
 
 
-def _create_target_id_list(fullpath):
+def _create_target_id_list(fullpath, timestamp=None, cache=None):
     """ Encodes the path, in a kinda super-verbose way.
     """
 
     levels = list(_get_path_levels(fullpath))
-    entry_codes = {"folder": 0x31, "file": 0x32}
-    entry_codes.update({"folder_uc": 0x35, "file_uc": 0x36})
     blobs = []
 
     # Absolute path?
-    drivedetector = re.compile("(\w)[:/\\\\]*$")
+    drivedetector = re.compile(r"(\w)[:/\\]*$")
     if drivedetector.match(levels[0].strip()):
         # Root
         blobs.append(b"\x1fP\xe0O\xd0 \xea:i\x10\xa2\xd8\x08\x00+00\x9d")
@@ -138,44 +403,13 @@ def _create_target_id_list(fullpath):
 
     # Process all levels
     for path in levels:
-        # Prepare
-        stats = os.stat(path)
-        entry_type = "folder" if os.path.isdir(path) else "file"
-        short_name = os.path.basename(path)
-        full_name = short_name  # whatever works
-        short_name_len = len(short_name) + 1
-        try:
-            short_name.encode("ascii")
-            short_name_unicode = False
-            short_name_len += short_name_len % 2  # padding
-        except UnicodeError:
-            short_name_unicode = True
-            short_name_len = short_name_len * 2
-            entry_type += "_uc"
-        # Write. Unsure what all this does, but it works! Thanks Tim-Christian!
-        out = BytesIO()
-        out.write(pack("<H", entry_codes[entry_type]))
-        out.write(pack("<I", stats.st_size))
-        _write_dos_time(out, datetime.fromtimestamp(stats.st_mtime))
-        out.write(pack("<H", 0x10))
-        if short_name_unicode:
-            out.write(short_name.encode("utf-16-le") + b"\x00\x00")
+        if cache is None:
+            blobs.append(_encode_path_level(path, timestamp))
         else:
-            val = short_name.encode("cp1252")
-            out.write(val + b"\x00")
-            if not len(val) % 2:
-                out.write(b"\x00")
-        out.write(pack("<H", 24 + 2 * len(short_name)))  # some indicator
-        out.write(pack("<H", 0x03))
-        out.write(pack("<H", 0x04))
-        out.write(pack("<H", 0xBEEF))
-        _write_dos_time(out, datetime.fromtimestamp(stats.st_ctime))
-        _write_dos_time(out, datetime.fromtimestamp(stats.st_atime))
-        out.write(pack("<H", 0x14))  # offset for Unicode
-        out.write(pack("<H", 0))  # signal that full name is written in Unicode
-        out.write(full_name.encode("utf-16-le") + b"\x00\x00")
-        out.write(pack("<H", 0x0E + short_name_len))  # some offset
-        blobs.append(out.getvalue())
+            key = path, timestamp
+            if key not in cache:
+                cache[key] = _encode_path_level(path, timestamp)
+            blobs.append(cache[key])
 
     # Compose all of it
     out = BytesIO()
@@ -186,14 +420,73 @@ def _create_target_id_list(fullpath):
     return out.getvalue()
 
 
+def _encode_path_level(path, timestamp=None):
+    """ Encode one level (a directory or file) of the target path.
+    """
+    entry_codes = {"folder": 0x31, "file": 0x32}
+    entry_codes.update({"folder_uc": 0x35, "file_uc": 0x36})
+
+    # Prepare
+    stats = os.stat(path)
+    entry_type = "folder" if stat.S_ISDIR(stats.st_mode) else "file"
+    if timestamp is None:
+        mtime = datetime.fromtimestamp(stats.st_mtime)
+        ctime = datetime.fromtimestamp(stats.st_ctime)
+        atime = datetime.fromtimestamp(stats.st_atime)
+    else:
+        mtime = ctime = atime = datetime.fromtimestamp(timestamp, timezone.utc)
+    short_name = os.path.basename(path)
+    full_name = short_name  # whatever works
+    short_name_len = len(short_name) + 1
+    try:
+        short_name.encode("ascii")
+        short_name_unicode = False
+        short_name_len += short_name_len % 2  # padding
+    except UnicodeError:
+        short_name_unicode = True
+        short_name_len = short_name_len * 2
+        entry_type += "_uc"
+    # Write. Unsure what all this does, but it works! Thanks Tim-Christian!
+    out = BytesIO()
+    out.write(pack("<H", entry_codes[entry_type]))
+    out.write(pack("<I", stats.st_size))
+    _write_dos_time(out, mtime)
+    out.write(pack("<H", 0x10))
+    if short_name_unicode:
+        out.write(short_name.encode("utf-16-le") + b"\x00\x00")
+    else:
+        val = short_name.encode("cp1252")
+        out.write(val + b"\x00")
+        if not len(val) % 2:
+            out.write(b"\x00")
+    out.write(pack("<H", 24 + 2 * len(short_name)))  # some indicator
+    out.write(pack("<H", 0x03))
+    out.write(pack("<H", 0x04))
+    out.write(pack("<H", 0xBEEF))
+    _write_dos_time(out, ctime)
+    _write_dos_time(out, atime)
+    out.write(pack("<H", 0x14))  # offset for Unicode
+    out.write(pack("<H", 0))  # signal that full name is written in Unicode
+    out.write(full_name.encode("utf-16-le") + b"\x00\x00")
+    out.write(pack("<H", 0x0E + short_name_len))  # some offset
+    return out.getvalue()
+
+
 def _write_windows_time(f, dt):
-    # Write a Windows time int from a datetime object
-    x = int((time.mktime(dt.timetuple()) + 11644473600) * 10000000)
+    # Write a Windows time int from a datetime object or a timestamp
+    if isinstance(dt, datetime):
+        dt = time.mktime(dt.timetuple())
+    x = int((dt + 11644473600) * 10000000)
     f.write(pack("<Q", x))
 
 
 def _write_dos_time(f, dt):
-    # Write a dos timestamp from a datetime object
+    # Write a dos timestamp from a datetime object. DOS times can only hold
+    # 1980-2107, so e.g. SOURCE_DATE_EPOCH=0 is clamped, as in zip files.
+    if dt.year < 1980:
+        dt = datetime(1980, 1, 1)
+    elif dt.year > 2107:
+        dt = datetime(2107, 12, 31, 23, 59, 58)
     date = 0
     date = _put_bits(dt.year - 1980, date, 0, 7)
     date = _put_bits(dt.month, date, 7, 4)
@@ -202,7 +495,7 @@ def _write_dos_time(f, dt):
     time = 0
     time = _put_bits(dt.hour, time, 0, 5)
     time = _put_bits(dt.minute, time, 5, 6)
-    time = _put_bits(dt.second, time, 11, 5)
+    time = _put_bits(dt.second // 2, time, 11, 5)  # 2-second resolution
     f.write(pack("<H", time))
 
 
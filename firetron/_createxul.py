@@ -1,15 +1,54 @@
-import os
-import sys
-import shutil
+import io
+import json
+import zipfile
+from collections import OrderedDict
+
+from ._static import bundle_assets
+from ._fileutils import write_tree
 
 packagename = "firetron"
 
 
-def create_xul_app(path, title, id, url, windowfeatures, windowmode="normal", icon=None):
+def create_xul_app(path, title, id, url, windowfeatures, windowmode="normal", icon=None,
+                   jar=False, assets=None, minify=False, memory_profile="default",
+                   server=None, server_timeout=10, single_instance=False, bridge=False):
     """ Create the files that determine the XUL app to launch.
+    
+    The files are first composed in memory; if the app at ``path`` already
+    exists, only the files that differ are written (see ``write_tree()``).
+    
+    If ``assets`` is given, it must be a directory with static html/js/css
+    assets, which are bundled in the app (see ``bundle_assets()``) and
+    served from chrome://. In this case ``url`` is the entry point relative
+    to the asset directory (default "index.html").
+    
+    If ``jar`` is True, the chrome content is packed in a single uncompressed
+    jar archive, so that Gecko needs to open fewer files at startup. Icons
+    and prefs are always written as plain files, because Gecko looks these
+    up on the file system.
+    
+    The ``memory_profile`` can be "default", "lean" or "minimal", to write
+    prefs that reduce the number of processes and cache sizes, so that
+    multiple apps can run side by side (see ``MEMORY_PREFS``).
+    
+    If ``server`` is given (a list of strings, in which "{appdir}" is
+    replaced with the directory of the app), it is started when the window
+    opens; a command without a path is looked up in the PATH. A splash is
+    shown until the server writes its port to the ready file (see
+    ``notify_ready()``), or ``server_timeout`` seconds pass. Any "{port}"
+    in the url is replaced with the reported port.
+    
+    If ``single_instance`` is True, launching the app while it is already
+    running opens a new window in the running runtime instead (see
+    ``send_to_instance()``).
+    
+    If ``bridge`` is True, the app listens for a connection from the server
+    process, to exchange messages with low latency (see ``Bridge``). The
+    bridge is available in the chrome as ``firetron_bridge``.
     """
     
     assert windowmode in ('normal', 'maximized', 'fullscreen', 'kiosk')
+    assert memory_profile in MEMORY_PREFS
     modemap = {'kiosk': 'fullscreen'}
     
     # Dict with all values that are injected in the file templates
@@ -31,43 +70,119 @@ def create_xul_app(path, title, id, url, windowfeatures, windowmode="normal", ic
                 
                 )
     
+    # Bundle static assets, if given
+    asset_files = {}
+    if assets is not None:
+        asset_files = bundle_assets(assets, minify)
+        url = url or 'index.html'
+        if url not in asset_files:
+            raise ValueError('Entry point %r not found in assets' % url)
+        D['url'] = 'chrome://{}/content/app/{}'.format(D['name'], url)
+    
+    # With a server, the browser is pointed at the url when the server is ready
+    config = dict(name=D['name'], url=D['url'], server=server, server_timeout=server_timeout,
+                  single_instance=single_instance, bridge=bridge)
+    D['deckindex'] = 0 if server else 1
+    D['browserurl'] = 'about:blank' if server else D['url']
+    
     # Fill in arguments in file contents
     manifest_link = 'manifest chrome/chrome.manifest'
-    manifest = 'content {name} content/'.format(**D)
+    if jar:
+        manifest = 'content {name} jar:{name}.jar!/content/'.format(**D)
+    else:
+        manifest = 'content {name} content/'.format(**D)
     application_ini = APPLICATION_INI.format(**D)
     main_xul = MAIN_XUL.format(**D)
     main_js = MAIN_JS  # No format (also problematic due to braces)
+    config_js = CONFIG_JS.format(config=json.dumps(config))
     prefs_js = PREFS_JS.format(**D)
-
-    # Clear
-    if os.path.isdir(path):
-        shutil.rmtree(path)
-
-    # Create directory structure
-    for subdir in ('',
-                    'chrome', 'chrome/content',
-                    'chrome/icons', 'chrome/icons/default',
-                    'defaults', 'defaults/preferences',
-                    ):
-        os.mkdir(os.path.join(path, subdir))
-
-    # Create files
+    if MEMORY_PREFS[memory_profile]:
+        prefs_js += '\n// Memory profile "{}"\n'.format(memory_profile)
+        for key, val in MEMORY_PREFS[memory_profile].items():
+            prefs_js += 'pref({}, {});\n'.format(json.dumps(key), json.dumps(val))
+    
+    # Collect the files (relative path -> bytes)
+    files = OrderedDict()
     for fname, text in [('chrome.manifest', manifest_link),
                         ('chrome/chrome.manifest', manifest),
                         ('application.ini', application_ini),
                         ('defaults/preferences/prefs.js', prefs_js),
-                        ('chrome/content/main.js', main_js),
-                        ('chrome/content/main.xul', main_xul),
                         ]:
-        with open(os.path.join(path, fname), 'wb') as f:
-            f.write(text.encode())
+        files[fname] = text.encode()
+    content = OrderedDict()
+    for fname, text in [('config.js', config_js),
+                        ('main.js', main_js),
+                        ('main.xul', main_xul),
+                        ]:
+        content[fname] = text.encode()
+    for fname, data in asset_files.items():
+        content['app/' + fname] = data
+    if jar:
+        files['chrome/{name}.jar'.format(**D)] = _create_jar(content, 'content/')
+    else:
+        for fname, data in content.items():
+            files['chrome/content/' + fname] = data
 
-    # Icon - use Icon class to write a png (Unix) and an ico (Windows)
+    # Icon - use Icon class to create a png (Unix) and an ico (Windows)
     if icon is not None:
-        icon_name = os.path.join(path, 'chrome/icons/default/' + D['windowid'])
-        icon.write(icon_name + '.ico')
-        icon.write(icon_name + '.icns')
-        icon.write(icon_name + '.png')
+        icon_name = 'chrome/icons/default/' + D['windowid']
+        files[icon_name + '.ico'] = icon._to_ico()
+        files[icon_name + '.icns'] = icon._to_icns()
+        for size in icon.image_sizes():
+            files['%s%i.png' % (icon_name, size)] = icon._to_png(icon._ims[size])
+    
+    # Write only what changed, and swap in the result atomically
+    write_tree(path, files)
+
+
+def _create_jar(files, prefix=''):
+    """ Pack the given files (dict name -> bytes) in a zip archive, and
+    return it as bytes. The files are stored without compression, so
+    Gecko can read them without inflating. A fixed timestamp and fixed
+    attributes are used, so that the same files produce the same jar on
+    any platform.
+    """
+    f = io.BytesIO()
+    with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED) as zf:
+        for fname, data in files.items():
+            info = zipfile.ZipInfo(prefix + fname, (1980, 1, 1, 0, 0, 0))
+            info.create_system = 0
+            info.external_attr = 0o644 << 16
+            zf.writestr(info, data)
+    return f.getvalue()
+
+
+# Prefs for each memory profile. Cache sizes are in KiB.
+MEMORY_PREFS = OrderedDict()
+MEMORY_PREFS["default"] = OrderedDict()
+MEMORY_PREFS["lean"] = OrderedDict([
+    ("dom.ipc.processCount", 1),
+    ("dom.ipc.processPrelaunch.enabled", False),
+    ("browser.cache.memory.capacity", 16384),
+    ("browser.cache.disk.capacity", 51200),
+    ("browser.sessionhistory.max_total_viewers", 0),
+    ("image.mem.surfacecache.max_size_kb", 131072),
+    ("media.memory_cache_max_size", 16384),
+    ("network.prefetch-next", False),
+])
+MEMORY_PREFS["minimal"] = OrderedDict([
+    ("dom.ipc.processCount", 1),
+    ("dom.ipc.processCount.webIsolated", 1),
+    ("fission.autostart", False),
+    ("dom.ipc.processPrelaunch.enabled", False),
+    ("browser.cache.memory.capacity", 4096),
+    ("browser.cache.disk.enable", False),
+    ("browser.sessionhistory.max_entries", 10),
+    ("browser.sessionhistory.max_total_viewers", 0),
+    ("image.mem.surfacecache.max_size_kb", 32768),
+    ("image.mem.discardable", True),
+    ("image.mem.animated.discardable", True),
+    ("media.memory_cache_max_size", 4096),
+    ("network.prefetch-next", False),
+    ("network.dns.disablePrefetch", True),
+    ("network.http.speculative-parallel-limit", 0),
+    ("javascript.options.mem.gc_incremental_slice_ms", 5),
+])
 
 
 ## ____________________ templates ____________________
@@ -104,45 +219,575 @@ MAIN_XUL = """
     sizemode="{sizemode}"
     onclose="quit();"
     >
+    <script type="application/javascript"
+            src="chrome://{name}/content/config.js" />
     <script type="application/javascript"
             src="chrome://{name}/content/main.js" />
-    <!-- content or content-primary ? -->
-    <browser src="{url}"
-             id="content"
-             type="content"
-             flex="1"
-             disablehistory="true" />
+    <deck id="deck" flex="1" selectedIndex="{deckindex}">
+        <!-- splash, shown while the server starts -->
+        <vbox id="splash" flex="1" align="center" pack="center">
+            <label id="splash-label" value="Starting {title} ..." />
+        </vbox>
+        <!-- content or content-primary ? -->
+        <browser src="{browserurl}"
+                 id="content"
+                 type="content"
+                 flex="1"
+                 disablehistory="true" />
+    </deck>
 </window>
 
 """.lstrip()
 
 
 MAIN_JS = """
+// ---------- Helpers
+
+var env = Components.classes["@mozilla.org/process/environment;1"]
+                    .getService(Components.interfaces.nsIEnvironment);
+
+function get_dir(key) {
+    return Components.classes["@mozilla.org/file/directory_service;1"]
+                     .getService(Components.interfaces.nsIProperties)
+                     .get(key, Components.interfaces.nsIFile);
+}
+
+function read_file(file) {
+    var stream = Components.classes["@mozilla.org/network/file-input-stream;1"]
+                           .createInstance(Components.interfaces.nsIFileInputStream);
+    stream.init(file, 0x01, 0, 0);
+    var sstream = Components.classes["@mozilla.org/scriptableinputstream;1"]
+                            .createInstance(Components.interfaces.nsIScriptableInputStream);
+    sstream.init(stream);
+    var text = sstream.read(sstream.available());
+    sstream.close();
+    stream.close();
+    return text;
+}
+
+function write_file(target, text) {
+    // Write to a temp file and rename, so that a reader never sees a partial file
+    var file = Components.classes["@mozilla.org/file/local;1"]
+                         .createInstance(Components.interfaces.nsIFile);
+    file.initWithPath(target.path + ".tmp");
+    var stream = Components.classes["@mozilla.org/network/file-output-stream;1"]
+                           .createInstance(Components.interfaces.nsIFileOutputStream);
+    stream.init(file, 0x02 | 0x08 | 0x20, 384, 0);  // write, create, truncate, 0600
+    stream.write(text, text.length);
+    stream.close();
+    if (target.exists()) { target.remove(false); }
+    file.moveTo(null, target.leafName);
+}
+
+function get_main_windows() {
+    // Get the other main windows of this app
+    var windows = [];
+    var e = Components.classes["@mozilla.org/appshell/window-mediator;1"]
+                      .getService(Components.interfaces.nsIWindowMediator)
+                      .getEnumerator("thisapp:main");
+    while (e.hasMoreElements()) {
+        var w = e.getNext();
+        if (w !== window) { windows.push(w); }
+    }
+    return windows;
+}
+
+
+// ---------- Startup timing
+
+// Startup timing marks, in ms since the epoch. These are written as json to
+// the file given by FIRETRON_TIMING_FILE (see firetron.read_startup_timing).
+var timing = {};
+var timing_written = false;
+
+function timing_now() {
+    if (window.performance && performance.timeOrigin) {
+        return performance.timeOrigin + performance.now();
+    }
+    return Date.now();
+}
+
+function timing_mark(name) {
+    if (timing[name] === undefined) { timing[name] = timing_now(); }
+    if (timing.content_paint !== undefined) { timing_write(); }
+}
+
+function timing_write() {
+    var filename = env.get("FIRETRON_TIMING_FILE");
+    if (!filename || timing_written) { return; }
+    timing_written = true;
+    // Add marks from the launcher and the runtime itself
+    if (env.get("FIRETRON_LAUNCH_TIME")) {
+        timing.launch = parseFloat(env.get("FIRETRON_LAUNCH_TIME"));
+    }
+    try {
+        var info = Components.classes["@mozilla.org/toolkit/app-startup;1"]
+                             .getService(Components.interfaces.nsIAppStartup)
+                             .getStartupInfo();
+        if (info.process) { timing.process = info.process.getTime(); }
+        if (info.main) { timing.main = info.main.getTime(); }
+    } catch (err) {}
+    var target = Components.classes["@mozilla.org/file/local;1"]
+                           .createInstance(Components.interfaces.nsIFile);
+    target.initWithPath(filename);
+    write_file(target, JSON.stringify(timing));
+}
+
+timing_mark("script");
+
+window.addEventListener("MozAfterPaint", function () {
+    timing_mark("first_paint");
+    if (timing.content_load !== undefined) { timing_mark("content_paint"); }
+}, false);
+
+
+// ---------- Server process
+
 // https://developer.mozilla.org/en-US/docs/Mozilla/Tech/XPCOM/Reference/Interface/nsIProcess
+var process = null;
+var server_error = null;
 
-// create an nsIFile for the executable
-var file = Components.classes["@mozilla.org/file/local;1"]
-                     .createInstance(Components.interfaces.nsIFile);
-file.initWithPath("c:\\\\pythons\\\\python37\\\\python.exe");
+function show_content(url) {
+    window.firetron_content_url = url;  // secondary windows load this too
+    document.getElementById("content").setAttribute("src", url);
+    document.getElementById("deck").selectedIndex = 1;
+}
+
+function show_splash_message(text) {
+    document.getElementById("splash-label").setAttribute("value", text);
+    document.getElementById("deck").selectedIndex = 0;
+}
 
-// Create an nsIProcess and run it
-// Note that it is *not* a subprocess of this process; if *this* process
-// terminates, the created process stays alive ...
-var process = Components.classes["@mozilla.org/process/util;1"]
-                        .createInstance(Components.interfaces.nsIProcess);
-process.init(file);
-var args = [];
-process.runwAsync(args, args.length);  // This function also allows observing the process from quitting
+function start_server() {
+    // The launcher tells us where the app is, otherwise assume the parent of the XUL dir
+    var appdir = env.get("FIRETRON_APPDIR") || get_dir("XCurProcD").parent.path;
+    var cmd = firetron_config.server.map(function (arg) { return arg.split("{appdir}").join(appdir); });
 
+    // The server writes its port to this file when it is ready (see firetron.notify_ready)
+    var ready_file = get_dir("TmpD");
+    ready_file.append("firetron_ready.txt");
+    ready_file.createUnique(Components.interfaces.nsIFile.NORMAL_FILE_TYPE, 384);  // 0600
+    ready_file.remove(false);
+    env.set("FIRETRON_READY_FILE", ready_file.path);
 
-// When *this* process exits ...
+    // Create an nsIProcess and run it
+    // Note that it is *not* a subprocess of this process; if *this* process
+    // terminates, the created process stays alive ...
+    try {
+        process = Components.classes["@mozilla.org/process/util;1"]
+                            .createInstance(Components.interfaces.nsIProcess);
+        process.init(find_executable(cmd[0]));
+        var args = cmd.slice(1);
+        var observer = {observe: function (subject, topic, data) {
+            server_error = "Server exited with code " + process.exitValue;
+        }};
+        process.runwAsync(args, args.length, observer);
+    } catch (err) {
+        show_splash_message("Could not start server " + cmd[0] + ": " + (err.message || err));
+        return;
+    }
+
+    wait_for_server(ready_file, Date.now() + 1000 * firetron_config.server_timeout);
+}
+
+function find_executable(name) {
+    // Like a shell: a name without a slash is looked up in the PATH, with
+    // the PATHEXT extensions on Windows
+    var file = Components.classes["@mozilla.org/file/local;1"]
+                         .createInstance(Components.interfaces.nsIFile);
+    if (/[\\\\/]/.test(name)) {
+        file.initWithPath(name);
+        if (!file.exists()) { throw new Error("file not found"); }
+        return file;
+    }
+    var windows = Components.classes["@mozilla.org/xre/app-info;1"]
+                            .getService(Components.interfaces.nsIXULRuntime).OS == "WINNT";
+    var exts = windows ? [""].concat((env.get("PATHEXT") || ".EXE").split(";")) : [""];
+    var dirs = env.get("PATH").split(windows ? ";" : ":");
+    for (var i = 0; i < dirs.length; i++) {
+        for (var j = 0; j < exts.length; j++) {
+            try {
+                file.initWithPath(dirs[i]);  // throws for empty and relative dirs
+            } catch (err) {
+                break;
+            }
+            file.append(name + exts[j]);
+            if (file.exists() && file.isFile() && (windows || file.isExecutable())) {
+                return file;
+            }
+        }
+    }
+    throw new Error("not found in PATH");
+}
+
+function wait_for_server(ready_file, deadline) {
+    if (ready_file.exists() && ready_file.fileSize > 0) {
+        var port = read_file(ready_file).trim();
+        ready_file.remove(false);
+        show_content(firetron_config.url.split("{port}").join(port));
+    } else if (server_error) {
+        show_splash_message(server_error);
+    } else if (Date.now() > deadline) {
+        show_splash_message("Server did not start within " + firetron_config.server_timeout + " s");
+    } else {
+        setTimeout(function () { wait_for_server(ready_file, deadline); }, 20);
+    }
+}
+
+
+// ---------- Bridge
+
+// The bridge is a binary message channel between the app and its server
+// process (see firetron.Bridge). The primary window listens on a local
+// socket, and passes the port and a token to the server via the environment.
+// Each frame is a 4-byte big-endian length (of the rest of the frame), a kind
+// byte, and the payload. Messages that are sent in the same tick are written
+// in one batch. Usage in the chrome: firetron_bridge.on("message", callback),
+// firetron_bridge.send(obj_or_bytes). Use pause() and resume() to stop reading
+// (the server then blocks when its buffer is full), and watch buffered_amount
+// and the "drain" event to avoid buffering too much data here.
+var BRIDGE_BINARY = 0, BRIDGE_JSON = 1, BRIDGE_TOKEN = 2;
+var firetron_bridge = null;
+
+function create_bridge() {
+    var Cc = Components.classes, Ci = Components.interfaces;
+    var thread = Cc["@mozilla.org/thread-manager;1"].getService(Ci.nsIThreadManager).mainThread;
+    var encoder = new TextEncoder(), decoder = new TextDecoder();
+    var bytes = window.crypto.getRandomValues(new Uint8Array(16));
+    var token = Array.prototype.map.call(bytes, function (b) { return (256 + b).toString(16).slice(1); }).join("");
+    var listeners = {message: [], connect: [], drain: [], close: []};
+    var socket = null, input = null, binput = null, output = null;
+    var verified = false, reading = false, writing = false, flush_scheduled = false;
+    var in_buffer = new Uint8Array(0), out_frames = [];
+
+    var bridge = {
+        connected: false,
+        paused: false,
+        buffered_amount: 0,  // bytes waiting to be written
+        on: function (type, callback) { listeners[type].push(callback); },
+        off: function (type, callback) {
+            listeners[type] = listeners[type].filter(function (c) { return c !== callback; });
+        },
+        send: function (message) {
+            var kind = BRIDGE_BINARY, payload;
+            if (message instanceof ArrayBuffer) {
+                payload = new Uint8Array(message);
+            } else if (ArrayBuffer.isView(message)) {
+                payload = new Uint8Array(message.buffer, message.byteOffset, message.byteLength);
+            } else {
+                kind = BRIDGE_JSON;
+                payload = encoder.encode(JSON.stringify(message));
+            }
+            var frame = new Uint8Array(5 + payload.length);
+            new DataView(frame.buffer).setUint32(0, payload.length + 1);
+            frame[4] = kind;
+            frame.set(payload, 5);
+            out_frames.push(frame);
+            bridge.buffered_amount += frame.length;
+            if (!flush_scheduled) {
+                flush_scheduled = true;
+                Promise.resolve().then(flush);  // after the current tick
+            }
+            return bridge.buffered_amount;
+        },
+        pause: function () { bridge.paused = true; },
+        resume: function () {
+            bridge.paused = false;
+            read_async();
+        },
+        close: function () {
+            // Close the connection and stop listening
+            disconnect();
+            socket.close();
+        }
+    };
+
+    function emit(type, arg) {
+        listeners[type].slice().forEach(function (callback) {
+            try { callback(arg); } catch (err) { Components.utils.reportError(err); }
+        });
+    }
+
+    function connect(transport) {
+        if (input) { transport.close(0); return; }  // one connection at a time
+        input = transport.openInputStream(0, 0, 0).QueryInterface(Ci.nsIAsyncInputStream);
+        output = transport.openOutputStream(0, 0, 0).QueryInterface(Ci.nsIAsyncOutputStream);
+        binput = Cc["@mozilla.org/binaryinputstream;1"].createInstance(Ci.nsIBinaryInputStream);
+        binput.setInputStream(input);
+        verified = false;
+        in_buffer = new Uint8Array(0);
+        read_async();
+    }
+
+    function disconnect() {
+        if (!input) { return; }
+        try { input.close(); } catch (err) {}
+        try { output.close(); } catch (err) {}
+        input = output = binput = null;
+        out_frames = [];
+        writing = reading = false;
+        bridge.buffered_amount = 0;
+        if (bridge.connected) {
+            bridge.connected = false;
+            emit("close");
+        }
+    }
+
+    function read_async() {
+        if (!input || reading || bridge.paused) { return; }
+        reading = true;
+        input.asyncWait({onInputStreamReady: on_readable}, 0, 0, thread);
+    }
+
+    function on_readable(stream) {
+        reading = false;
+        if (stream !== input) { return; }  // an old connection
+        var n = 0;
+        try { n = input.available(); } catch (err) { disconnect(); return; }  // closed
+        var chunk = new Uint8Array(binput.readByteArray(n));
+        var buffer = new Uint8Array(in_buffer.length + chunk.length);
+        buffer.set(in_buffer);
+        buffer.set(chunk, in_buffer.length);
+        // Handle all complete frames
+        var view = new DataView(buffer.buffer), pos = 0;
+        while (input && buffer.length - pos >= 4) {
+            var size = view.getUint32(pos);
+            if (size < 1 || (!verified && size > 1024)) { disconnect(); return; }
+            if (buffer.length - pos - 4 < size) { break; }
+            var kind = buffer[pos + 4], payload = buffer.subarray(pos + 5, pos + 4 + size);
+            pos += 4 + size;
+            if (!verified) {
+                if (kind !== BRIDGE_TOKEN || decoder.decode(payload) !== token) { disconnect(); return; }
+                verified = bridge.connected = true;
+                emit("connect");
+                flush();
+            } else if (kind === BRIDGE_JSON) {
+                emit("message", JSON.parse(decoder.decode(payload)));
+            } else if (kind === BRIDGE_BINARY) {
+                emit("message", payload.slice());
+            }
+        }
+        in_buffer = buffer.slice(pos);
+        read_async();
+    }
+
+    function flush() {
+        flush_scheduled = false;
+        if (!verified || writing || !out_frames.length) { return; }
+        // Write all pending frames in one batch; the copier waits for the socket
+        // to become writable, so a slow reader does not block the window
+        var size = 0;
+        out_frames.forEach(function (frame) { size += frame.length; });
+        var data = new Uint8Array(size), pos = 0;
+        out_frames.forEach(function (frame) { data.set(frame, pos); pos += frame.length; });
+        out_frames = [];
+        var source = Cc["@mozilla.org/io/arraybuffer-input-stream;1"]
+                       .createInstance(Ci.nsIArrayBufferInputStream);
+        source.setData(data.buffer, 0, size);
+        var copier = Cc["@mozilla.org/network/async-stream-copier;1"]
+                       .createInstance(Ci.nsIAsyncStreamCopier);
+        copier.init(source, output, thread, true, false, 65536, true, false);
+        var sink = output;
+        writing = true;
+        copier.asyncCopy({
+            onStartRequest: function (request) {},
+            onStopRequest: function (request, status) {
+                if (sink !== output) { return; }  // an old connection
+                writing = false;
+                if (!Components.isSuccessCode(status)) { disconnect(); return; }
+                bridge.buffered_amount -= size;
+                if (out_frames.length) {
+                    flush();
+                } else {
+                    emit("drain");
+                }
+            }
+        }, null);
+    }
+
+    socket = Cc["@mozilla.org/network/server-socket;1"].createInstance(Ci.nsIServerSocket);
+    socket.init(-1, true, 1);  // any port, loopback only
+    socket.asyncListen({
+        onSocketAccepted: function (server, transport) { connect(transport); },
+        onStopListening: function (server, status) {}
+    });
+    bridge.port = socket.port;
+    bridge.token = token;
+    return bridge;
+}
+
+function start_bridge() {
+    // Called before the server starts, so that it inherits the environment
+    firetron_bridge = create_bridge();
+    env.set("FIRETRON_BRIDGE_PORT", String(firetron_bridge.port));
+    env.set("FIRETRON_BRIDGE_TOKEN", firetron_bridge.token);
+}
+
+
+// ---------- Single instance
+
+// In single-instance mode, the primary window listens on a local socket, and
+// writes its port to a lock file in the profile dir. A second launch of the
+// app sends its arguments there (see firetron.send_to_instance), and we open
+// a new window in this process. The dev launcher uses this to reload content.
+var is_primary = false;
+var instance_socket = null;
+
+function get_lock_file() {
+    var file = get_dir("ProfD");
+    file.append("firetron-instance.json");
+    return file;
+}
+
+function start_instance_listener() {
+    var bytes = window.crypto.getRandomValues(new Uint8Array(16));
+    var token = Array.prototype.map.call(bytes, function (b) { return (256 + b).toString(16).slice(1); }).join("");
+    instance_socket = Components.classes["@mozilla.org/network/server-socket;1"]
+                                .createInstance(Components.interfaces.nsIServerSocket);
+    instance_socket.init(-1, true, -1);  // any port, loopback only
+    instance_socket.asyncListen({
+        onSocketAccepted: function (server, transport) { handle_instance_connection(transport, token); },
+        onStopListening: function (server, status) {}
+    });
+    var pid = Components.classes["@mozilla.org/xre/app-info;1"]
+                        .getService(Components.interfaces.nsIXULRuntime).processID;
+    write_file(get_lock_file(), JSON.stringify({pid: pid, port: instance_socket.port, token: token}));
+}
+
+function stop_instance_listener() {
+    if (!instance_socket) { return; }
+    instance_socket.close();
+    instance_socket = null;
+    var file = get_lock_file();
+    if (file.exists()) { file.remove(false); }
+}
+
+function handle_instance_connection(transport, token) {
+    // Read a line of json, handle it, and write a line back
+    var input = transport.openInputStream(0, 0, 0);
+    var output = transport.openOutputStream(1, 0, 0);  // blocking
+    var sinput = Components.classes["@mozilla.org/scriptableinputstream;1"]
+                           .createInstance(Components.interfaces.nsIScriptableInputStream);
+    sinput.init(input);
+    var text = "";
+    var thread = Components.classes["@mozilla.org/thread-manager;1"]
+                           .getService(Components.interfaces.nsIThreadManager).mainThread;
+    var callback = {onInputStreamReady: function (stream) {
+        var n = 0;
+        try { n = sinput.available(); } catch (err) {}  // closed
+        text += sinput.read(n);
+        var i = text.indexOf("\\n");
+        if (i >= 0 || n == 0) {
+            var line = i >= 0 ? text.slice(0, i) : text;
+            var reply = handle_instance_message(line, token) + "\\n";
+            try { output.write(reply, reply.length); } catch (err) {}
+            output.close();
+            input.close();
+        } else {
+            input.asyncWait(callback, 0, 0, thread);
+        }
+    }};
+    input.QueryInterface(Components.interfaces.nsIAsyncInputStream);
+    input.asyncWait(callback, 0, 0, thread);
+}
+
+function handle_instance_message(line, token) {
+    var msg;
+    try { msg = JSON.parse(line); } catch (err) { return "error: invalid message"; }
+    if (msg.token !== token) { return "error: invalid token"; }
+    if (msg.command == "open") {
+        window.openDialog("chrome://" + firetron_config.name + "/content/main.xul",
+                          "_blank", "chrome,all,dialog=no", msg.args || []);
+        return "ok";
+    } else if (msg.command == "reload") {
+        // Reload the content in place, e.g. for hot reloading during development
+        get_main_windows().concat([window]).forEach(function (w) {
+            var flags = Components.interfaces.nsIWebNavigation.LOAD_FLAGS_BYPASS_CACHE;
+            w.document.getElementById("content").reloadWithFlags(flags);
+        });
+        return "ok";
+    }
+    return "error: unknown command " + msg.command;
+}
+
+function become_primary(proc, bridge) {
+    // Called by the primary window when it closes
+    is_primary = true;
+    process = proc;
+    firetron_bridge = bridge;
+    if (firetron_config.single_instance) { start_instance_listener(); }
+}
+
+function wait_for_primary(primary) {
+    // A secondary window shares the runtime, server and bridge of the primary window
+    firetron_bridge = primary.firetron_bridge;
+    if (primary.firetron_content_url) {
+        show_content(primary.firetron_content_url);
+    } else {
+        setTimeout(function () { wait_for_primary(primary); }, 20);
+    }
+}
+
+
+// ---------- Init and exit
+
+window.addEventListener("load", function () {
+    timing_mark("window_load");
+    var browser = document.getElementById("content");
+    browser.addEventListener("load", function (event) {
+        var doc = event.originalTarget;
+        if (doc && doc.URL && doc.URL != "about:blank") { timing_mark("content_load"); }
+    }, true);
+
+    var others = get_main_windows();
+    window.firetron_args = window.arguments ? window.arguments[0] : [];
+    if (others.length) {
+        wait_for_primary(others[0]);
+        return;
+    }
+    is_primary = true;
+    if (firetron_config.single_instance) { start_instance_listener(); }
+    if (firetron_config.bridge) { start_bridge(); }
+    if (firetron_config.server) {
+        start_server();
+    } else {
+        window.firetron_content_url = firetron_config.url;
+    }
+    // When pre-warming a profile, quit gracefully, so that caches are written
+    if (env.get("FIRETRON_WARMUP")) {
+        setTimeout(function () {
+            Components.classes["@mozilla.org/toolkit/app-startup;1"]
+                      .getService(Components.interfaces.nsIAppStartup)
+                      .quit(Components.interfaces.nsIAppStartup.eAttemptQuit);
+        }, 1000);
+    }
+}, false);
+
+
+// When *this* window closes ...
 function quit() {
-    if (process.isRunning) { process.kill(); }
+    if (!is_primary) { return; }
+    stop_instance_listener();
+    var others = get_main_windows();
+    if (others.length) {
+        others[0].become_primary(process, firetron_bridge);
+        return;
+    }
+    if (firetron_bridge) { firetron_bridge.close(); }
+    if (process && process.isRunning) {
+        process.kill();
+    }
 }
 
 """.lstrip()
 
 
+CONFIG_JS = """
+// Generated by firetron, used by main.js
+var firetron_config = {config};
+""".lstrip()
+
+
 PREFS_JS = """
 // This tells xulrunner what xul file to use
 pref("toolkit.defaultChromeURI", "chrome://{name}/content/main.xul");
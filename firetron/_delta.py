@@ -0,0 +1,274 @@
+"""
+Binary delta updates between two versions of an app bundle (the output
+of ``create_app()``). A patch is a zip file with a JSON manifest, the
+data of new files (each unique content stored once), and block-based
+deltas for changed files.
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import shutil
+import struct
+import hashlib
+import zipfile
+import itertools
+from collections import OrderedDict
+
+from ._fileutils import list_files, file_hash, hash_tree, swap_dirs, _link_or_copy
+
+PATCH_MANIFEST_NAME = 'patch.json'
+
+# Block size for matching data of the old file in the new file
+BLOCK_SIZE = 64
+
+# The number of positions to scan at a time for candidate blocks (the
+# window grows from the minimum, because the next match is often close)
+SCAN_WINDOW = 2**8, 2**16
+
+
+def create_patch(old_dir, new_dir, patch_file=None):
+    """ Create a patch that turns the directory ``old_dir`` into
+    ``new_dir``. Files that are also present in the old version (at any
+    path) are not stored; changed files are stored as a binary delta if
+    that is smaller. The patch is written to ``patch_file`` (a filename)
+    or returned as bytes if that is None.
+    """
+    old_hashes = hash_tree(old_dir)
+    by_hash = {}
+    for fname, sha in old_hashes.items():
+        by_hash.setdefault(sha, fname)
+
+    manifest = OrderedDict(version=1, old=old_hashes, files=OrderedDict())
+    f = io.BytesIO()
+    with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as zf:
+        stored = set()
+        for fname in list_files(new_dir):
+            filename = os.path.join(new_dir, fname)
+            with open(filename, 'rb') as fd:
+                data = fd.read()
+            sha = hashlib.sha256(data).hexdigest()
+            entry = OrderedDict(sha256=sha, mode=os.stat(filename).st_mode & 0o777)
+            if sha in by_hash:
+                # Same content in the old version (e.g. unchanged or moved)
+                entry['op'], entry['source'] = 'copy', by_hash[sha]
+            elif fname in old_hashes and sha not in stored:
+                with open(os.path.join(old_dir, fname), 'rb') as fd:
+                    delta = make_delta(fd.read(), data)
+                if len(delta) < len(data):
+                    entry['op'], entry['source'] = 'delta', fname
+                    zf.writestr('delta/' + fname, delta)
+                else:
+                    entry['op'] = 'data'
+            else:
+                entry['op'] = 'data'
+            if entry['op'] == 'data' and sha not in stored:
+                zf.writestr('data/' + sha, data)
+                stored.add(sha)
+            manifest['files'][fname] = entry
+        zf.writestr(PATCH_MANIFEST_NAME, json.dumps(manifest, indent=2))
+
+    if patch_file is None:
+        return f.getvalue()
+    with open(patch_file, 'wb') as fd:
+        fd.write(f.getvalue())
+
+
+def apply_patch(patch, path):
+    """ Apply a patch (a filename or bytes) to the directory at ``path``.
+    The files that the patch uses from the current version, and all
+    resulting files, are verified against the hashes in the patch. The new
+    version is created in a staging directory (hard-linking files that are
+    kept), and then swapped in, so that a failure never leaves a half
+    updated directory. Raises RuntimeError if the directory is not the
+    version that the patch was made for. Returns the sorted list of
+    relative paths that were added, changed, or removed.
+    """
+    path = os.path.abspath(path)
+    if isinstance(patch, str):
+        with open(patch, 'rb') as f:
+            patch = f.read()
+    zf = zipfile.ZipFile(io.BytesIO(patch))
+    manifest = json.loads(zf.read(PATCH_MANIFEST_NAME).decode())
+    if manifest.get('version') != 1:
+        raise RuntimeError('Unsupported patch version %r' % manifest.get('version'))
+    old_hashes = manifest['old']
+
+    # Check that all paths stay inside the directory, before touching anything
+    for fname, entry in manifest['files'].items():
+        _check_relpath(path, fname)
+        if entry['op'] in ('copy', 'delta'):
+            _check_relpath(path, entry.get('source', ''))
+
+    # Verify the sources used by the patch
+    verified = set()
+    for fname, entry in manifest['files'].items():
+        source = entry.get('source')
+        if source and source not in verified:
+            filename = os.path.join(path, source)
+            if not os.path.isfile(filename) or file_hash(filename) != old_hashes[source]:
+                raise RuntimeError('Cannot apply patch: %r does not match the '
+                                   'version that the patch was made for' % source)
+            verified.add(source)
+
+    # Render the new version into a staging directory
+    staging = '{}.{}.tmp'.format(path, os.getpid())
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    changed = sorted(set(old_hashes).difference(manifest['files']))
+    try:
+        for fname, entry in manifest['files'].items():
+            filename = os.path.join(staging, fname)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            if entry['op'] == 'copy':
+                _link_or_copy(os.path.join(path, entry['source']), filename)
+            else:
+                if entry['op'] == 'delta':
+                    with open(os.path.join(path, entry['source']), 'rb') as f:
+                        data = apply_delta(f.read(), zf.read('delta/' + fname))
+                else:
+                    data = zf.read('data/' + entry['sha256'])
+                if hashlib.sha256(data).hexdigest() != entry['sha256']:
+                    raise RuntimeError('Patch produced wrong content for %r' % fname)
+                with open(filename, 'wb') as f:
+                    f.write(data)
+                os.chmod(filename, entry['mode'])
+            if old_hashes.get(fname) != entry['sha256']:
+                changed.append(fname)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    # Swap
+    swap_dirs(staging, path)
+    return sorted(changed)
+
+
+def _check_relpath(root, fname):
+    """ Raise RuntimeError if a relative path from a patch is absolute or
+    would point outside of the directory ``root``.
+    """
+    parts = re.split(r'[/\\]', fname)
+    if (not fname or os.path.isabs(fname) or fname[0] in '/\\' or
+            re.match(r'^[a-zA-Z]:', fname) or '..' in parts):
+        raise RuntimeError('Invalid path in patch: %r' % fname)
+    root = os.path.realpath(root)
+    if not os.path.realpath(os.path.join(root, fname)).startswith(root + os.sep):
+        raise RuntimeError('Invalid path in patch: %r' % fname)
+
+
+def make_delta(old, new):
+    """ Create a binary delta (bytes) that turns ``old`` into ``new``. The
+    delta is a series of instructions: copy a range of the old data, or
+    insert literal data. Blocks of the old data are indexed by content, so
+    that moved and repeated data is found too (see ``_find_block()``).
+    """
+    old, new = bytes(old), bytes(new)
+    index = {}
+    for offset in range(0, len(old) - BLOCK_SIZE + 1, BLOCK_SIZE):
+        index.setdefault(old[offset:offset + BLOCK_SIZE], offset)
+    prefixes = set(int.from_bytes(block[:4], sys.byteorder) for block in index)
+    # The new data as 4-byte words, starting at each of the 4 phases
+    words = [memoryview(new)[k:k + (len(new) - k) // 4 * 4].cast('I') for k in range(4)]
+
+    out = io.BytesIO()
+    # Handle the common prefix and suffix fast, changes are often local
+    prefix = _common_prefix(old, new)
+    suffix = _common_prefix(old[prefix:][::-1], new[prefix:][::-1])
+    if prefix:
+        out.write(b'C' + struct.pack('<QQ', 0, prefix))
+    literal_start = pos = prefix
+    expected = prefix  # where the old data continues after the last copy
+    n = len(new) - suffix
+    old_view, new_view = memoryview(old), memoryview(new)
+    while pos + BLOCK_SIZE <= n:
+        block = new[pos:pos + BLOCK_SIZE]
+        if old[expected:expected + BLOCK_SIZE] == block:
+            offset = expected
+        else:
+            pos, offset = _find_block(new, words, pos, n - BLOCK_SIZE + 1, index, prefixes)
+            if pos is None:
+                break
+        # Extend the match forward
+        length = BLOCK_SIZE + _common_prefix(new_view[pos + BLOCK_SIZE:n],
+                                             old_view[offset + BLOCK_SIZE:])
+        _write_literal(out, new[literal_start:pos])
+        out.write(b'C' + struct.pack('<QQ', offset, length))
+        pos += length
+        literal_start = pos
+        expected = offset + length
+    _write_literal(out, new[literal_start:n])
+    if suffix:
+        out.write(b'C' + struct.pack('<QQ', len(old) - suffix, suffix))
+    return out.getvalue()
+
+
+def apply_delta(old, delta):
+    """ Apply a delta created with ``make_delta()`` to ``old``, and return
+    the new data (bytes).
+    """
+    out = io.BytesIO()
+    view = memoryview(delta)
+    pos = 0
+    while pos < len(view):
+        op = view[pos:pos + 1].tobytes()
+        if op == b'C':
+            offset, length = struct.unpack_from('<QQ', view, pos + 1)
+            if offset + length > len(old):
+                raise RuntimeError('Invalid delta: copy beyond the end of the source')
+            out.write(old[offset:offset + length])
+            pos += 17
+        elif op == b'L':
+            length = struct.unpack_from('<Q', view, pos + 1)[0]
+            out.write(view[pos + 9:pos + 9 + length])
+            pos += 9 + length
+        else:
+            raise RuntimeError('Invalid delta instruction %r' % op)
+    return out.getvalue()
+
+
+def _find_block(data, words, start, end, index, prefixes):
+    """ Find the first position in ``range(start, end)`` at which a block of
+    the index starts. Returns ``(position, offset in old)`` or ``(None, None)``.
+    Candidates are the positions whose first 4 bytes match the start of a
+    block, which are found by iterating over ``words`` (the data as 4-byte
+    words at each phase) in C, without creating a slice per position.
+    """
+    lo, window = start, SCAN_WINDOW[0]
+    while lo < end:
+        hi = min(lo + window, end)
+        candidates = []
+        for k, view in enumerate(words):
+            i0, i1 = max(0, (lo - k + 3) // 4), max(0, (hi - k + 3) // 4)
+            candidates.extend(itertools.compress(range(k + 4 * i0, k + 4 * i1, 4),
+                                                 map(prefixes.__contains__, view[i0:i1])))
+        for pos in sorted(candidates):
+            offset = index.get(data[pos:pos + BLOCK_SIZE])
+            if offset is not None:
+                return pos, offset
+        lo, window = hi, min(window * 4, SCAN_WINDOW[1])
+    return None, None
+
+
+def _write_literal(out, data):
+    if data:
+        out.write(b'L' + struct.pack('<Q', len(data)))
+        out.write(data)
+
+
+def _common_prefix(a, b):
+    """ Get the length of the common prefix of two bytes objects (or
+    memoryviews, to avoid copies).
+    """
+    lo, hi = 0, min(len(a), len(b))
+    # Compare in chunks first, then bytes
+    chunk = 4096
+    while lo + chunk <= hi and a[lo:lo + chunk] == b[lo:lo + chunk]:
+        lo += chunk
+    while lo < hi and a[lo] == b[lo]:
+        lo += 1
+    return lo
@@ -0,0 +1,166 @@
+"""
+A stand-in for the Firefox runtime, to test and benchmark the launch path
+without a display or a Firefox install. It parses the arguments, reads the
+XUL app like the runtime would, writes startup timing marks (like main.js)
+and serves the single-instance protocol. It runs until terminated, or for
+FIRETRON_FAKE_LIFETIME seconds.
+
+Run as ``python -m firetron._fakeruntime --app path/to/application.ini``,
+or create an executable with ``create_fake_runtime()``.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import zipfile
+import binascii
+import threading
+import configparser
+
+
+def create_fake_runtime(path):
+    """ Create an executable at the given path that runs the fake runtime.
+    On Windows, ".bat" is appended to the path. Returns the path.
+    """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = 'import sys; sys.path.insert(0, %r); ' % package_dir
+    code += 'from firetron._fakeruntime import main; main()'
+    if sys.platform.startswith('win'):
+        path += '.bat'
+        text = '@"%s" -c "%s" %%*\r\n' % (sys.executable, code)
+    else:
+        text = '#!/bin/sh\nexec "%s" -c "%s" "$@"\n' % (sys.executable, code)
+    with open(path, 'wb') as f:
+        f.write(text.encode())
+    os.chmod(path, 0o755)
+    return path
+
+
+def parse_args(argv):
+    """ Parse runtime arguments like Firefox does (single or double dash).
+    """
+    args = dict(app=None, profile=None, headless=False, no_remote=False)
+    i = 0
+    while i < len(argv):
+        arg = argv[i].lstrip('-')
+        if arg in ('app', 'profile') and i + 1 < len(argv):
+            args[arg] = argv[i + 1]
+            i += 1
+        elif arg == 'headless':
+            args['headless'] = True
+        elif arg == 'no-remote':
+            args['no_remote'] = True
+        i += 1
+    return args
+
+
+def read_app(ini_filename):
+    """ Read the XUL app definition. Returns a dict with the [App] fields,
+    and the firetron config (from config.js) as "config".
+    """
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    if not parser.read(ini_filename):
+        raise RuntimeError('Cannot read %r' % ini_filename)
+    info = dict(parser['App'])
+    app_dir = os.path.dirname(os.path.abspath(ini_filename))
+    # Find config.js, either as a file or in the jar
+    text = None
+    content_dir = os.path.join(app_dir, 'chrome', 'content')
+    jar = os.path.join(app_dir, 'chrome', info['Name'] + '.jar')
+    if os.path.isfile(os.path.join(content_dir, 'config.js')):
+        with open(os.path.join(content_dir, 'config.js'), 'rb') as f:
+            text = f.read().decode()
+    elif os.path.isfile(jar):
+        with zipfile.ZipFile(jar) as zf:
+            text = zf.read('content/config.js').decode()
+    info['config'] = {}
+    if text:
+        info['config'] = json.loads(text.split('=', 1)[1].strip().rstrip(';'))
+    return info
+
+
+def main(argv=None):
+    t_process = time.time() * 1000
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if not args['app']:
+        sys.exit('fake runtime: no --app given')
+    marks = dict(process=t_process, main=time.time() * 1000)
+    info = read_app(args['app'])
+    marks['script'] = marks['window_load'] = marks['first_paint'] = time.time() * 1000
+    marks['content_load'] = marks['content_paint'] = time.time() * 1000
+
+    # Report timing like main.js does
+    if os.environ.get('FIRETRON_LAUNCH_TIME'):
+        marks['launch'] = float(os.environ['FIRETRON_LAUNCH_TIME'])
+    filename = os.environ.get('FIRETRON_TIMING_FILE')
+    if filename:
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(json.dumps(marks).encode())
+        os.replace(filename + '.tmp', filename)
+    print(json.dumps(dict(app=info['Name'], headless=args['headless'], timing=marks)))
+    sys.stdout.flush()
+
+    # Serve the single-instance protocol
+    lock_file = None
+    if info['config'].get('single_instance') and args['profile']:
+        lock_file = os.path.join(args['profile'], 'firetron-instance.json')
+        _start_instance_listener(lock_file)
+
+    # Live until terminated
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        lifetime = float(os.environ.get('FIRETRON_FAKE_LIFETIME', 'inf'))
+        etime = time.time() + lifetime
+        while time.time() < etime:
+            time.sleep(min(0.1, max(0, etime - time.time())))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if lock_file and os.path.isfile(lock_file):
+            os.remove(lock_file)
+
+
+def _start_instance_listener(lock_file):
+    token = binascii.hexlify(os.urandom(16)).decode()
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+
+    def serve():
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                data = b''
+                while not data.endswith(b'\n'):
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                try:
+                    msg = json.loads(data.decode())
+                except ValueError:
+                    conn.sendall(b'error: invalid message\n')
+                    continue
+                if msg.get('token') != token:
+                    conn.sendall(b'error: invalid token\n')
+                elif msg.get('command') in ('open', 'reload'):
+                    print(json.dumps(dict(command=msg['command'], args=msg.get('args'))))
+                    sys.stdout.flush()
+                    conn.sendall(b'ok\n')
+                else:
+                    conn.sendall(b'error: unknown command\n')
+
+    t = threading.Thread(target=serve)
+    t.daemon = True
+    t.start()
+    info = dict(pid=os.getpid(), port=server.getsockname()[1], token=token)
+    with open(lock_file, 'wb') as f:
+        f.write(json.dumps(info).encode())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Utilities for writing directory trees with minimal I/O.
+"""
+
+import os
+import shutil
+import hashlib
+from collections import OrderedDict
+
+
+def file_hash(filename, algorithm='sha256'):
+    """ Get the hex digest of the contents of the given file.
+    """
+    h = hashlib.new(algorithm)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_source_date_epoch():
+    """ Get the timestamp from the SOURCE_DATE_EPOCH environment variable
+    (the convention for reproducible builds), or None if it is not set.
+    """
+    value = os.environ.get('SOURCE_DATE_EPOCH', '').strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('SOURCE_DATE_EPOCH must be an integer, not %r' % value)
+
+
+def list_files(path):
+    """ Get a sorted list of the relative (posix) paths of all files in
+    the given directory.
+    """
+    result = []
+    for root, dirs, fnames in os.walk(path):
+        for fname in fnames:
+            filename = os.path.join(root, fname)
+            result.append(os.path.relpath(filename, path).replace(os.sep, '/'))
+    return sorted(result)
+
+
+def write_tree(path, files):
+    """ Make the directory at ``path`` contain exactly the given files
+    (a dict that maps relative posix paths to bytes).
+
+    Existing files are compared by content hash. If nothing differs, nothing
+    is written. Otherwise the new tree is rendered in a staging directory,
+    in which unchanged files are hard-linked (or copied if that's not
+    possible), and then swapped in using renames, so that a failure never
+    leaves a half-written tree at ``path``. Returns the list of relative
+    paths that were added, changed, or removed.
+    """
+    path = os.path.abspath(path)
+
+    # Determine what changed
+    existing = list_files(path) if os.path.isdir(path) else []
+    changed = [fname for fname in existing if fname not in files]
+    unchanged = set()
+    for fname, data in files.items():
+        if fname in existing:
+            filename = os.path.join(path, fname)
+            if file_hash(filename) == hashlib.sha256(data).hexdigest():
+                unchanged.add(fname)
+                continue
+        changed.append(fname)
+    if not changed and os.path.isdir(path):
+        return []
+
+    # Render into staging directory (in a fixed order)
+    staging = '{}.{}.tmp'.format(path, os.getpid())
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)
+    try:
+        for fname, data in sorted(files.items()):
+            filename = os.path.join(staging, fname)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            if fname in unchanged:
+                _link_or_copy(os.path.join(path, fname), filename)
+            else:
+                with open(filename, 'wb') as f:
+                    f.write(data)
+        if not files:
+            os.makedirs(staging)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    # Swap
+    swap_dirs(staging, path)
+    return sorted(changed)
+
+
+def hash_tree(path, exclude=()):
+    """ Get a dict that maps the relative (posix) paths of all files in
+    the given directory to their sha256 hex digest, in sorted order.
+    """
+    hashes = OrderedDict()
+    for fname in list_files(path):
+        if fname not in exclude:
+            hashes[fname] = file_hash(os.path.join(path, fname))
+    return hashes
+
+
+def set_tree_mtime(path, timestamp):
+    """ Set the access and modification time of the given directory and
+    all files and directories in it, e.g. for reproducible builds.
+    """
+    for root, dirs, fnames in os.walk(path, topdown=False):
+        for fname in sorted(fnames):
+            filename = os.path.join(root, fname)
+            if not os.path.islink(filename):
+                os.utime(filename, (timestamp, timestamp))
+        os.utime(root, (timestamp, timestamp))
+
+
+def swap_dirs(new, path):
+    """ Move the directory ``new`` to ``path``, replacing the directory
+    that is currently there (if any).
+    """
+    if not os.path.isdir(path):
+        os.rename(new, path)
+        return
+    old = '{}.{}.old'.format(path, os.getpid())
+    if os.path.isdir(old):
+        shutil.rmtree(old)
+    os.rename(path, old)
+    try:
+        os.rename(new, path)
+    except Exception:
+        os.rename(old, path)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        shutil.copy2(src, dst)
@@ -2,6 +2,7 @@ import os
 import sys
 import time
 import shutil
+import subprocess
 
 
 def get_firefox_exe():
@@ -85,12 +86,13 @@ def get_firefox_exe_version(exe):
             return part
 
 
-def copy_firefox_runtime(dir1, dir2, altname='xulrunner'):
+def copy_firefox_runtime(dir1, dir2, altname='xulrunner', incremental=False):
     """ Copy the firefox/xulrunner runtime to a new folder, in which
     we rename the firefox exe to xulrunner. This thus creates a xul
     runtime in a location where we have write access. Used to be able
     to set the process name on Windows, and maybe used to distribute
-    apps *with* the runtime.
+    apps *with* the runtime. If ``incremental`` is True, an existing
+    copy is updated, skipping files with the same size and mtime.
     """
     t0 = time.time()
     # Get extension
@@ -99,24 +101,34 @@ def copy_firefox_runtime(dir1, dir2, altname='xulrunner'):
     if os.path.isdir(os.path.join(dir1, 'xulrunner')):
         dir1 = os.path.join(dir1, 'xulrunner')
     # Clear
-    if os.path.isdir(dir2):
+    if os.path.isdir(dir2) and not incremental:
         shutil.rmtree(dir2)
-    os.mkdir(dir2)
+    if not os.path.isdir(dir2):
+        os.mkdir(dir2)
     try:
         # Copy all files except dirs
         for fname in os.listdir(dir1):
             filename1 = os.path.join(dir1, fname)
             filename2 = os.path.join(dir2, fname)
             if os.path.isfile(filename1):
-                shutil.copy2(filename1, filename2)
+                _copy_if_changed(filename1, filename2)
         # Copy firefox exe -> xulrunner
         for exe_name in ('firefox', 'iceweasel', 'xulrunner', 'firefox'):
             exe = os.path.join(dir1, exe_name + ext)
             if os.path.isfile(exe):
                 break
-        shutil.copy2(exe, os.path.join(dir2, altname + ext))
+        _copy_if_changed(exe, os.path.join(dir2, altname + ext))
         print('Copied firefox in %1.1f s' % (time.time()-t0))
     except Exception:
         # Clean up
         shutil.rmtree(dir2)
-        raise
\ No newline at end of file
+        raise
+
+
+def _copy_if_changed(filename1, filename2):
+    # Copy, unless the target looks the same (copy2 preserves the mtime)
+    if os.path.isfile(filename2):
+        st1, st2 = os.stat(filename1), os.stat(filename2)
+        if st1.st_size == st2.st_size and int(st1.st_mtime) == int(st2.st_mtime):
+            return
+    shutil.copy2(filename1, filename2)
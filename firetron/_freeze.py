@@ -4,94 +4,364 @@ Create a distributable app.
 
 import os
 import sys
+import json
+import time
+import shlex
 import shutil
+import subprocess
+from collections import OrderedDict
 
 from ._createxul import create_xul_app
 from ._findff import copy_firefox_runtime, get_firefox_exe
+from ._profile import create_profile_template
+from ._fileutils import file_hash, hash_tree, set_tree_mtime, get_source_date_epoch
 
+# The manifest of content hashes written into each build
+BUILD_MANIFEST_NAME = "firetron-build-manifest.json"
 
-def create_app(target_dir, name, app, title=None, icon=None, include_firefox=False):
+# The timestamp for reproducible builds without SOURCE_DATE_EPOCH (1980-01-01,
+# the earliest date that zip files can hold)
+DEFAULT_EPOCH = 315532800
+
+
+def create_app(target_dir, name, app, title=None, icon=None, include_firefox=False,
+               jar=False, minify=False, warm_profile=False, memory_profile="default",
+               server=None, server_timeout=10, single_instance=False, clean=True,
+               cache_dir=None, reproducible=None, bridge=False):
+    """ Create a distributable app in the given target directory.
     
-    # We don't want want to include PyInstaller by default when *this* lib is frozen
-    import importlib
-    try:
-        pyinstaller_run = importlib.import_module("PyInstaller.__main__").run
-    except ImportError:
+    The ``app`` can be a URL or a directory with static assets. If a
+    ``server`` is given (a command line or a list of arguments; a Python
+    script as the command is frozen along), it is started by the app, and
+    the window loads the URL once the server has signalled that it is
+    ready (see ``firetron.notify_ready()``). In this case, the URL may
+    contain "{port}" to be replaced with the port that the server
+    reports. If ``single_instance`` is True, launching the
+    app again opens a new window in the running instance. If ``bridge`` is
+    True, the server can exchange messages with the app via ``firetron.Bridge``.
+    See ``create_xul_app()`` for the other options.
+    
+    If ``include_firefox`` is True, the installed Firefox runtime is copied
+    into the app; it can also be the directory of the runtime to include.
+    If ``clean`` is False, an existing build in ``target_dir`` is updated in
+    place, writing only files that changed. If a ``cache_dir`` is given,
+    PyInstaller keeps its work files there, which makes subsequent builds
+    faster. Returns a dict that maps each stage to its duration in seconds.
+    
+    If ``reproducible`` is True (the default if the SOURCE_DATE_EPOCH
+    environment variable is set), building the same inputs produces the
+    same output: all mtimes are set to SOURCE_DATE_EPOCH (or 1980-01-01),
+    and PyInstaller runs with a fixed hash seed. A pre-warmed profile is not
+    reproducible. A manifest with the sha256 of each file is written to
+    ``firetron-build-manifest.json`` in the target directory.
+    """
+    
+    return _create_apps(target_dir, [dict(name=name, app=app, title=title, icon=icon, jar=jar,
+                                          minify=minify, memory_profile=memory_profile,
+                                          server=server, server_timeout=server_timeout,
+                                          single_instance=single_instance, bridge=bridge)],
+                        include_firefox, warm_profile, clean, cache_dir, reproducible, bundle=False)
+
+
+def create_apps(target_dir, apps, include_firefox=False, warm_profile=False, clean=True,
+                cache_dir=None, reproducible=None, **defaults):
+    """ Create a bundle of multiple apps in the given target directory,
+    which share one frozen Python runtime (and Firefox runtime, if
+    included). PyInstaller runs once; each app gets a copy of the small
+    launcher executable with its own name, and its own XUL application
+    (in ``xul/<name>``) and profile template (in ``profile/<name>``). On
+    Windows, an app with an icon gets its own PyInstaller run instead,
+    since the icon of a frozen executable cannot be changed afterwards.
+    
+    The ``apps`` is a list of dicts with the options of ``create_app()``
+    for each app: "name" and "app" are required, and "title", "icon",
+    "jar", "minify", "memory_profile", "server", "server_timeout",
+    "single_instance" and "bridge" are optional. The ``defaults`` are
+    used for options that an app does not specify. The other arguments
+    are as in ``create_app()``. Returns a dict that maps each stage to its
+    duration in seconds.
+    """
+    apps = [dict(defaults, **options) for options in apps]
+    if not apps:
+        raise ValueError("create_apps() needs at least one app")
+    for options in apps:
+        if not options.get("name") or not options.get("app"):
+            raise ValueError("create_apps() needs a name and app for each app")
+    names = [options["name"] for options in apps]
+    if len(set(names)) != len(names):
+        raise ValueError("create_apps() got duplicate app names")
+    return _create_apps(target_dir, apps, include_firefox, warm_profile, clean, cache_dir,
+                        reproducible, bundle=True)
+
+
+def _create_apps(target_dir, apps, include_firefox, warm_profile, clean, cache_dir,
+                 reproducible, bundle):
+    """ Build one app, or a bundle of apps that share the frozen runtime.
+    Without ``bundle``, there is one app, and its XUL application and
+    profile template are directly in ``xul`` and ``profile``.
+    """
+    
+    # PyInstaller runs in a subprocess (see _pyinstaller_env), check that it's there
+    import importlib.util
+    if importlib.util.find_spec("PyInstaller") is None:
         raise ImportError("firetron.create_app needs PyInstaller (pip install pyinstaller)")
     
+    stages = _Stages()
+    names = [options["name"] for options in apps]
+    ext = ".exe" * sys.platform.startswith("win")
+    
+    def app_dir(kind, name):
+        # In a bundle, each app has its own XUL application and profile template
+        return os.path.join(target_dir, kind, name) if bundle else os.path.join(target_dir, kind)
+    
+    # Determine timestamp for a reproducible build
+    timestamp = None
+    if reproducible or (reproducible is None and get_source_date_epoch() is not None):
+        timestamp = get_source_date_epoch()
+        timestamp = DEFAULT_EPOCH if timestamp is None else timestamp
+    
     # Start with a clean target directory
-    print("===== Creating/cleaning target directory")
-    if os.path.isdir(target_dir):
+    stages.start("clean", "Creating/cleaning target directory")
+    if clean and os.path.isdir(target_dir):
         shutil.rmtree(target_dir)
-    os.mkdir(target_dir)
-    
-    # Determine what to run
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
     
-    # Create the XUL application
-    print("===== Creating XUL application")
-    title = title or name
-    id = name
-    url = app  # todo: only when app is a string starting with http://
-    windowfeatures = 'resizable=1,minimizable=1,dialog=0,'
-    windowmode = "normal"  # 'normal', 'maximized', 'fullscreen', 'kiosk'
-    create_xul_app(os.path.join(target_dir, "xul"), title, id, url, windowfeatures, windowmode, icon)
+    # Create the XUL applications
+    stages.start("xul", "Creating XUL application" + "s" * bundle)
+    server_scripts = []
+    for options in apps:
+        script = _create_xul(app_dir("xul", options["name"]), **options)
+        if script:
+            server_scripts.append((options["name"] + "_server", script))
     
-    print("===== Prepare for PyInstaller")
+    stages.start("launcher", "Prepare for PyInstaller")
     
-    # Copy launcher code
+    # Copy launcher code (frozen once, also in a bundle)
     print("Create launcher script")
-    launcher_filename = os.path.join(target_dir, name + ".py")
+    launcher_filename = os.path.join(target_dir, names[0] + ".py")
     with open(launcher_filename, 'wb') as f:
         f.write(launcher_code.encode())
     
-    # Determine icon file
-    iconfile = None
-    if icon is None:
-        pass
-    elif sys.platform.startswith("win"):
-        iconfile = os.path.join(target_dir, 'icon.ico')
-    elif sys.platform.startswith("darwin"):
-        iconfile = os.path.join(target_dir, 'icon.icns')
-    
-    # Compose PyInstaller command
-    cmd = [launcher_filename, "--windowed",
-            "--distpath", target_dir,
-            "--workpath", target_dir + "/build",
-            "--specpath", target_dir,
-            ]
-    if iconfile:
-        print("Writing icons")
-        icon.write(iconfile)
-        cmd += ["--icon", iconfile]
+    # Determine icon files
+    iconfiles = OrderedDict()
+    for options in apps:
+        icon, iconfile = options.get("icon"), None
+        if icon is None:
+            pass
+        elif sys.platform.startswith("win"):
+            iconfile = os.path.join(target_dir, (options["name"] if bundle else "icon") + ".ico")
+        elif sys.platform.startswith("darwin"):
+            iconfile = os.path.join(target_dir, (options["name"] if bundle else "icon") + ".icns")
+        iconfiles[options["name"]] = icon, iconfile
     
     # Call PyInstaller
-    print("===== Running PyInstaller to create the executables")
-    try:
-        pyinstaller_run(cmd)
-    except SystemExit:
-        raise RuntimeError("FAIL")
+    stages.start("pyinstaller", "Running PyInstaller to create the executables")
+    for icon, iconfile in iconfiles.values():
+        if iconfile:
+            print("Writing icons")
+            icon.write(iconfile)
+    workpath = os.path.join(cache_dir, names[0]) if cache_dir else target_dir + "/build"
+    env = _pyinstaller_env(timestamp)
+    _run_pyinstaller(launcher_filename, target_dir, names[0], iconfiles[names[0]][1],
+                     workpath, env)
+    for server_name, server_script in server_scripts:
+        _run_pyinstaller(server_script, target_dir, server_name, workpath=workpath, env=env)
+    
+    # The other apps of a bundle get a copy of the launcher executable, which
+    # finds the XUL application by its own name. On Windows, an app with an
+    # icon is frozen separately: the icon can only be set before PyInstaller
+    # appends its archive to the executable. The shared files are merged.
+    if bundle and len(names) > 1:
+        stages.start("entrypoints", "Creating the executables of the other apps")
+        for name in names[1:]:
+            if iconfiles[name][1] and sys.platform.startswith("win"):
+                _run_pyinstaller(launcher_filename, target_dir, name, iconfiles[name][1],
+                                 workpath, env)
+            else:
+                shutil.copy2(os.path.join(target_dir, names[0] + ext),
+                             os.path.join(target_dir, name + ext))
     
     # Clean up after PyInstaller
-    print("===== Cleaning up")
-    for x in os.listdir(os.path.join(target_dir, name)):
-        os.rename(os.path.join(target_dir, name, x), os.path.join(target_dir, x))
-    for fname in (launcher_filename, launcher_filename[:-3] + ".spec", iconfile, None):
+    stages.start("cleanup", "Cleaning up")
+    for fname in [launcher_filename] + [iconfile for _, iconfile in iconfiles.values()]:
         if fname and os.path.isfile(os.path.join(target_dir, fname)):
             os.remove(os.path.join(target_dir, fname))
-    for dname in ("build", name, "__pycache__", None):
+    for dname in ("build", "__pycache__", None):
         if dname and os.path.isdir(os.path.join(target_dir, dname)):
             shutil.rmtree(os.path.join(target_dir, dname))
     
-    # Copy over firefox directory
+    # Copy over firefox directory, with an executable for each app, so that
+    # each app has its own process name
     if include_firefox:
-        print("===== Copying Firefox runtime")
-        exe = get_firefox_exe()  # Raises RuntimeError if not found
-        copy_firefox_runtime(os.path.dirname(exe), os.path.join(target_dir, "ff"), name)
+        stages.start("firefox", "Copying Firefox runtime")
+        if isinstance(include_firefox, str):
+            runtime_dir = include_firefox
+        else:
+            runtime_dir = os.path.dirname(get_firefox_exe())  # Raises RuntimeError if not found
+        ff_dir = os.path.join(target_dir, "ff")
+        copy_firefox_runtime(runtime_dir, ff_dir, names[0], incremental=not clean)
+        for name in names[1:]:
+            shutil.copy2(os.path.join(ff_dir, names[0] + ext), os.path.join(ff_dir, name + ext))
         
+    # Create profile templates, copied to the user's profile on first launch
+    stages.start("profile", "Creating profile template" + "s" * bundle)
+    for name in names:
+        warm_exe = None
+        if warm_profile:
+            warm_exe = get_firefox_exe()
+            if include_firefox:
+                warm_exe = os.path.join(target_dir, "ff", name + os.path.splitext(warm_exe)[1])
+        create_profile_template(app_dir("profile", name),
+                                exe=warm_exe, app=app_dir("xul", name))
+    
+    # Write manifest of content hashes, and fix mtimes
+    stages.start("manifest", "Writing manifest")
+    manifest = OrderedDict([("apps", names) if bundle else ("name", names[0])])
+    manifest.update(source_date_epoch=timestamp,
+                    files=hash_tree(target_dir, exclude=(BUILD_MANIFEST_NAME, )))
+    with open(os.path.join(target_dir, BUILD_MANIFEST_NAME), 'wb') as f:
+        f.write(json.dumps(manifest, indent=2).encode())
+    if timestamp is not None:
+        set_tree_mtime(target_dir, timestamp)
+    
     print("===== Done!")
+    return stages.finish()
+
+
+def _create_xul(xul_dir, name, app, title=None, icon=None, jar=False, minify=False,
+                memory_profile="default", server=None, server_timeout=10,
+                single_instance=False, bridge=False):
+    """ Create the XUL application of one app. Returns the filename of
+    the server script to freeze along, or None.
+    """
+    
+    # Determine what to run
+    server_script = None
+    if server is not None:
+        server = _split_command(server) if isinstance(server, str) else list(server)
+        if not server:
+            raise ValueError("create_app() server must not be empty")
+        if server[0].endswith(".py"):
+            # Freeze the server script alongside the launcher
+            server_script = os.path.abspath(server[0])
+            server[0] = "{appdir}/" + name + "_server" + ".exe" * sys.platform.startswith("win")
+        elif shutil.which(server[0]) is None:
+            print("Warning: server command %r not found here; the app looks it up "
+                  "in the PATH when it starts." % server[0])
+    
+    title = title or name
+    id = name
+    if "://" in app:
+        url, assets = app, None
+    elif os.path.isdir(app):
+        url, assets = None, app  # Static assets, served from chrome://
+    else:
+        raise ValueError("create_app() app must be a URL or an asset directory")
+    windowfeatures = 'resizable=1,minimizable=1,dialog=0,'
+    windowmode = "normal"  # 'normal', 'maximized', 'fullscreen', 'kiosk'
+    create_xul_app(xul_dir, title, id, url, windowfeatures, windowmode, icon,
+                   jar=jar, assets=assets, minify=minify, memory_profile=memory_profile,
+                   server=server, server_timeout=server_timeout, single_instance=single_instance,
+                   bridge=bridge)
+    return server_script
+
+
+def _split_command(command):
+    """ Split a command line like the platform's shell would. A path to an
+    existing file is not split, even if it contains spaces.
+    """
+    if os.path.isfile(command):
+        return [command]
+    if not sys.platform.startswith("win"):
+        return shlex.split(command)
+    # On Windows, backslashes are path separators, and only quotes are special
+    args = shlex.split(command, posix=False)
+    return [arg[1:-1] if len(arg) > 1 and arg[0] == arg[-1] and arg[0] in "\"'" else arg
+            for arg in args]
+
+
+def _pyinstaller_env(timestamp):
+    """ Get the environment for the PyInstaller process, with the variables
+    that make its output reproducible (if timestamp is not None). This is
+    why PyInstaller runs in a subprocess: the hash seed of a running
+    interpreter cannot be changed, and os.environ is shared with
+    concurrent builds.
+    """
+    env = dict(os.environ)
+    if timestamp is not None:
+        env.update(PYTHONHASHSEED="0", SOURCE_DATE_EPOCH=str(timestamp))
+    return env
+
+
+class _Stages(object):
+    """ Keep track of the duration of the stages of a build.
+    """
+    
+    def __init__(self):
+        self._durations = OrderedDict()
+        self._current = None
+        self._t0 = None
+    
+    def start(self, key, title):
+        self.finish()
+        print("===== " + title)
+        self._current, self._t0 = key, time.perf_counter()
+    
+    def finish(self):
+        if self._current is not None:
+            self._durations[self._current] = time.perf_counter() - self._t0
+            self._current = None
+        return self._durations
+
+
+def _run_pyinstaller(script, target_dir, name, iconfile=None, workpath=None, env=None):
+    """ Freeze the given script into an executable with the given name, and
+    merge the result into the target directory. Files that are already
+    present (e.g. shared libraries from an earlier run) are kept.
+    """
+    # Use a separate dist dir, because on Unix the output dir and the
+    # executable in it have the same name
+    distpath = os.path.join(target_dir, "dist")
+    cmd = [script, "--windowed", "--name", name,
+            "--distpath", distpath,
+            "--workpath", workpath or target_dir + "/build",
+            "--specpath", target_dir,
+            ]
+    if iconfile:
+        cmd += ["--icon", iconfile]
+    try:
+        subprocess.check_call([sys.executable, "-m", "PyInstaller"] + cmd, env=env)
+    except subprocess.CalledProcessError as err:
+        raise RuntimeError("PyInstaller failed to freeze %s (exit code %i)" %
+                           (script, err.returncode))
+    # Move the output into the target dir
+    _merge_dir(os.path.join(distpath, name), target_dir)
+    shutil.rmtree(distpath)
+    os.remove(os.path.join(target_dir, name + ".spec"))
+
+
+def _merge_dir(src, dst):
+    """ Move the files in src into dst. Files that are already present with
+    the same content (e.g. shared libraries from an earlier run or an
+    earlier build) are left untouched.
+    """
+    for x in os.listdir(src):
+        src_path, dst_path = os.path.join(src, x), os.path.join(dst, x)
+        if os.path.isdir(src_path) and os.path.isdir(dst_path):
+            _merge_dir(src_path, dst_path)
+        elif not os.path.exists(dst_path):
+            os.rename(src_path, dst_path)
+        elif os.path.isfile(src_path) and os.path.isfile(dst_path):
+            if (os.path.getsize(src_path) != os.path.getsize(dst_path) or
+                    file_hash(src_path) != file_hash(dst_path)):
+                os.replace(src_path, dst_path)
 
 
 launcher_code = """
+import time
+t0 = time.time()  # as early as possible, for startup timing
+
 import os
 import sys
 import tempfile
@@ -106,25 +376,76 @@ Could not locate Firefox executable!
 Please install Firefox (e.g. from https://firefox.com)
 '''.strip()
 
+# Mark the launch time, if startup timing is requested
+if os.environ.get("FIRETRON_TIMING_FILE"):
+    os.environ.setdefault("FIRETRON_LAUNCH_TIME", repr(t0 * 1000))
+
 try:
     ffexe = firetron.get_firefox_exe()
 except RuntimeError:
     dialite.warn("Firefox not found", ffnotfound)
     sys.exit(1)
 
+def apply_pending_update(exedir):
+    # Apply an update that was put next to the app dir (see firetron.create_patch).
+    # The app dir is swapped atomically, so on failure the current version is used.
+    patch = exedir + ".firetron-patch"
+    if os.path.isfile(patch):
+        try:
+            firetron.apply_patch(patch, exedir)
+        except RuntimeError as err:  # Patch is not for this version
+            sys.stderr.write("Discarding update: %s\\n" % err)
+            os.remove(patch)
+        except OSError as err:  # E.g. on Windows the dir cannot be swapped while in use
+            sys.stderr.write("Could not apply update: %s\\n" % err)
+        else:
+            os.remove(patch)
+
+def get_app_dir(exedir, kind, exename):
+    # In a bundle of apps (see firetron.create_apps), each app has its own dir.
+    # Check for a file that it must contain, because a single app can have a
+    # subdir with the same name as the app (e.g. "chrome" or "defaults").
+    marker = {"xul": "application.ini", "profile": "firetron-template.txt"}[kind]
+    path = os.path.join(exedir, kind, exename)
+    return path if os.path.isfile(os.path.join(path, marker)) else os.path.join(exedir, kind)
+
+def prepare_profile(exename, exedir):
+    # Use a persistent per-user profile, so that Firefox does not have to
+    # create a new one on each start. It is seeded from the profile template.
+    profile_dir = os.path.join(os.path.expanduser("~"), ".firetron", exename)
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+    # In single-instance mode, let the running instance open a new window
+    # (a stale lock file is removed). This is done first, because the profile
+    # must not be touched while an instance is using it.
+    try:
+        if firetron.send_to_instance(profile_dir, "open", sys.argv[1:]):
+            sys.exit(0)
+    except RuntimeError as err:  # The running instance refused
+        dialite.warn("Could not open a new window", str(err))
+        sys.exit(1)
+    template = get_app_dir(exedir, "profile", exename)
+    if os.path.isdir(template):
+        firetron.copy_profile_template(template, profile_dir)
+    return profile_dir
+
 if sys.platform.startswith("win"):
     exename = os.path.basename(sys.executable)[:-4]
     exedir = os.path.dirname(os.path.abspath(sys.executable))
-    xul = os.path.join(exedir, "xul", "application.ini")
+    xuldir = get_app_dir(exedir, "xul", exename)
+    xul = os.path.join(xuldir, "application.ini")
+    apply_pending_update(exedir)
+    profile_dir = prepare_profile(exename, exedir)
+    os.environ["FIRETRON_APPDIR"] = exedir  # so the XUL app can find the server
     
-    # Create shortcut
-    lnk_path = os.path.join(tempfile.gettempdir(), sys.executable[:-4] + ".lnk")
-    firetron.create_lnk(lnk_path,
+    # Create shortcut, or reuse the one from a previous start if it's still valid
+    lnk_path = os.path.join(tempfile.gettempdir(), exename + ".lnk")
+    firetron.update_lnk(lnk_path,
         target=ffexe,
-        arguments='--app "' + xul + '"',
+        arguments='--app "' + xul + '" -profile "' + profile_dir + '"',
         work_dir=exedir, 
         comment="Run " + exename + " on the Firefox XUL runtime",
-        icon=os.path.join(exedir, "xul", "chrome", "icons", "default", "W" + exename + ".ico"),
+        icon=os.path.join(xuldir, "chrome", "icons", "default", "W" + exename + ".ico"),
         run_mode="normal",
     )
     
@@ -134,5 +455,17 @@ if sys.platform.startswith("win"):
     #os.execl(ffexe, sys.executable, "--app", xul)
 
 else:
-    raise NotImplementedError()
+    exename = os.path.basename(sys.executable)
+    exedir = os.path.dirname(os.path.abspath(sys.executable))
+    xuldir = get_app_dir(exedir, "xul", exename)
+    xul = os.path.join(xuldir, "application.ini")
+    apply_pending_update(exedir)
+    profile_dir = prepare_profile(exename, exedir)
+    os.environ["FIRETRON_APPDIR"] = exedir  # so the XUL app can find the server
+    
+    # Replace this process with the runtime. There is no lingering Python
+    # process, and the runtime gets our pid (and e.g. our stdio).
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(ffexe, [ffexe, "--app", xul, "-profile", profile_dir])
 """
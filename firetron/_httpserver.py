@@ -0,0 +1,300 @@
+"""
+An asyncio HTTP server for serving app content locally, for use as the
+server process of a firetron app (see ``create_app()``). It supports
+keep-alive, serves files with zero-copy ``sendfile``, serves precompressed
+gzip and brotli variants, uses strong ETags, and keeps small files in memory.
+
+Use ``serve_static()`` in a server script, or run
+``python -m firetron._httpserver path/to/assets``.
+"""
+
+import os
+import sys
+import gzip
+import asyncio
+import hashlib
+import importlib
+import mimetypes
+import posixpath
+import urllib.parse
+from collections import OrderedDict
+
+from ._server import notify_ready
+
+try:
+    brotli = importlib.import_module('brotli')
+except ImportError:
+    brotli = None
+
+# Precompressed variants, in order of preference
+ENCODINGS = ('br', '.br'), ('gzip', '.gz')
+
+MAX_HEADER_SIZE = 64 * 1024
+
+STATUS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+          405: 'Method Not Allowed', 431: 'Request Header Fields Too Large'}
+
+
+class StaticServer(object):
+    """ An HTTP server for the files in ``root``. Files of at most
+    ``cache_file_size`` bytes are kept in an LRU cache of at most
+    ``cache_size`` bytes. Start with ``start()`` (a coroutine) or use
+    ``serve_static()``.
+    """
+
+    def __init__(self, root, host='127.0.0.1', port=0, cache_size=16 * 2**20,
+                 cache_file_size=256 * 2**10):
+        if not os.path.isdir(root):
+            raise ValueError('Directory to serve does not exist: %r' % root)
+        self._root = os.path.realpath(root)
+        self._host = host
+        self._port = port
+        self._cache = OrderedDict()  # filename -> (stat key, etag, data)
+        self._cache_bytes = 0
+        self._cache_size = cache_size
+        self._cache_file_size = cache_file_size
+        self._etags = {}  # filename -> (stat key, etag), for uncached files
+        self._server = None
+
+    def __repr__(self):
+        return '<StaticServer for %r on port %i at 0x%x>' % (self._root, self.port, id(self))
+
+    @property
+    def port(self):
+        """ The port that the server listens on (0 if not started).
+        """
+        if self._server is None:
+            return 0
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        """ Start listening. Returns the port.
+        """
+        self._server = await asyncio.start_server(self._handle_connection, self._host,
+                                                  self._port, limit=MAX_HEADER_SIZE)
+        return self.port
+
+    def close(self):
+        """ Stop listening.
+        """
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader, writer):
+        """ Handle one request. Returns whether to keep the connection open.
+        """
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            await self._send(writer, 431, keep_alive=False)
+            return False
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            await self._send(writer, 400, keep_alive=False)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, val = line.split(':', 1)
+                headers[key.strip().lower()] = val.strip()
+
+        # Discard a request body, if any
+        length = int(headers.get('content-length', '0') or 0)
+        if length:
+            await reader.readexactly(length)
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        if method not in ('GET', 'HEAD'):
+            await self._send(writer, 405, keep_alive=keep_alive)
+            return keep_alive
+        filename = self._resolve(target)
+        if filename is None:
+            await self._send(writer, 404, keep_alive=keep_alive)
+            return keep_alive
+
+        # Pick a precompressed variant, if the client accepts it, and it is
+        # not older than the file (i.e. not stale)
+        accepted = [x.split(';')[0].strip() for x in
+                    headers.get('accept-encoding', '').split(',')]
+        encoding = None
+        try:
+            st = os.stat(filename)
+            for name, ext in ENCODINGS:
+                if name in accepted:
+                    try:
+                        variant_st = os.stat(filename + ext)
+                    except OSError:
+                        continue
+                    if variant_st.st_mtime_ns >= st.st_mtime_ns:
+                        encoding, filename, st = name, filename + ext, variant_st
+                        break
+            # Get etag and data (if cached)
+            key = st.st_mtime_ns, st.st_size
+            etag, data = self._lookup(filename, key)
+        except OSError:  # E.g. removed in the meantime
+            await self._send(writer, 404, keep_alive=keep_alive)
+            return keep_alive
+
+        response_headers = [('Content-Type', _content_type(filename, encoding)),
+                            ('ETag', etag), ('Cache-Control', 'no-cache'),
+                            ('Vary', 'Accept-Encoding')]
+        if encoding:
+            response_headers.append(('Content-Encoding', encoding))
+        if etag in [x.strip() for x in headers.get('if-none-match', '').split(',')]:
+            await self._send(writer, 304, response_headers, keep_alive=keep_alive)
+            return keep_alive
+
+        # Open a large file before sending the head, so that we can still 404
+        f = None
+        if method == 'GET' and data is None:
+            try:
+                f = open(filename, 'rb')
+            except OSError:
+                await self._send(writer, 404, keep_alive=keep_alive)
+                return keep_alive
+        response_headers.append(('Content-Length', str(st.st_size)))
+        try:
+            await self._send(writer, 200, response_headers, keep_alive=keep_alive,
+                             body=b'' if method == 'HEAD' else data)
+            if f is not None:
+                await asyncio.get_running_loop().sendfile(writer.transport, f)
+        finally:
+            if f is not None:
+                f.close()
+        return keep_alive
+
+    async def _send(self, writer, status, headers=(), keep_alive=True, body=None):
+        """ Send the response head, and the body if given.
+        """
+        if body is None and status >= 400:
+            body = STATUS[status].encode()
+            headers = list(headers) + [('Content-Type', 'text/plain'),
+                                       ('Content-Length', str(len(body)))]
+        elif status == 304:
+            headers = list(headers) + [('Content-Length', '0')]
+        lines = ['HTTP/1.1 %i %s' % (status, STATUS[status])]
+        lines += ['%s: %s' % header for header in headers]
+        lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+    def _resolve(self, target):
+        """ Get the filename for a request target, or None.
+        """
+        path = urllib.parse.unquote(target.split('?', 1)[0].split('#', 1)[0])
+        path = posixpath.normpath('/' + path).lstrip('/')
+        filename = os.path.realpath(os.path.join(self._root, *path.split('/')))
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, 'index.html')
+        if not (filename == self._root or filename.startswith(self._root + os.sep)):
+            return None
+        return filename if os.path.isfile(filename) else None
+
+    def _lookup(self, filename, key):
+        """ Get the (strong) etag of the file, and its data if it is small
+        enough to be cached.
+        """
+        # Cached data?
+        item = self._cache.get(filename)
+        if item is not None and item[0] == key:
+            self._cache.move_to_end(filename)
+            return item[1], item[2]
+        # Small file: read, and put in LRU cache
+        if key[1] <= self._cache_file_size:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            etag = '"%s"' % hashlib.sha256(data).hexdigest()[:32]
+            if item is not None:
+                self._cache_bytes -= len(item[2])
+            self._cache[filename] = key, etag, data
+            self._cache_bytes += len(data)
+            while self._cache_bytes > self._cache_size:
+                _, (_, _, old_data) = self._cache.popitem(last=False)
+                self._cache_bytes -= len(old_data)
+            return etag, data
+        # Large file: only cache the etag
+        item = self._etags.get(filename)
+        if item is None or item[0] != key:
+            h = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    h.update(block)
+            item = self._etags[filename] = key, '"%s"' % h.hexdigest()[:32]
+        return item[1], None
+
+
+def _content_type(filename, encoding):
+    if encoding:
+        filename = os.path.splitext(filename)[0]
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript',
+                                                             'application/json'):
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def serve_static(root, host='127.0.0.1', port=0, **kwargs):
+    """ Serve the files in ``root`` until the process is terminated.
+    When started by a firetron app, the app is notified that the server is
+    ready (see ``notify_ready()``). See ``StaticServer`` for the options.
+    """
+    server = StaticServer(root, host, port, **kwargs)
+
+    async def main():
+        port = await server.start()
+        if not notify_ready(port):
+            print('Serving %s at http://%s:%i' % (root, host, port))
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+def precompress(root, min_size=1024, extensions=('.html', '.js', '.css', '.svg',
+                                                 '.json', '.txt', '.xml', '.wasm')):
+    """ Write gzip (and brotli, if available) compressed variants next to
+    the compressible files in ``root``, for ``StaticServer`` to serve.
+    Variants that would not be smaller are not written. Returns the list
+    of files that were written.
+    """
+    written = []
+    for dirpath, dirnames, fnames in os.walk(root):
+        for fname in sorted(fnames):
+            filename = os.path.join(dirpath, fname)
+            if not fname.endswith(extensions) or os.path.getsize(filename) < min_size:
+                continue
+            with open(filename, 'rb') as f:
+                data = f.read()
+            variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data)))
+            for ext, compressed in variants:
+                if len(compressed) < len(data):
+                    with open(filename + ext, 'wb') as f:
+                        f.write(compressed)
+                    written.append(filename + ext)
+    return written
+
+
+if __name__ == '__main__':
+    serve_static(sys.argv[1] if len(sys.argv) > 1 else '.')
@@ -12,7 +12,7 @@ from __future__ import print_function, division, absolute_import
 import sys
 import struct
 
-from ._png import read_png, write_png
+from ._png import read_png, write_png, _to_rgba
 
 if sys.version_info[0] >= 3:
     basestring = str  # noqa
@@ -132,7 +132,7 @@ class Icon(object):
         elif filename.lower().endswith('.png'):
             for size in sorted(self._ims):
                 filename2 = '%s%i%s' % (filename[:-4], size, filename[-4:])
-                data = self._to_png(self._ims[size])
+                data = self._to_png(self._ims[size], mode='auto')
                 with open(filename2, 'wb') as f:
                     f.write(data)
         elif filename.lower().endswith('.bmp'):
@@ -395,19 +395,16 @@ class Icon(object):
         if shape[0] not in VALID_SIZES:
             raise RuntimeError('Invalid size %r in png' % shape[0])
         
-        # Make RGBA if necessary
-        if shape[2] == 3:
-            im2 = bytearray(int(len(im)*1.333333333334))
-            im2[3::4] = b'\xff' * (shape[0] * shape[1])
-            im2[0::4] = im[0::3]
-            im2[1::4] = im[1::3]
-            im2[2::4] = im[2::3]
+        # Make RGBA if necessary (png can also be gray, or gray with alpha)
+        if shape[2] != 4:
+            im2 = bytearray(_to_rgba(im, shape[2]))
         else:
             im2 = im  # already bytearray
         
         #return im2
         self._store_image(im2)
     
-    def _to_png(self, im):
+    def _to_png(self, im, mode='rgba'):
+        # Icon containers (ICO, ICNS) need RGBA, standalone files can be smaller
         size = self._image_size(im)
-        return write_png(bytes(im), (size, size, 4))
+        return write_png(bytes(im), (size, size, 4), mode=mode)
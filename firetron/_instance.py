@@ -0,0 +1,61 @@
+"""
+Pass commands to a running instance of an app in single-instance mode.
+"""
+
+import os
+import json
+import socket
+
+from ._proc import is_alive
+
+
+LOCK_NAME = 'firetron-instance.json'
+
+
+def send_to_instance(profile_dir, command='open', args=(), timeout=2.0):
+    """ Send a command to the running instance of the app that uses the
+    given profile. With the "open" command, the running instance opens a
+    new window, which is much cheaper than starting a new runtime. Returns
+    True on success, and False if there is no running instance. A lock file
+    of an instance that is no longer running is removed. Raises RuntimeError
+    if the running instance does not accept the command.
+    """
+    # Read the lock file that the running instance wrote
+    lock_file = os.path.join(profile_dir, LOCK_NAME)
+    try:
+        with open(lock_file, 'rb') as f:
+            info = json.loads(f.read().decode())
+        pid, port, token = int(info['pid']), int(info['port']), info['token']
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    if not is_alive(pid):
+        _remove_lock(lock_file)
+        return False
+
+    # Send our message
+    msg = dict(token=token, command=command, args=list(args))
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout) as s:
+            s.sendall(json.dumps(msg).encode() + b'\n')
+            reply = b''
+            while not reply.endswith(b'\n'):
+                data = s.recv(1024)
+                if not data:
+                    break
+                reply += data
+    except ConnectionRefusedError:
+        _remove_lock(lock_file)  # The pid was reused by another process
+        return False
+    except OSError:
+        return False
+    reply = reply.decode(errors='ignore').strip()
+    if reply != 'ok':
+        raise RuntimeError('Running instance replied: %s' % reply)
+    return True
+
+
+def _remove_lock(lock_file):
+    try:
+        os.remove(lock_file)
+    except OSError:
+        pass
@@ -3,45 +3,185 @@ Code to launch an app live from the Python interpreter, for use during
 development.
 """
 
+import os
+import sys
+import atexit
+import pathlib
+import shutil
+import tempfile
+import threading
+import subprocess
+
+from ._findff import get_firefox_exe
+from ._createxul import create_xul_app
+from ._profile import create_profile_template
+from ._instance import send_to_instance
+from ._timing import timing_env
+
+
+def launch_app(app, title=None, size=(640, 480), pos=None, windowmode='normal',
+               icon=None, exe=None, watch=None, timing_file=None, pool=None,
+               headless=False):
+    """ Launch an app for development, and return a ``LaunchedApp`` object.
+
+    The ``app`` can be a URL or a directory with static assets (which
+    are loaded directly via file://). The runtime is started once; when
+    a file in ``watch`` changes (a directory, default the asset directory
+    if ``app`` is one), the content is reloaded in place. If ``timing_file``
+    is given, startup timing marks are written to it (see
+    ``read_startup_timing()``). If an ``AppDirPool`` is given as ``pool``,
+    the app and profile dir are leased from it. With ``headless``, the
+    runtime runs without a display.
+    """
+
+    # Determine url
+    if os.path.isdir(app):
+        url = pathlib.Path(os.path.abspath(os.path.join(app, 'index.html'))).as_uri()
+        if watch is None:
+            watch = app
+    else:
+        url = app
 
-def launch_app(self, url):
-    
     # Get dir to store app definition
-    app_path = create_temp_app_dir('firefox')
-    id = op.basename(app_path).split('_', 1)[1].replace('~', '_')
-    
+    lease = pool.lease() if pool is not None else None
+    app_path = lease.path if lease else tempfile.mkdtemp(prefix='firetron_')
+    id = os.path.basename(app_path).split('_', 1)[1].replace('~', '_')
+
     # Set size and position
     # Maybe interesting window features: alwaysRaised
     windowfeatures = 'resizable=1,minimizable=1,dialog=0,'
-    if self._windowmode == 'normal':
-        windowfeatures += 'width=%i,height=%i' % self._size
-        if self._pos:
-            windowfeatures += ',left=%i,top=%i' % self._pos
-
-    # Create files for app
-    # self._create_xul_app(app_path, id, url, windowfeatures)
-
-    # Get executable for xul runtime (may be None)
-    ff_exe = self.get_exe()
-    if not ff_exe:
-        raise RuntimeError('Firefox is not available on this system.')
-    elif not op.isfile(ff_exe):
-        # We have no way to wrap things up in a custom app
-        exe = ff_exe
-    else:
-        # We make sure the runtime is "installed" and mangle the name
-        xul_exe = op.join(self.get_runtime_dir(), 'xulrunner')
-        xul_exe += '.exe' * sys.platform.startswith('win')
-        exe = self._get_app_exe(xul_exe, app_path)
-    
+    if windowmode == 'normal':
+        windowfeatures += 'width=%i,height=%i' % tuple(size)
+        if pos:
+            windowfeatures += ',left=%i,top=%i' % tuple(pos)
+
+    # Create files for app. The single-instance listener is used for reloading.
+    xul_path = os.path.join(app_path, 'xul')
+    create_xul_app(xul_path, title or id, id, url, windowfeatures, windowmode, icon,
+                   single_instance=True)
+
     # Prepare profile dir for Xul to let -profile dir point to.
     # This dir is unique for each instance of the app, but because it is
     # inside the app_path, it gets automatically cleaned up.
-    profile_dir = op.join(app_path, 'stub_profile')
-    if not op.isdir(profile_dir):
-        os.mkdir(profile_dir)
-    
+    profile_dir = os.path.join(app_path, 'stub_profile')
+    if not lease:
+        create_profile_template(profile_dir)
+
+    # Get executable for xul runtime
+    exe = exe or get_firefox_exe()  # Raises RuntimeError if not found
+
     # Launch
-    cmd = [exe, '-app', op.join(app_path, 'application.ini'),
-            '-profile', profile_dir]
-    self._start_subprocess(cmd)
+    env = os.environ.copy()
+    if timing_file:
+        env.update(timing_env(timing_file))
+    cmd = [exe, '--app', os.path.join(xul_path, 'application.ini'),
+           '-no-remote', '-profile', profile_dir]
+    if headless:
+        cmd.append('--headless')
+        env['MOZ_HEADLESS'] = '1'
+    try:
+        process = subprocess.Popen(cmd, env=env)
+    except Exception:
+        if lease:
+            lease.release()
+        else:
+            shutil.rmtree(app_path, ignore_errors=True)
+        raise
+    return LaunchedApp(process, app_path, profile_dir, watch, lease=lease)
+
+
+class LaunchedApp(object):
+    """ Object that represents an app that was launched for development.
+    Use ``reload()`` to reload its content and ``close()`` to stop it.
+    """
+
+    def __init__(self, process, app_path, profile_dir, watch=None, interval=0.2, lease=None):
+        self._process = process
+        self._app_path = app_path
+        self._lease = lease
+        self._profile_dir = profile_dir
+        self._closed = threading.Event()
+        self._watcher = None
+        if watch:
+            self._watcher = threading.Thread(target=self._watch, args=(watch, interval))
+            self._watcher.daemon = True
+            self._watcher.start()
+        atexit.register(self.close)
+
+    def __repr__(self):
+        return '<LaunchedApp with pid %i at 0x%x>' % (self.pid, id(self))
+
+    @property
+    def pid(self):
+        """ The pid of the runtime process.
+        """
+        return self._process.pid
+
+    @property
+    def profile_dir(self):
+        """ The profile directory used by the runtime.
+        """
+        return self._profile_dir
+
+    @property
+    def exit_code(self):
+        """ The exit code of the runtime, or None if it's still running.
+        """
+        return self._process.poll()
+
+    def is_alive(self):
+        """ Get whether the runtime is still running.
+        """
+        return self._process.poll() is None
+
+    def reload(self):
+        """ Reload the content in place, without restarting the runtime.
+        Returns False if the runtime is not (yet) ready to receive commands.
+        """
+        return send_to_instance(self._profile_dir, 'reload')
+
+    def close(self):
+        """ Stop the runtime and remove the temporary app directory (or
+        give it back to the pool).
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        atexit.unregister(self.close)  # so that closed apps can be collected
+        if self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        if self._lease:
+            self._lease.release()
+        else:
+            shutil.rmtree(self._app_path, ignore_errors=True)
+
+    def _watch(self, path, interval):
+        snapshot = _snapshot(path)
+        while not self._closed.wait(interval):
+            if not self.is_alive():
+                break
+            new_snapshot = _snapshot(path)
+            if new_snapshot != snapshot:
+                snapshot = new_snapshot
+                if not self.reload():
+                    print('Could not reload app (runtime not ready?)', file=sys.stderr)
+
+
+def _snapshot(path):
+    """ Get a dict with the mtime and size of all files in the directory.
+    """
+    result = {}
+    for root, dirs, fnames in os.walk(path):
+        for fname in fnames:
+            filename = os.path.join(root, fname)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue  # removed in the meantime
+            result[filename] = st.st_mtime, st.st_size
+    return result
@@ -0,0 +1,117 @@
+"""
+Monitor the resources used by a launched app: the runtime process and
+its children (e.g. the server process).
+"""
+
+import json
+import time
+import threading
+import collections
+
+from ._proc import is_alive, get_children, get_rss, get_cpu_time
+
+
+class Monitor(object):
+    """ Monitor the process tree of a launched app, by sampling it every
+    ``interval`` seconds in a background thread.
+
+    The ``target`` can be a pid, a ``LaunchedApp``, a ``subprocess.Popen``
+    object, or the filename of an instance lock file (as written in
+    single-instance mode). Each sample is a dict with fields "time", "pid",
+    "alive", "rss" (bytes, whole tree), "cpu_percent" (whole tree, can exceed
+    100 on multiple cores), "children" (number of child processes) and
+    "exit_code" (if known). Each sample is passed to ``callback``, and
+    appended as a json line to ``logfile`` if given. The last ``history``
+    samples are available via ``samples``.
+    """
+
+    def __init__(self, target, interval=1.0, callback=None, logfile=None, history=1000):
+        self._process = None
+        if isinstance(target, int):
+            self._pid = target
+        elif isinstance(target, str):
+            with open(target, 'rb') as f:
+                self._pid = json.loads(f.read().decode())['pid']
+        elif hasattr(target, 'exit_code'):  # LaunchedApp
+            self._pid = target.pid
+            self._process = target
+        else:  # Popen
+            self._pid = target.pid
+            self._process = target
+        self._interval = interval
+        self._callback = callback
+        self._logfile = logfile
+        self._samples = collections.deque(maxlen=history)
+        self._last_cpu = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return '<Monitor for pid %i at 0x%x>' % (self._pid, id(self))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def samples(self):
+        """ A list of the most recent samples.
+        """
+        return list(self._samples)
+
+    def start(self):
+        """ Start sampling in a background thread. Sampling stops when
+        the process exits (after a final sample) or when ``stop()`` is called.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """ Stop sampling.
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def sample(self):
+        """ Take a sample now, and return it.
+        """
+        t = time.time()
+        alive = self._exit_code() is None and is_alive(self._pid)
+        pids = [self._pid] + get_children(self._pid) if alive else []
+        cpu = sum(get_cpu_time(pid) for pid in pids)
+        cpu_percent = 0.0
+        if self._last_cpu is not None:
+            t0, cpu0 = self._last_cpu
+            cpu_percent = max(0.0, 100.0 * (cpu - cpu0) / max(t - t0, 1e-6))
+        self._last_cpu = t, cpu
+        sample = dict(time=t, pid=self._pid, alive=alive,
+                      rss=sum(get_rss(pid) for pid in pids),
+                      cpu_percent=cpu_percent, children=max(0, len(pids) - 1),
+                      exit_code=self._exit_code())
+        self._samples.append(sample)
+        if self._logfile:
+            with open(self._logfile, 'ab') as f:
+                f.write(json.dumps(sample).encode() + b'\n')
+        if self._callback is not None:
+            self._callback(sample)
+        return sample
+
+    def _exit_code(self):
+        if self._process is None:
+            return None
+        elif hasattr(self._process, 'exit_code'):
+            return self._process.exit_code
+        return self._process.poll()
+
+    def _run(self):
+        while not self._stop.is_set():
+            sample = self.sample()
+            if not sample['alive']:
+                break
+            self._stop.wait(self._interval)
@@ -3,9 +3,10 @@
 # This module is distributed under the terms of the new BSD License.
 
 """
-Pure python module to handle for reading and writing png files. Written
-for Python 2.7 and Python 3.2+. Can only read PNG's that are not
-interlaced, have a bit depth of 8, and are either RGB or RGBA.
+Pure python module to handle for reading and writing png files. Can read
+and write PNG's that are not interlaced, and are grayscale, grayscale with
+alpha, RGB, RGBA (all with a bit depth of 8), or palette-indexed (bit depth
+1, 2, 4 or 8, with optional alpha).
 """
 
 from __future__ import print_function, division, absolute_import
@@ -13,21 +14,37 @@ from __future__ import print_function, division, absolute_import
 import io
 import struct
 import zlib
+from collections import Counter
 
+# The PNG color type for each mode, and the number of samples per pixel
+COLOR_TYPES = {'gray': 0, 'rgb': 2, 'palette': 3, 'gray_alpha': 4, 'rgba': 6}
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
 
-def write_png(im, shape=None, file=None):
+# The mode that matches the number of channels of an image
+MODES = {1: 'gray', 2: 'gray_alpha', 3: 'rgb', 4: 'rgba'}
+
+
+def write_png(im, shape=None, file=None, mode=None, colors=None):
     """
-    Write a png image. The written image is in RGB or RGBA format, with
-    8 bit precision, and without interlacing.
+    Write a png image. The written image has 8 bit precision (or less for
+    palette images), and no interlacing.
     
     Parameters:
         im (bytes, bytearray, numpy-array): the image data to write.
         shape (tuple): the shape of the image. If ``im`` is a numpy array,
-            the shape can be omitted. The shape can be ``(H, W)`` for
-            grayscale, ``(H, W, 3)`` for RGB and ``(H, W, 4)`` for RGBA.
-            Note that grayscale images are converted to RGB.
+            the shape can be omitted. The shape can be ``(H, W)`` or
+            ``(H, W, 1)`` for grayscale, ``(H, W, 2)`` for grayscale with
+            alpha, ``(H, W, 3)`` for RGB and ``(H, W, 4)`` for RGBA.
         file (file-like object, None): where to write the resulting
             image. If omitted or None, the result is returned as bytes.
+        mode (str, None): the color type to write: 'gray', 'gray_alpha',
+            'rgb', 'rgba' or 'palette'. Converting to a mode that has fewer
+            channels or colors must be lossless, otherwise a ValueError is
+            raised. Use 'auto' to write the smallest lossless variant.
+            Default None writes the mode that matches the shape.
+        colors (int, None): if given, the image is reduced to at most this
+            many colors (at most 256) with ``quantize()``, and written as
+            a palette image. Note that this is lossy.
     """
     
     # Check types
@@ -46,25 +63,59 @@ def write_png(im, shape=None, file=None):
         raise ValueError('Invalid type for im, '
                          'need ndarray, bytearray or bytes, got %r' % type(im))
     
-    # Allow grayscale: convert to RGB
-    if len(shape) == 2 or (len(shape) == 3 and shape[2] == 1):
-        im3 = bytearray(shape[0] * shape[1] * 3)
-        im3[0::3] = im
-        im3[1::3] = im
-        im3[2::3] = im
-        im = im3
-        shape = shape[0], shape[1], 3
-    
     # Check shape
+    if len(shape) == 2:
+        shape = shape[0], shape[1], 1
     if len(shape) != 3:
-        raise ValueError('shape must be 3 elements)')
-    if shape[2] not in (3, 4):
-        raise ValueError('shape[2] must be in (3, 4)')
+        raise ValueError('shape must be 2 or 3 elements')
+    if shape[2] not in (1, 2, 3, 4):
+        raise ValueError('shape[2] must be in (1, 2, 3, 4)')
     if (shape[0] * shape[1] * shape[2]) != len(im):
         raise ValueError('Shape does not match number of elements in image')
+    if mode not in (None, 'auto') and mode not in COLOR_TYPES:
+        raise ValueError('Invalid png mode %r' % mode)
     
-    # Get file object
-    f = io.BytesIO() if file is None else file
+    # Get the candidate encodings
+    h, w = shape[0], shape[1]
+    if colors is not None:
+        if mode not in (None, 'auto', 'palette'):
+            raise ValueError('write_png can only use colors with palette mode')
+        candidates = [_palette_png(w, h, *quantize(im, shape, colors))]
+    elif mode is None or mode == MODES[shape[2]]:
+        candidates = [_encode_png(w, h, COLOR_TYPES[MODES[shape[2]]], 8, im)]
+    else:
+        rgba = _to_rgba(im, shape[2])
+        opaque = rgba[3::4] == b'\xff' * (w * h)
+        gray = rgba[0::4] == rgba[1::4] == rgba[2::4]
+        if mode == 'auto':
+            # The variant with the least channels, and a palette if possible
+            mode = MODES[(1 if gray else 3) + (not opaque)]
+            candidates = [_encode_png(w, h, COLOR_TYPES[mode], 8, _from_rgba(rgba, mode))]
+            palette = _exact_palette(rgba, 256)
+            if palette is not None:
+                candidates.append(_palette_png(w, h, *palette))
+        elif mode == 'palette':
+            palette = _exact_palette(rgba, 256)
+            if palette is None:
+                raise ValueError('Image has more than 256 colors, use colors '
+                                 'to quantize it')
+            candidates = [_palette_png(w, h, *palette)]
+        else:
+            if (mode.startswith('gray') and not gray) or (mode in ('gray', 'rgb') and
+                                                        not opaque):
+                raise ValueError('Cannot write image as %s without loss' % mode)
+            candidates = [_encode_png(w, h, COLOR_TYPES[mode], 8, _from_rgba(rgba, mode))]
+    
+    data = min(candidates, key=len)
+    if file is None:
+        return data
+    file.write(data)
+
+
+def _encode_png(width, height, color_type, bit_depth, im, plte=None, trns=None):
+    """ Encode pixel data (packed scanlines) as png bytes.
+    """
+    f = io.BytesIO()
     
     def add_chunk(data, name):
         name = name.encode('ASCII')
@@ -78,38 +129,180 @@ def write_png(im, shape=None, file=None):
     f.write(b'\x89PNG\x0d\x0a\x1a\x0a')  # header
     
     # First chunk
-    w, h = shape[1], shape[0]
-    depth = 8
-    ctyp = 0b0110 if shape[2] == 4 else 0b0010
-    ihdr = struct.pack('>IIBBBBB', w, h, depth, ctyp, 0, 0, 0)
+    ihdr = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)
     add_chunk(ihdr, 'IHDR')
+    if plte is not None:
+        add_chunk(plte, 'PLTE')
+    if trns:
+        add_chunk(trns, 'tRNS')
     
     # Chunk with pixels. Just one chunk, no fancy filters.
-    line_len = w * shape[2]
-    lines = [im[i*line_len:(i+1)*line_len] for i in range(h)]
+    line_len = len(im) // height
+    lines = [im[i*line_len:(i+1)*line_len] for i in range(height)]
     lines = [b'\x00' + bytes(line) for line in lines]  # prepend filter byt
     pixels_compressed = zlib.compress(b''.join(lines), 9)
     add_chunk(pixels_compressed, 'IDAT')
     
     # Closing chunk
     add_chunk(b'', 'IEND')
+    return f.getvalue()
+
+
+def _palette_png(width, height, indices, palette):
+    """ Encode a palette image, with the smallest bit depth that fits.
+    """
+    bit_depth = 8
+    for depth in (1, 2, 4):
+        if len(palette) <= 2 ** depth:
+            bit_depth = depth
+            break
+    if bit_depth < 8:
+        indices = b''.join(_pack_bits(indices[i*width:(i+1)*width], bit_depth)
+                           for i in range(height))
+    plte = b''.join(color[:3] for color in palette)
+    # Transparent colors come first, so tRNS can omit the opaque ones
+    alphas = bytes(color[3] for color in palette).rstrip(b'\xff')
+    return _encode_png(width, height, 3, bit_depth, indices, plte, alphas)
+
+
+def _pack_bits(values, bit_depth):
+    """ Pack a scanline of small values into bytes, most significant bits first.
+    """
+    per_byte = 8 // bit_depth
+    values = bytes(values) + bytes(-len(values) % per_byte)
+    out = bytearray(len(values) // per_byte)
+    for j in range(per_byte):
+        shift = 8 - bit_depth * (j + 1)
+        for i, value in enumerate(values[j::per_byte]):
+            out[i] |= value << shift
+    return bytes(out)
+
+
+def _to_rgba(im, channels):
+    """ Convert pixel data with the given number of channels to RGBA.
+    """
+    if channels == 4:
+        return bytes(im)
+    n = len(im) // channels
+    rgba = bytearray(n * 4)
+    if channels <= 2:
+        rgba[0::4] = rgba[1::4] = rgba[2::4] = im[0::channels]
+    else:
+        rgba[0::4], rgba[1::4], rgba[2::4] = im[0::3], im[1::3], im[2::3]
+    rgba[3::4] = im[1::2] if channels == 2 else b'\xff' * n
+    return bytes(rgba)
+
+
+def _from_rgba(rgba, mode):
+    """ Select the channels of RGBA data for the given (non-palette) mode.
+    """
+    if mode == 'rgba':
+        return rgba
+    elif mode == 'gray':
+        return rgba[0::4]
+    channels = CHANNELS[COLOR_TYPES[mode]]
+    im = bytearray(len(rgba) // 4 * channels)
+    if mode == 'rgb':
+        im[0::3], im[1::3], im[2::3] = rgba[0::4], rgba[1::4], rgba[2::4]
+    else:
+        im[0::2], im[1::2] = rgba[0::4], rgba[3::4]
+    return bytes(im)
+
+
+def _exact_palette(rgba, max_colors):
+    """ Get ``(indices, palette)`` for RGBA data, or None if it has more than
+    ``max_colors`` colors.
+    """
+    pixels = memoryview(rgba).cast('I')
+    keys = set()
+    for i in range(0, len(pixels), 4096):
+        keys.update(pixels[i:i + 4096])
+        if len(keys) > max_colors:
+            return None
+    return _index_colors(pixels, dict((key, key) for key in keys))
+
+
+def _index_colors(pixels, color_map):
+    """ Create ``(indices, palette)``, given a dict that maps each pixel value
+    (RGBA as native uint32) to its palette color (idem).
+    """
+    colors = sorted(set(color_map.values()),
+                    key=lambda c: (struct.pack('=I', c)[3] == 255, c))
+    index = dict((c, i) for i, c in enumerate(colors))
+    lookup = dict((key, index[c]) for key, c in color_map.items())
+    indices = bytes(map(lookup.__getitem__, pixels))
+    return indices, [struct.pack('=I', c) for c in colors]
+
+
+def quantize(im, shape, colors=256):
+    """
+    Reduce an image to at most ``colors`` colors, using the median cut
+    algorithm (on all four RGBA channels). Returns ``(indices, palette)``,
+    with ``indices`` a bytes object with a palette index per pixel, and
+    ``palette`` a list of RGBA colors (4-byte bytes objects).
+    """
+    if not 1 <= colors <= 256:
+        raise ValueError('quantize() colors must be between 1 and 256')
+    channels = shape[2] if len(shape) == 3 else 1
+    rgba = _to_rgba(im, channels)
+    pixels = memoryview(rgba).cast('I')
+    hist = Counter(pixels)
+    if len(hist) <= colors:
+        return _index_colors(pixels, dict((key, key) for key in hist))
     
-    if file is None:
-        return f.getvalue()
+    # Start with one box with all colors, and split the box with the largest
+    # (range * number of pixels) at the median of its widest channel.
+    unpack = struct.Struct('=I').pack
+    boxes = [[(tuple(bytearray(unpack(key))), count) for key, count in hist.items()]]
+    
+    def box_key(box):
+        if len(box) < 2:
+            return -1, 0
+        ranges = [max(c[0][i] for c in box) - min(c[0][i] for c in box) for i in range(4)]
+        channel = max(range(4), key=ranges.__getitem__)
+        return ranges[channel] * sum(c[1] for c in box), channel
+    
+    keys = [box_key(boxes[0])]
+    while len(boxes) < colors:
+        i = max(range(len(boxes)), key=lambda j: keys[j][0])
+        if keys[i][0] < 0:
+            break  # no box can be split
+        channel = keys[i][1]
+        box = sorted(boxes[i], key=lambda c: c[0][channel])
+        half, total, split = sum(c[1] for c in box) / 2, 0, 1
+        for split in range(1, len(box)):
+            total += box[split - 1][1]
+            if total >= half:
+                break
+        boxes[i:i + 1] = box[:split], box[split:]
+        keys[i:i + 1] = box_key(box[:split]), box_key(box[split:])
+    
+    # Map each color to the (weighted) mean color of its box
+    color_map = {}
+    for box in boxes:
+        n = sum(c[1] for c in box)
+        mean = bytes(int(sum(c[0][i] * c[1] for c in box) / n + 0.5) for i in range(4))
+        key = struct.unpack('=I', mean)[0]
+        for color, count in box:
+            color_map[struct.unpack('=I', bytes(color))[0]] = key
+    return _index_colors(pixels, color_map)
 
 
 def read_png(f, return_ndarray=False):
     """
     Read a png image. This is a simple implementation; can only read
-    PNG's that are not interlaced, have a bit depth of 8, and are either
-    RGB or RGBA.
+    PNG's that are not interlaced, and are grayscale, grayscale with alpha,
+    RGB or RGBA with a bit depth of 8, or palette-indexed. Grayscale images
+    with a bit depth below 8 can be read too.
     
     Parameters:
         f (file-object, bytes): the source to read the png data from.
         return_ndarray (bool): whether to return the result as a numpy array.
             Default False. If False, returns ``(pixel_array, shape)``,
             with ``pixel_array`` a bytearray object and shape being
-            ``(H, W, 3)`` or ``(H, W, 4)``, for RGB and RGBA, respectively.
+            ``(H, W, C)``, with C 1 for grayscale, 2 for grayscale with
+            alpha, 3 for RGB and 4 for RGBA. Palette images are returned as
+            RGB, or as RGBA if the palette has transparency.
     """
     # http://en.wikipedia.org/wiki/Portable_Network_Graphics
     # http://www.libpng.org/pub/png/spec/1.2/PNG-Chunks.html
@@ -146,13 +339,13 @@ def read_png(f, return_ndarray=False):
     compression_method = asint(chunk1[18:19])
     filter_method = asint(chunk1[19:20])
     interlace_method = asint(chunk1[20:21])
-    bytes_per_pixel = 3 + (color_type == 6)
     
     # Check if we can do this ....
-    if bit_depth != 8:
-        raise RuntimeError('Can only deal with bit-depth of 8.')
-    if color_type not in [2, 6]:  # RGB, RGBA
-        raise RuntimeError('Can only deal with RGB or RGBA.')
+    if color_type not in CHANNELS:
+        raise RuntimeError('Invalid PNG color type %r' % color_type)
+    if bit_depth != 8 and not (color_type in (0, 3) and bit_depth in (1, 2, 4)):
+        raise RuntimeError('Can only deal with bit-depth of 8 (or less for '
+                           'grayscale and palette).')
     if interlace_method != 0:
         raise RuntimeError('Can only deal with non-interlaced.')
     if filter_method != 0:
@@ -161,8 +354,8 @@ def read_png(f, return_ndarray=False):
         # this should be the case for any PNG
         raise RuntimeError('Expected PNG compression param to be 0.')
     
-    # If this is the case ... extract pixel info
-    lines, prev = [], None
+    # Collect the palette and the pixel data (which may span multiple chunks)
+    plte, trns, idat = b'', b'', []
     while True:
         chunk = bb[chunk_pointer:]
         if not chunk:
@@ -171,37 +364,67 @@ def read_png(f, return_ndarray=False):
         chunk_pointer += 12 + chunk_length
         if chunk[4:8] == b'IEND':
             break
+        elif chunk[4:8] == b'PLTE':
+            plte = bytes(chunk[8:8+chunk_length])
+        elif chunk[4:8] == b'tRNS':
+            trns = bytes(chunk[8:8+chunk_length])
         elif chunk[4:8] == b'IDAT':  # Pixel data
-            # Decompress and unfilter
-            pixels_compressed = chunk[8:8+chunk_length]
-            pixels_raw = zlib.decompress(pixels_compressed)
-            s = width * bytes_per_pixel + 1  # stride
-            #print(pixels_raw[0::s])  # show filters in use
-            for i in range(height):
-                prev = _png_scanline(pixels_raw[i*s:i*s+s], prev=prev)
-                lines.append(prev)
-            
-    # Combine scanlines from all chunks
-    im = bytearray(sum([len(line) for line in lines]))
-    i = 0
-    line_len = width * bytes_per_pixel
-    for line in lines:
-        if not len(line) == line_len:  # noqa
+            idat.append(chunk[8:8+chunk_length])
+    
+    # Decompress and unfilter
+    pixels_raw = zlib.decompress(b''.join(idat))
+    bits_per_pixel = CHANNELS[color_type] * bit_depth
+    bytes_per_pixel = max(1, bits_per_pixel // 8)  # for unfiltering
+    line_len = (width * bits_per_pixel + 7) // 8
+    s = line_len + 1  # stride
+    #print(pixels_raw[0::s])  # show filters in use
+    lines, prev = [], bytearray(line_len)  # line above the first
+    for i in range(height):
+        prev = _png_scanline(pixels_raw[i*s:i*s+s], bytes_per_pixel, prev)
+        if not len(prev) == line_len:  # noqa
             raise RuntimeError('Line length mismatch while reading png.')
-        im[i:i+line_len] = line
-        i += line_len
+        lines.append(prev)
     
-    shape = height, width, bytes_per_pixel
+    # Unpack samples of less than 8 bits, scaling gray values to 0-255
+    if bit_depth < 8:
+        table = _unpack_table(bit_depth, scale=color_type == 0)
+        lines = [b''.join(map(table.__getitem__, line))[:width] for line in lines]
+    im = bytearray().join(lines)
+    channels = CHANNELS[color_type]
+    
+    # Expand palette
+    if color_type == 3:
+        channels = 4 if trns else 3
+        alphas = trns + b'\xff' * 256
+        palette = [plte[i*3:i*3+3] + alphas[i:i+1] * (channels == 4)
+                   for i in range(len(plte) // 3)]
+        try:
+            im = bytearray().join(map(palette.__getitem__, im))
+        except IndexError:
+            raise RuntimeError('PNG pixel refers to a color not in the palette')
+    
+    shape = height, width, channels
     
     # Done
     if return_ndarray:
         import importlib
         numpy = importlib.import_module("numpy")
-        return np.frombuffer(im, 'uint8').reshape(shape)
+        return numpy.frombuffer(im, 'uint8').reshape(shape)
     else:
         return im, shape
 
 
+def _unpack_table(bit_depth, scale=False):
+    """ Get a list that maps each byte to the values of its samples of
+    ``bit_depth`` bits, optionally scaled to the range 0-255.
+    """
+    per_byte = 8 // bit_depth
+    mask = 2 ** bit_depth - 1
+    factor = 255 // mask if scale else 1
+    return [bytes(((b >> (8 - bit_depth * (j + 1))) & mask) * factor
+                  for j in range(per_byte)) for b in range(256)]
+
+
 def _png_scanline(line_bytes, fu=4, prev=None):
     """ Scanline unfiltering, taken from png.py
     """
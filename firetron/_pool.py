@@ -0,0 +1,140 @@
+"""
+A pool of prepared app directories, for launching many runtimes (e.g.
+in test suites) without paying for directory setup and first-run profile
+costs each time.
+"""
+
+import os
+import atexit
+import shutil
+import tempfile
+import threading
+
+from ._profile import create_profile_template, copy_profile_template
+
+
+class AppDirPool(object):
+    """ A pool of ``size`` prepared app directories, each with a profile
+    dir that is seeded from a startup-tuned profile template. Directories
+    are leased to launches (see ``lease()``), and reset and reused when
+    released. At most ``max_concurrent`` leases (default ``size``) can be
+    active at the same time; further leases block. All directories are
+    removed on ``close()``, which is also called at exit; directories that
+    are still leased at that point are removed when they are released.
+    """
+
+    def __init__(self, size=4, max_concurrent=None, prefs=None):
+        self._tempdir = tempfile.mkdtemp(prefix='firetron_pool_')
+        self._template = os.path.join(self._tempdir, 'profile_template')
+        create_profile_template(self._template, prefs)
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_concurrent or size)
+        self._free = [self._create_slot() for i in range(size)]
+        self._leased = set()
+        self._closed = False
+        atexit.register(self.close)
+
+    def __repr__(self):
+        return '<AppDirPool with %i free dirs at 0x%x>' % (len(self._free), id(self))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def lease(self, timeout=None):
+        """ Get an ``AppDirLease``, waiting at most ``timeout`` seconds if
+        the maximum number of leases is active. Release it with
+        ``release()``, or use it as a context manager.
+        """
+        if self._closed:
+            raise RuntimeError('Cannot lease from a closed AppDirPool')
+        if not self._semaphore.acquire(timeout=timeout):
+            raise RuntimeError('Timeout waiting for a free app dir')
+        try:
+            with self._lock:
+                path = self._free.pop(0) if self._free else None
+            if path is None:
+                path = self._create_slot()
+            with self._lock:
+                if self._closed:
+                    shutil.rmtree(path, ignore_errors=True)
+                    raise RuntimeError('Cannot lease from a closed AppDirPool')
+                self._leased.add(path)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return AppDirLease(self, path)
+
+    def close(self):
+        """ Remove all app directories that are not leased. The pool's
+        temporary directory is removed when the last lease is released.
+        """
+        with self._lock:
+            self._closed = True
+            free, self._free = self._free, []
+            paths = free if self._leased else [self._tempdir]
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _create_slot(self):
+        path = tempfile.mkdtemp(prefix='firetron_', dir=self._tempdir)
+        copy_profile_template(self._template, os.path.join(path, 'stub_profile'))
+        return path
+
+    def _release(self, path):
+        try:
+            if not self._closed:
+                # Reset the profile; the XUL app is updated incrementally on reuse
+                profile_dir = os.path.join(path, 'stub_profile')
+                shutil.rmtree(profile_dir, ignore_errors=True)
+                copy_profile_template(self._template, profile_dir)
+            with self._lock:
+                self._leased.discard(path)
+                if not self._closed:
+                    self._free.append(path)
+                    return
+                # Closed while leased
+                path = path if self._leased else self._tempdir
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            self._semaphore.release()
+
+
+class AppDirLease(object):
+    """ A leased app directory from an ``AppDirPool``.
+    """
+
+    def __init__(self, pool, path):
+        self._pool = pool
+        self._path = path
+
+    def __repr__(self):
+        return '<AppDirLease %r at 0x%x>' % (self._path, id(self))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    @property
+    def path(self):
+        """ The app directory. The XUL app goes in its "xul" subdir.
+        """
+        return self._path
+
+    @property
+    def profile_dir(self):
+        """ The profile directory, seeded from the pool's profile template.
+        """
+        return os.path.join(self._path, 'stub_profile')
+
+    def release(self):
+        """ Give the directory back to the pool. Can safely be called
+        multiple times.
+        """
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool._release(self._path)
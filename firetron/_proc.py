@@ -0,0 +1,110 @@
+"""
+Functions to inspect running processes. Uses psutil if available, and
+falls back to /proc on Linux.
+"""
+
+import os
+import sys
+import importlib
+
+try:
+    psutil = importlib.import_module('psutil')
+except ImportError:
+    psutil = None
+
+
+def _check():
+    if psutil is None and not os.path.isdir('/proc/self'):
+        raise RuntimeError('Inspecting processes needs psutil (pip install psutil) '
+                           'on %s' % sys.platform)
+
+
+def is_alive(pid):
+    """ Get whether the process with the given pid exists.
+    """
+    if psutil is not None:
+        return psutil.pid_exists(pid)
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def get_children(pid):
+    """ Get a list of the pids of all (recursive) child processes of the
+    given process.
+    """
+    _check()
+    if psutil is not None:
+        try:
+            return [p.pid for p in psutil.Process(pid).children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+    # Map parents to children
+    children = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            stat = _read_proc_stat(int(name))
+            if stat:
+                children.setdefault(int(stat[1]), []).append(int(name))
+    result, todo = [], [pid]
+    while todo:
+        for child in children.get(todo.pop(0), []):
+            result.append(child)
+            todo.append(child)
+    return result
+
+
+def get_rss(pid):
+    """ Get the resident memory of the given process in bytes (0 if the
+    process does not exist).
+    """
+    _check()
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.NoSuchProcess:
+            return 0
+    try:
+        with open('/proc/%i/statm' % pid, 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def get_cpu_time(pid):
+    """ Get the CPU time (user + system) used by the given process in
+    seconds (0 if the process does not exist).
+    """
+    _check()
+    if psutil is not None:
+        try:
+            t = psutil.Process(pid).cpu_times()
+            return t.user + t.system
+        except psutil.NoSuchProcess:
+            return 0.0
+    stat = _read_proc_stat(pid)
+    if not stat:
+        return 0.0
+    return (int(stat[11]) + int(stat[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def get_tree_rss(pid):
+    """ Get the total resident memory of a process and its children in bytes.
+    """
+    return sum(get_rss(p) for p in [pid] + get_children(pid))
+
+
+def _read_proc_stat(pid):
+    """ Read /proc/pid/stat and return the fields after the command name,
+    starting with the state. Returns None if the process does not exist.
+    """
+    try:
+        with open('/proc/%i/stat' % pid, 'rb') as f:
+            text = f.read().decode(errors='ignore')
+    except OSError:
+        return None
+    return text[text.rindex(')') + 2:].split()
@@ -0,0 +1,166 @@
+"""
+Create profile templates that are tuned for a fast startup, so that
+each launch can start from a pre-seeded profile.
+"""
+
+import os
+import json
+import time
+import shutil
+import subprocess
+from collections import OrderedDict
+
+from ._fileutils import write_tree, list_files, file_hash
+
+
+STAMP_NAME = 'firetron-template.txt'
+
+# Tells the XUL app to quit once it has started, to pre-warm a profile
+WARMUP_ENV = 'FIRETRON_WARMUP'
+
+# Seconds that the startupCache must be unchanged to count as written
+CACHE_SETTLE_TIME = 2.0
+
+# Prefs that disable first-run work and background services
+STARTUP_PREFS = OrderedDict([
+    # First-run and migration
+    ("browser.shell.checkDefaultBrowser", False),
+    ("browser.startup.homepage_override.mstone", "ignore"),
+    ("startup.homepage_welcome_url", ""),
+    ("browser.aboutwelcome.enabled", False),
+    ("browser.disableResetPrompt", True),
+    ("datareporting.policy.firstRunURL", ""),
+    # Session restore
+    ("browser.startup.page", 0),
+    ("browser.sessionstore.resume_from_crash", False),
+    ("browser.sessionstore.max_resumed_crashes", 0),
+    ("toolkit.startup.max_resumed_crashes", -1),
+    # Telemetry
+    ("toolkit.telemetry.enabled", False),
+    ("toolkit.telemetry.unified", False),
+    ("toolkit.telemetry.archive.enabled", False),
+    ("datareporting.healthreport.uploadEnabled", False),
+    ("datareporting.policy.dataSubmissionEnabled", False),
+    ("app.normandy.enabled", False),
+    ("browser.ping-centre.telemetry", False),
+    # Updates
+    ("app.update.enabled", False),
+    ("app.update.auto", False),
+    ("app.update.checkInstallTime", False),
+    ("extensions.update.enabled", False),
+    ("extensions.getAddons.cache.enabled", False),
+    ("extensions.blocklist.enabled", False),
+    ("browser.search.update", False),
+    # Safebrowsing
+    ("browser.safebrowsing.malware.enabled", False),
+    ("browser.safebrowsing.phishing.enabled", False),
+    ("browser.safebrowsing.downloads.enabled", False),
+    ("browser.safebrowsing.blockedURIs.enabled", False),
+    # Network probes
+    ("network.captive-portal-service.enabled", False),
+    ("network.connectivity-service.enabled", False),
+])
+
+
+def create_profile_template(path, prefs=None, exe=None, app=None, timeout=20):
+    """ Create a profile template at the given directory.
+
+    The template contains a ``user.js`` with ``STARTUP_PREFS`` (updated
+    with the given ``prefs`` dict), so that the runtime skips first-run work
+    and background services. If ``exe`` is given, the runtime is started once
+    (headless, with the XUL app at ``app`` if given) to pre-warm the profile,
+    most notably the startupCache.
+    """
+    all_prefs = OrderedDict(STARTUP_PREFS)
+    all_prefs.update(prefs or {})
+    lines = ['// Prefs for fast startup, generated by firetron']
+    for key, val in all_prefs.items():
+        lines.append('user_pref({}, {});'.format(json.dumps(key), json.dumps(val)))
+    user_js = '\n'.join(lines) + '\n'
+
+    write_tree(path, {'user.js': user_js.encode()})
+    if exe:
+        _warm_profile(path, exe, app, timeout)
+
+    # The stamp identifies this version of the template
+    stamp = ['%s %s' % (file_hash(os.path.join(path, fname)), fname)
+             for fname in list_files(path)]
+    with open(os.path.join(path, STAMP_NAME), 'wb') as f:
+        f.write('\n'.join(stamp).encode())
+
+
+def copy_profile_template(template, path):
+    """ Copy the profile template to the given profile directory. If the
+    profile was already created from the same version of the template,
+    nothing is done. Returns whether files were copied.
+    """
+    stamp1 = os.path.join(template, STAMP_NAME)
+    stamp2 = os.path.join(path, STAMP_NAME)
+    if os.path.isfile(stamp2):
+        with open(stamp1, 'rb') as f1, open(stamp2, 'rb') as f2:
+            if f1.read() == f2.read():
+                return False
+    # Copy the files, the stamp last, so that an interrupted copy is redone
+    for fname in list_files(template):
+        if fname == STAMP_NAME:
+            continue
+        filename = os.path.join(path, fname)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        shutil.copy2(os.path.join(template, fname), filename)
+    shutil.copy2(stamp1, stamp2)
+    return True
+
+
+def _warm_profile(path, exe, app, timeout):
+    """ Run the runtime once on the profile, so that it writes its
+    startupCache. A XUL app quits by itself once it has started (see
+    ``WARMUP_ENV``), otherwise the runtime is stopped when the startupCache
+    file has stopped changing. It is terminated if it is not done within
+    ``timeout`` seconds.
+    """
+    cmd = [exe]
+    if app:
+        cmd += ['--app', os.path.join(app, 'application.ini')]
+    cmd += ['--headless', '-no-remote', '-profile', path]
+    env = dict(os.environ)
+    env[WARMUP_ENV] = '1'
+    p = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    try:
+        etime = time.time() + timeout
+        state, changed = None, time.time()
+        while time.time() < etime and p.poll() is None:
+            new_state = _get_startup_cache_state(path)
+            if new_state != state:
+                state, changed = new_state, time.time()
+            elif state and time.time() - changed > CACHE_SETTLE_TIME:
+                break
+            time.sleep(0.1)
+    finally:
+        if p.poll() is None:
+            p.terminate()
+            try:
+                p.wait(timeout)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                p.wait()
+    # Remove lock files, the profile is to be copied
+    for fname in ('lock', '.parentlock', 'parent.lock'):
+        filename = os.path.join(path, fname)
+        if os.path.lexists(filename):
+            os.remove(filename)
+
+
+def _get_startup_cache_state(path):
+    """ Get the names, sizes and mtimes of the startupCache files in a
+    profile (e.g. "startupCache.8.little"), to see when they are written.
+    """
+    cache_dir = os.path.join(path, 'startupCache')
+    if not os.path.isdir(cache_dir):
+        return ()
+    state = []
+    for fname in sorted(os.listdir(cache_dir)):
+        if fname.startswith('startupCache.'):
+            st = os.stat(os.path.join(cache_dir, fname))
+            state.append((fname, st.st_size, st.st_mtime))
+    return tuple(state)
@@ -0,0 +1,25 @@
+"""
+Functions for use in a server process that is started by a firetron app.
+"""
+
+import os
+
+
+READY_FILE_ENV = 'FIRETRON_READY_FILE'
+
+
+def notify_ready(port):
+    """ Signal to the app that the server is ready and listening on the
+    given port, so that the window can load its content. Servers should
+    preferably bind to port 0 and report the port that they got. Returns
+    False if the server was not started by a firetron app.
+    """
+    filename = os.environ.get(READY_FILE_ENV)
+    if not filename:
+        return False
+    # Write to a temp file and rename, so the app never reads a partial file
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(str(int(port)).encode())
+    os.replace(tmp, filename)
+    return True
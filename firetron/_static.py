@@ -0,0 +1,132 @@
+"""
+Bundle static html/js/css assets, so they can be served from chrome://
+as part of a XUL application.
+"""
+
+import os
+import re
+import json
+import hashlib
+import posixpath
+from collections import OrderedDict
+
+
+# Files of these types are scanned for references to other assets
+TEXT_EXTENSIONS = '.html', '.htm', '.css', '.js', '.svg'
+
+# Files of these types keep their name, since they are entry points
+ENTRY_EXTENSIONS = '.html', '.htm'
+
+MANIFEST_NAME = 'firetron-manifest.json'
+
+_ref_pattern = re.compile(r"""(["'(])([^"'()\s<>]+?)([?#][^"'()\s<>]*)?(["')])""")
+
+
+def bundle_assets(source_dir, minify=False):
+    """ Bundle the assets in the given directory.
+
+    Files get a content-hashed name (except html files, since these are
+    entry points), and references to them in html, css, js and svg files
+    are rewritten. If ``minify`` is True, comments and superfluous
+    whitespace are removed from css, and comments from html.
+
+    Returns a dict that maps relative (posix) paths to bytes. This
+    includes a json manifest that maps the original names to the new names.
+    """
+    if not os.path.isdir(source_dir):
+        raise ValueError('Asset directory does not exist: %r' % source_dir)
+
+    # Collect sources
+    sources = OrderedDict()
+    for root, dirs, fnames in os.walk(source_dir):
+        dirs.sort()
+        for fname in sorted(fnames):
+            filename = os.path.join(root, fname)
+            relpath = os.path.relpath(filename, source_dir).replace(os.sep, '/')
+            with open(filename, 'rb') as f:
+                sources[relpath] = f.read()
+    if MANIFEST_NAME in sources:
+        raise ValueError('Asset directory cannot contain %r' % MANIFEST_NAME)
+
+    # Process files, dependencies first
+    manifest = {}  # original name -> new name
+    files = OrderedDict()
+    busy, cyclic = set(), set()
+
+    def process(relpath):
+        if relpath in manifest:
+            return
+        busy.add(relpath)
+        data = sources[relpath]
+        ext = posixpath.splitext(relpath)[1].lower()
+        if ext in TEXT_EXTENSIONS:
+            text = data.decode('utf-8')
+            for dep in _find_references(relpath, text, sources):
+                if dep in busy:
+                    cyclic.add(dep)  # files in a cycle keep their name
+                else:
+                    process(dep)
+            text = _rewrite_references(relpath, text, manifest)
+            if minify:
+                text = _minify(text, ext)
+            data = text.encode('utf-8')
+        if ext in ENTRY_EXTENSIONS or relpath in cyclic:
+            newpath = relpath
+        else:
+            newpath = _hashed_name(relpath, data)
+        busy.discard(relpath)
+        manifest[relpath] = newpath
+        files[newpath] = data
+
+    for relpath in sources:
+        process(relpath)
+
+    files[MANIFEST_NAME] = json.dumps(manifest, indent=2, sort_keys=True).encode()
+    return files
+
+
+def _hashed_name(relpath, data):
+    base, ext = posixpath.splitext(relpath)
+    return base + '.' + hashlib.sha1(data).hexdigest()[:10] + ext
+
+
+def _resolve(relpath, ref):
+    """ Resolve a reference in the given file to a relative path, or None.
+    """
+    if '://' in ref or ref.startswith(('/', 'data:', 'mailto:', 'javascript:')):
+        return None
+    return posixpath.normpath(posixpath.join(posixpath.dirname(relpath), ref))
+
+
+def _find_references(relpath, text, sources):
+    deps = []
+    for m in _ref_pattern.finditer(text):
+        dep = _resolve(relpath, m.group(2))
+        if dep in sources and dep != relpath and dep not in deps:
+            deps.append(dep)
+    return deps
+
+
+def _rewrite_references(relpath, text, manifest):
+
+    def replace(m):
+        ref = m.group(2)
+        dep = _resolve(relpath, ref)
+        if dep not in manifest or manifest[dep] == dep:
+            return m.group(0)
+        newbase = posixpath.basename(manifest[dep])
+        ref = ref[:len(ref) - len(posixpath.basename(ref))] + newbase
+        return m.group(1) + ref + (m.group(3) or '') + m.group(4)
+
+    return _ref_pattern.sub(replace, text)
+
+
+def _minify(text, ext):
+    if ext == '.css':
+        text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+        text = re.sub(r'\s+', ' ', text)
+        text = re.sub(r'\s*([{};,])\s*', r'\1', text)
+        return text.strip()
+    elif ext in ('.html', '.htm'):
+        return re.sub(r'<!--(?!\[if).*?-->', '', text, flags=re.S)
+    return text
@@ -0,0 +1,55 @@
+"""
+Read the startup timing marks that main.js writes, to get insight into
+where launch time goes.
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict
+
+
+TIMING_FILE_ENV = 'FIRETRON_TIMING_FILE'
+LAUNCH_TIME_ENV = 'FIRETRON_LAUNCH_TIME'
+
+# The marks, in the order in which they normally occur
+MARKS = ('launch', 'process', 'main', 'script', 'window_load',
+         'first_paint', 'content_load', 'content_paint')
+
+
+def timing_env(filename):
+    """ Get a dict of environment variables to launch a runtime with, so
+    that main.js writes its timing marks to the given file. Also marks
+    the current time as the launch time.
+    """
+    return {TIMING_FILE_ENV: os.path.abspath(filename),
+            LAUNCH_TIME_ENV: repr(time.time() * 1000)}
+
+
+def read_startup_marks(filename, timeout=10.0):
+    """ Read the raw timing marks (ms since the epoch) from the given file.
+    Waits for the file to appear for at most ``timeout`` seconds.
+    """
+    etime = time.time() + timeout
+    while not os.path.isfile(filename):
+        if time.time() > etime:
+            raise RuntimeError('No startup timing was written to %r' % filename)
+        time.sleep(0.02)
+    with open(filename, 'rb') as f:
+        return json.loads(f.read().decode())
+
+
+def read_startup_timing(filename, timeout=10.0):
+    """ Get a startup breakdown from the timing marks in the given file.
+    Returns an ordered dict that maps each mark to the time in ms since
+    the previous mark, plus "total" for the time from the first to the
+    last mark. See ``MARKS`` for the possible marks.
+    """
+    marks = read_startup_marks(filename, timeout)
+    names = sorted([name for name in MARKS if name in marks],
+                   key=lambda name: (marks[name], MARKS.index(name)))
+    result = OrderedDict()
+    for prev, name in zip(names[:1] + names, names):
+        result[name] = marks[name] - marks[prev]
+    result['total'] = marks[names[-1]] - marks[names[0]] if names else 0.0
+    return result
@@ -0,0 +1,34 @@
+import pytest
+
+from firetron._bench import bench_codecs, save_codec_baseline, check_codec_baseline
+
+
+def case(mbps, peak_mem=1000, size=100):
+    return dict(mbps=mbps, peak_mem=peak_mem, size=size)
+
+
+def test_codec_case_names_include_icon_sizes():
+    names1 = set(bench_codecs((16, ), repeat=1))
+    names2 = set(bench_codecs((16, 32), repeat=1))
+    assert 'ico/write/16' in names1 and 'ico/write/16-32' in names2
+    assert 'icns/write/16-32' in names2
+    # Cases with the same name measured the same thing
+    assert not {name for name in names1 & names2 if name.startswith(('ico', 'icns'))}
+
+
+def test_codec_baseline_throughput_is_opt_in_and_relative(tmpdir):
+    filename = str(tmpdir.join('baseline.json'))
+    save_codec_baseline(dict(calibration=case(10), foo=case(100)), filename)
+    # A machine that is twice as slow
+    slow = dict(calibration=case(5), foo=case(50))
+    assert check_codec_baseline(slow, filename) == []
+    assert check_codec_baseline(slow, filename, check_throughput=True) == []
+    # An actual regression
+    slower = dict(calibration=case(10), foo=case(50))
+    assert check_codec_baseline(slower, filename) == []
+    assert len(check_codec_baseline(slower, filename, check_throughput=True)) == 1
+    with pytest.raises(ValueError):
+        check_codec_baseline(dict(foo=case(100)), filename, check_throughput=True)
+    # Memory and size are always checked
+    bigger = dict(calibration=case(10), foo=case(100, peak_mem=2000, size=101))
+    assert len(check_codec_baseline(bigger, filename)) == 2
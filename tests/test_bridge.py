@@ -0,0 +1,106 @@
+import json
+import socket
+import struct
+import threading
+
+import pytest
+
+from firetron._bridge import Bridge, BRIDGE_PORT_ENV, KIND_TOKEN, KIND_JSON
+
+
+class EchoApp(object):
+    # Stands in for the app side of the bridge (see main.js): checks the
+    # token, then sends every frame back
+
+    def __init__(self, token='secret'):
+        self.token = token
+        self.frames = 0
+        self._server = socket.socket()
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def _read_frame(self, f):
+        head = f.read(5)
+        if len(head) < 5:
+            return None, None
+        size, kind = struct.unpack('>IB', head)
+        return kind, f.read(size - 1)
+
+    def _run(self):
+        conn, _ = self._server.accept()
+        with conn, conn.makefile('rb') as f:
+            kind, payload = self._read_frame(f)
+            if kind != KIND_TOKEN or payload.decode() != self.token:
+                return
+            while True:
+                kind, payload = self._read_frame(f)
+                if kind is None:
+                    return
+                if kind == KIND_JSON and json.loads(payload.decode()) == 'bye':
+                    return
+                self.frames += 1
+                conn.sendall(struct.pack('>IB', len(payload) + 1, kind) + payload)
+
+    def close(self):
+        self._thread.join(5)
+        self._server.close()
+
+
+def test_bridge_echo():
+    app = EchoApp()
+    messages = [b'\x00binary\xff', {'a': [1, 2.5, None]}, 'text', b'x' * 2**20, 42, b'']
+    with Bridge(app.port, app.token) as bridge:
+        for message in messages:
+            bridge.send(message)
+        assert bridge.flush(5)
+        assert bridge.buffered_amount == 0
+        assert [bridge.recv(5) for message in messages] == messages
+        assert bridge.recv(0.01) is None
+        bridge.send('bye')
+        # The app closed the connection
+        assert list(bridge) == []
+        assert bridge.closed
+        with pytest.raises(RuntimeError):
+            bridge.send(b'more')
+    app.close()
+
+
+def test_bridge_callback_and_backpressure(monkeypatch):
+    app = EchoApp()
+    monkeypatch.setenv(BRIDGE_PORT_ENV, str(app.port))
+    received = []
+    done = threading.Event()
+
+    def callback(message):
+        received.append(message)
+        if len(received) == 200:
+            done.set()
+
+    bridge = Bridge(token=app.token, callback=callback, max_buffer=1000)
+    for i in range(200):
+        bridge.send(bytes([i % 256]) * 100)  # blocks while 1000 bytes are pending
+        assert bridge.buffered_amount <= 1000 + 105
+    assert done.wait(5)
+    assert received == [bytes([i % 256]) * 100 for i in range(200)]
+    bridge.send('bye')
+    bridge.close()
+    app.close()
+    assert app.frames == 200
+
+
+def test_bridge_wrong_token():
+    app = EchoApp()
+    bridge = Bridge(app.port, 'wrong')
+    assert bridge.recv(5) is None
+    assert bridge.closed
+    bridge.close()
+    app.close()
+
+
+def test_bridge_needs_port(monkeypatch):
+    monkeypatch.delenv(BRIDGE_PORT_ENV, raising=False)
+    with pytest.raises(RuntimeError):
+        Bridge()
@@ -0,0 +1,14 @@
+import pytest
+
+from firetron.__main__ import _build_bundle
+
+
+@pytest.mark.parametrize('key, value', [('target_dir', 'other'), ('include_firefox', True),
+                                        ('cache_dir', 'cache'), ('incremental', True)])
+def test_bundle_options_must_match(key, value):
+    builds = [dict(target_dir='dist', name='foo', app='http://localhost'),
+              dict(target_dir='dist', name='bar', app='http://localhost')]
+    builds[1][key] = value
+    with pytest.raises(ValueError) as err:
+        _build_bundle(builds)
+    assert key in str(err.value) and 'bar' in str(err.value)
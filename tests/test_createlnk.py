@@ -0,0 +1,47 @@
+import pytest
+
+from firetron._createlnk import create_lnk, create_lnks, read_lnk, lnk_matches
+
+
+@pytest.fixture
+def kwargs(tmpdir):
+    # The target must exist, because its file info is stored in the shortcut
+    target = tmpdir.mkdir("Foo App").join("foo.exe")
+    target.write("x")
+    return dict(target=str(target), arguments='--app "x y"', work_dir=str(tmpdir),
+                comment="Run foo", icon="C:\\icons\\foo.ico", run_mode="maximized")
+
+
+def test_lnk_roundtrip(kwargs):
+    data = create_lnk(None, timestamp=1500000000, **kwargs)
+    info = read_lnk(data)
+    assert info["target"].endswith("Foo App/foo.exe")
+    assert info["target_levels"][-1]["name"] == "foo.exe"
+    assert info["arguments"] == kwargs["arguments"]
+    assert info["work_dir"] == kwargs["work_dir"]
+    assert info["comment"] == kwargs["comment"]
+    assert info["icon"] == kwargs["icon"]
+    assert info["run_mode"] == "maximized"
+    assert info["mtime"] == 1500000000
+    assert lnk_matches(data, **kwargs)
+    assert not lnk_matches(data, **dict(kwargs, arguments="--other"))
+
+
+@pytest.mark.parametrize("timestamp", [0, 315532799, 315532800, 4200000000])
+def test_lnk_timestamps_outside_dos_range(kwargs, timestamp):
+    data = create_lnk(None, timestamp=timestamp, **kwargs)
+    assert read_lnk(data)["mtime"] == timestamp
+    assert create_lnk(None, timestamp=timestamp, **kwargs) == data
+
+
+def test_lnk_source_date_epoch(kwargs, monkeypatch):
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "0")
+    data = create_lnk(None, **kwargs)
+    assert data == create_lnk(None, timestamp=0, **kwargs)
+    results = create_lnks([dict(path=None, **kwargs), dict(path=None, **kwargs)])
+    assert results == [data, data]
+
+
+def test_lnk_invalid(kwargs):
+    with pytest.raises(ValueError):
+        read_lnk(create_lnk(None, timestamp=0, **kwargs)[:30])
@@ -0,0 +1,94 @@
+import os
+import io
+import json
+import zipfile
+import hashlib
+
+import pytest
+
+from firetron._delta import create_patch, apply_patch, make_delta, apply_delta
+
+
+def write_tree(path, files):
+    for fname, data in files.items():
+        filename = os.path.join(path, *fname.split('/'))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+
+def read_tree(path):
+    files = {}
+    for dirpath, _, fnames in os.walk(path):
+        for fname in fnames:
+            filename = os.path.join(dirpath, fname)
+            with open(filename, 'rb') as f:
+                files[os.path.relpath(filename, path).replace(os.sep, '/')] = f.read()
+    return files
+
+
+def test_delta_roundtrip():
+    old = os.urandom(10000)
+    cases = [old, old[:5000] + b'inserted' + old[5000:], old[6000:] + old[:6000],
+             os.urandom(3000), b'', old + old]
+    for new in cases:
+        assert apply_delta(old, make_delta(old, new)) == new
+    assert apply_delta(b'', make_delta(b'', old)) == old
+
+
+def test_patch_roundtrip(tmpdir):
+    old_dir, new_dir = str(tmpdir.join('old')), str(tmpdir.join('new'))
+    lib = os.urandom(50000)
+    write_tree(old_dir, {'app': b'v1', 'lib/big.so': lib, 'gone.txt': b'x', 'moved.txt': b'm'})
+    write_tree(new_dir, {'app': b'v2', 'lib/big.so': lib[:100] + b'patch' + lib[100:],
+                         'sub/moved.txt': b'm', 'new.txt': b'new'})
+    patch = create_patch(old_dir, new_dir)
+    assert len(patch) < 10000  # the library is stored as a delta
+    changed = apply_patch(patch, old_dir)
+    assert read_tree(old_dir) == read_tree(new_dir)
+    assert changed == ['app', 'gone.txt', 'lib/big.so', 'moved.txt', 'new.txt', 'sub/moved.txt']
+    # Applying again fails, because the dir is no longer the old version
+    with pytest.raises(RuntimeError):
+        apply_patch(patch, old_dir)
+
+
+def make_patch(files, old=None):
+    manifest = dict(version=1, old=old or {}, files=files)
+    f = io.BytesIO()
+    with zipfile.ZipFile(f, 'w') as zf:
+        zf.writestr('patch.json', json.dumps(manifest))
+        for entry in files.values():
+            zf.writestr('data/' + entry['sha256'], b'evil')
+    return f.getvalue()
+
+
+@pytest.mark.parametrize('fname', ['../evil.txt', 'sub/../../evil.txt', '/tmp/evil.txt',
+                                   '..\\evil.txt', 'C:evil.txt', 'C:\\evil.txt', ''])
+def test_patch_rejects_paths_outside(tmpdir, fname):
+    app_dir = str(tmpdir.join('app'))
+    write_tree(app_dir, {'app': b'v1'})
+    sha = hashlib.sha256(b'evil').hexdigest()
+    patch = make_patch({fname: dict(sha256=sha, mode=0o644, op='data')})
+    with pytest.raises(RuntimeError):
+        apply_patch(patch, app_dir)
+    assert not os.path.exists(str(tmpdir.join('evil.txt')))
+    assert read_tree(app_dir) == {'app': b'v1'}
+    # Sources are checked too
+    patch = make_patch({'app': dict(sha256=sha, mode=0o644, op='copy', source=fname)},
+                       old={fname: sha})
+    with pytest.raises(RuntimeError):
+        apply_patch(patch, app_dir)
+
+
+def test_patch_rejects_symlink_escape(tmpdir):
+    if not hasattr(os, 'symlink'):
+        pytest.skip('no symlinks')
+    app_dir = str(tmpdir.join('app'))
+    write_tree(app_dir, {'app': b'v1'})
+    os.mkdir(str(tmpdir.join('outside')))
+    os.symlink(str(tmpdir.join('outside')), os.path.join(app_dir, 'link'))
+    sha = hashlib.sha256(b'evil').hexdigest()
+    patch = make_patch({'link/evil.txt': dict(sha256=sha, mode=0o644, op='data')})
+    with pytest.raises(RuntimeError):
+        apply_patch(patch, app_dir)
+    assert os.listdir(str(tmpdir.join('outside'))) == []
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from firetron import _freeze
+from firetron._bench import _fake_pyinstaller
+from firetron._icon import Icon
+from firetron._freeze import create_app, create_apps, BUILD_MANIFEST_NAME
+
+
+@pytest.fixture
+def assets(tmpdir):
+    path = tmpdir.mkdir('assets')
+    path.join('index.html').write('<html><body>hello</body></html>')
+    return str(path)
+
+
+@pytest.fixture
+def pyinstaller_envs(tmpdir, monkeypatch):
+    # Run the fake PyInstaller, and collect the environments it runs with
+    envs = []
+    check_call = subprocess.check_call
+
+    def check_call_spy(cmd, env=None):
+        envs.append(env)
+        return check_call(cmd, env=env)
+
+    monkeypatch.setattr(_freeze.subprocess, 'check_call', check_call_spy)
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    with _fake_pyinstaller(str(tmpdir.join('fake')), 3, 1000):
+        yield envs
+
+
+@pytest.mark.parametrize('platform, command, args', [
+    ('linux', 'python3 -m "x y"', ['python3', '-m', 'x y']),
+    ('linux', "serve.py --root 'a b'", ['serve.py', '--root', 'a b']),
+    ('win32', r'C:\srv\app.py --port 0', [r'C:\srv\app.py', '--port', '0']),
+    ('win32', r'"C:\my srv\app.py" --name "a b"', [r'C:\my srv\app.py', '--name', 'a b']),
+    ('win32', r'C:\srv\app.exe', [r'C:\srv\app.exe']),
+])
+def test_split_server_command(monkeypatch, platform, command, args):
+    monkeypatch.setattr(sys, 'platform', platform)
+    assert _freeze._split_command(command) == args
+
+
+def test_split_server_command_existing_path(tmpdir):
+    script = tmpdir.mkdir('my server').join('app.py')
+    script.write('')
+    assert _freeze._split_command(str(script)) == [str(script)]
+
+
+def test_reproducible_build_env(tmpdir, assets, pyinstaller_envs):
+    hashseed = os.environ.get('PYTHONHASHSEED')
+    target_dir = str(tmpdir.join('dist'))
+    create_app(target_dir, 'foo', assets, reproducible=True)
+    env, = pyinstaller_envs
+    assert env['PYTHONHASHSEED'] == '0'
+    assert env['SOURCE_DATE_EPOCH'] == str(_freeze.DEFAULT_EPOCH)
+    # The environment of this process is not touched
+    assert os.environ.get('PYTHONHASHSEED') == hashseed
+    assert 'SOURCE_DATE_EPOCH' not in os.environ
+    with open(os.path.join(target_dir, BUILD_MANIFEST_NAME), 'rb') as f:
+        manifest = json.loads(f.read().decode())
+    assert manifest['source_date_epoch'] == _freeze.DEFAULT_EPOCH
+    assert os.path.getmtime(os.path.join(target_dir, 'xul')) == _freeze.DEFAULT_EPOCH
+    # A normal build does not get these
+    create_app(target_dir, 'foo', assets)
+    assert 'SOURCE_DATE_EPOCH' not in pyinstaller_envs[1]
+    assert pyinstaller_envs[1].get('PYTHONHASHSEED') == hashseed
+
+
+def test_create_apps_layout(tmpdir, assets, pyinstaller_envs):
+    target_dir = str(tmpdir.join('dist'))
+    names = ['foo', 'bar', 'chrome']
+    apps = [dict(name=name, app=assets, title=name.title()) for name in names]
+    create_apps(target_dir, apps, memory_profile='lean')
+    assert len(pyinstaller_envs) == 1  # the launcher is frozen once
+    ext = '.exe' * sys.platform.startswith('win')
+    for name in names:
+        assert os.path.isfile(os.path.join(target_dir, 'xul', name, 'application.ini'))
+        assert os.path.isfile(os.path.join(target_dir, 'profile', name, 'firetron-template.txt'))
+        assert os.path.isfile(os.path.join(target_dir, name + ext))
+    # The frozen runtime is shared
+    assert len(os.listdir(os.path.join(target_dir, '_internal'))) == 3
+    assert not os.path.exists(os.path.join(target_dir, 'foo.py'))
+    with open(os.path.join(target_dir, BUILD_MANIFEST_NAME), 'rb') as f:
+        manifest = json.loads(f.read().decode())
+    assert manifest['apps'] == names
+    for name in names:
+        assert name + ext in manifest['files']
+        assert 'xul/%s/application.ini' % name in manifest['files']
+    with pytest.raises(ValueError):
+        create_apps(target_dir, apps + [dict(name='foo', app=assets)])
+
+
+def test_create_apps_windows_icons(tmpdir, assets, monkeypatch):
+    # On Windows, apps with an icon are frozen with it, instead of copied
+    runs = []
+
+    def run_pyinstaller(script, target_dir, name, iconfile=None, workpath=None, env=None):
+        runs.append((os.path.basename(script), name, iconfile and os.path.basename(iconfile)))
+        with open(os.path.join(target_dir, name + '.exe'), 'wb') as f:
+            f.write(name.encode())
+
+    monkeypatch.setattr(sys, 'platform', 'win32')
+    monkeypatch.setattr(_freeze, '_run_pyinstaller', run_pyinstaller)
+    icon = Icon()
+    icon.add(bytes(16 * 16 * 4))
+    apps = [dict(name='foo', app=assets, icon=icon), dict(name='bar', app=assets),
+            dict(name='spam', app=assets, icon=icon)]
+    target_dir = str(tmpdir.join('dist'))
+    with _fake_pyinstaller(str(tmpdir.join('fake')), 0, 0):
+        create_apps(target_dir, apps)
+    assert runs == [('foo.py', 'foo', 'foo.ico'), ('foo.py', 'spam', 'spam.ico')]
+    with open(os.path.join(target_dir, 'bar.exe'), 'rb') as f:
+        assert f.read() == b'foo'
+    assert not [fname for fname in os.listdir(target_dir) if fname.endswith('.ico')]
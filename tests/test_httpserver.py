@@ -0,0 +1,124 @@
+import os
+import gzip
+import asyncio
+import threading
+import http.client
+
+import pytest
+
+from firetron._httpserver import StaticServer, precompress
+
+
+@pytest.fixture
+def server(tmpdir):
+    root = tmpdir.mkdir('root')
+    root.join('index.html').write('<html>' + 'hello ' * 500 + '</html>')
+    root.mkdir('sub').join('big.bin').write_binary(os.urandom(300000))
+    tmpdir.join('secret.txt').write('secret')
+    precompress(str(root))
+    server = StaticServer(str(root), cache_file_size=1000)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+    yield server
+
+    async def shutdown():
+        server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def request(conn, path, **headers):
+    conn.request('GET', path, headers=headers)
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def test_server_get_and_304(server, tmpdir):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    # Several requests over one keep-alive connection
+    response, body = request(conn, '/')
+    assert response.status == 200
+    assert body == tmpdir.join('root', 'index.html').read_binary()
+    assert response.getheader('Content-Type') == 'text/html; charset=utf-8'
+    etag = response.getheader('ETag')
+    response, body = request(conn, '/index.html', **{'If-None-Match': etag})
+    assert response.status == 304 and body == b''
+    # A large file, sent with sendfile, and its etag
+    response, body = request(conn, '/sub/big.bin')
+    assert response.status == 200
+    assert body == tmpdir.join('root', 'sub', 'big.bin').read_binary()
+    response, body = request(conn, '/sub/big.bin',
+                             **{'If-None-Match': response.getheader('ETag')})
+    assert response.status == 304
+    # A changed file gets a new etag
+    tmpdir.join('root', 'index.html').write('changed!')
+    response, body = request(conn, '/', **{'If-None-Match': etag})
+    assert response.status == 200 and body == b'changed!'
+    conn.close()
+
+
+def test_server_gzip_variant(server, tmpdir):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    data = tmpdir.join('root', 'index.html').read_binary()
+    response, body = request(conn, '/index.html', **{'Accept-Encoding': 'gzip, deflate'})
+    assert response.getheader('Content-Encoding') == 'gzip'
+    assert response.getheader('Content-Type') == 'text/html; charset=utf-8'
+    assert response.getheader('Vary') == 'Accept-Encoding'
+    assert len(body) < len(data) and gzip.decompress(body) == data
+    response, body = request(conn, '/index.html')
+    assert response.getheader('Content-Encoding') is None and body == data
+    conn.close()
+
+
+@pytest.mark.parametrize('path', ['/../secret.txt', '/%2e%2e/secret.txt', '/..%2fsecret.txt',
+                                  '/sub/../../secret.txt', '/%2E%2E%5Csecret.txt',
+                                  '/link/secret.txt', '/missing.html'])
+def test_server_traversal(server, tmpdir, path):
+    if hasattr(os, 'symlink'):
+        os.symlink(str(tmpdir), str(tmpdir.join('root', 'link')))
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    response, body = request(conn, path)
+    assert response.status == 404
+    assert b'secret' not in body
+    conn.close()
+
+
+def test_server_skips_stale_variant(server, tmpdir):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    index = tmpdir.join('root', 'index.html')
+    st = os.stat(str(index) + '.gz')
+    # Edited after precompress()
+    index.write('<html>' + 'edited ' * 500 + '</html>')
+    os.utime(str(index), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    response, body = request(conn, '/index.html', **{'Accept-Encoding': 'gzip'})
+    assert response.getheader('Content-Encoding') is None
+    assert body == index.read_binary()
+    precompress(str(tmpdir.join('root')))
+    os.utime(str(index) + '.gz', ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+    response, body = request(conn, '/index.html', **{'Accept-Encoding': 'gzip'})
+    assert response.getheader('Content-Encoding') == 'gzip'
+    assert gzip.decompress(body) == index.read_binary()
+    conn.close()
+
+
+def test_server_file_removed_during_request(server, monkeypatch):
+    def lookup(filename, key):
+        raise FileNotFoundError(filename)
+
+    monkeypatch.setattr(server, '_lookup', lookup)
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    response, body = request(conn, '/index.html')
+    assert response.status == 404
+    # The connection is still usable
+    response, body = request(conn, '/index.html')
+    assert response.status == 404
+    conn.close()
@@ -0,0 +1,29 @@
+import os
+import json
+
+import pytest
+
+from firetron._instance import send_to_instance, LOCK_NAME
+
+
+def write_lock(path, data):
+    with open(os.path.join(path, LOCK_NAME), 'wb') as f:
+        f.write(data.encode() if isinstance(data, str) else json.dumps(data).encode())
+
+
+@pytest.mark.parametrize('data', ['', 'not json', '[1, 2]', '{"pid": 1}', 'null',
+                                  '{"pid": "x", "port": 1, "token": ""}'])
+def test_send_to_instance_invalid_lock(tmpdir, data):
+    write_lock(str(tmpdir), data)
+    assert send_to_instance(str(tmpdir)) is False
+
+
+def test_send_to_instance_no_lock(tmpdir):
+    assert send_to_instance(str(tmpdir)) is False
+
+
+def test_send_to_instance_dead_pid(tmpdir):
+    # A pid that is certainly not running
+    write_lock(str(tmpdir), dict(pid=2**22 + 12345, port=1, token='x'))
+    assert send_to_instance(str(tmpdir)) is False
+    assert not os.path.exists(str(tmpdir.join(LOCK_NAME)))
@@ -0,0 +1,23 @@
+import gc
+import os
+import sys
+import weakref
+import tempfile
+import subprocess
+
+from firetron._launch import LaunchedApp
+
+
+def test_closed_app_can_be_collected():
+    app_path = tempfile.mkdtemp()
+    process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    app = LaunchedApp(process, app_path, os.path.join(app_path, 'profile'))
+    assert app.is_alive()
+    app.close()
+    assert app.exit_code is not None
+    assert not os.path.exists(app_path)
+    # The atexit handler is removed, so it no longer keeps the app alive
+    ref = weakref.ref(app)
+    del app
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import types
+import socket
+import threading
+
+import pytest
+
+import firetron
+from firetron import _freeze
+from firetron._profile import create_profile_template
+
+
+def get_launcher_function(name, **namespace):
+    # The launcher is a script that is frozen along, take a function from it
+    code = _freeze.launcher_code
+    start = code.index('def %s(' % name)
+    end = code.index('\n\n', start)
+    namespace.update(os=os, sys=sys, firetron=firetron)
+    exec(code[start:end], namespace)
+    return namespace[name]
+
+
+def test_get_app_dir(tmpdir):
+    get_app_dir = get_launcher_function('get_app_dir')
+    exedir = str(tmpdir)
+    # A single app, with a chrome dir that has the same name as the app
+    os.makedirs(os.path.join(exedir, 'xul', 'chrome'))
+    open(os.path.join(exedir, 'xul', 'application.ini'), 'wb').close()
+    assert get_app_dir(exedir, 'xul', 'chrome') == os.path.join(exedir, 'xul')
+    # A bundle
+    os.makedirs(os.path.join(exedir, 'profile', 'foo'))
+    open(os.path.join(exedir, 'profile', 'foo', 'firetron-template.txt'), 'wb').close()
+    assert get_app_dir(exedir, 'profile', 'foo') == os.path.join(exedir, 'profile', 'foo')
+    assert get_app_dir(exedir, 'profile', 'bar') == os.path.join(exedir, 'profile')
+
+
+class FakeInstance(object):
+    # Stands in for a running instance: listens on a port and answers once
+
+    def __init__(self, reply):
+        self._server = socket.socket()
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self.port = self._server.getsockname()[1]
+        self.received = []
+        self._thread = threading.Thread(target=self._run, args=(reply, ))
+        self._thread.start()
+
+    def _run(self, reply):
+        conn, _ = self._server.accept()
+        with conn:
+            self.received.append(json.loads(conn.recv(1024).decode()))
+            conn.sendall(reply)
+
+    def close(self):
+        self._thread.join(5)
+        self._server.close()
+
+
+@pytest.fixture
+def launch(tmpdir, monkeypatch):
+    # Prepare the profile like the launcher does, with a profile template
+    monkeypatch.setenv('HOME', str(tmpdir))
+    monkeypatch.setattr(sys, 'argv', ['foo', 'file.txt'])
+    template = str(tmpdir.join('template'))
+    create_profile_template(template)
+    warnings = []
+    dialite = types.SimpleNamespace(warn=lambda title, msg: warnings.append(msg))
+    prepare_profile = get_launcher_function('prepare_profile', dialite=dialite,
+                                            get_app_dir=lambda *args: template)
+    profile_dir = os.path.join(str(tmpdir), '.firetron', 'foo')
+    os.makedirs(profile_dir)
+    lock_file = os.path.join(profile_dir, 'firetron-instance.json')
+
+    def launch(port=None):
+        if port is not None:
+            with open(lock_file, 'wb') as f:
+                f.write(json.dumps(dict(pid=os.getpid(), port=port, token='x')).encode())
+        return prepare_profile('foo', str(tmpdir))
+
+    launch.profile_dir, launch.lock_file, launch.warnings = profile_dir, lock_file, warnings
+    return launch
+
+
+def test_prepare_profile_new_instance(launch):
+    assert launch() == launch.profile_dir
+    assert os.path.isfile(os.path.join(launch.profile_dir, 'user.js'))
+
+
+def test_prepare_profile_removes_stale_lock(launch):
+    # The pid of the lock file is alive, but nothing listens on its port
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    assert launch(port) == launch.profile_dir
+    assert not os.path.exists(launch.lock_file)
+    assert os.path.isfile(os.path.join(launch.profile_dir, 'user.js'))
+
+
+@pytest.mark.parametrize('reply, code', [(b'ok\n', 0), (b'error: unknown command\n', 1)])
+def test_prepare_profile_running_instance(launch, reply, code):
+    instance = FakeInstance(reply)
+    try:
+        with pytest.raises(SystemExit) as err:
+            launch(instance.port)
+    finally:
+        instance.close()
+    assert err.value.code == code
+    assert instance.received == [dict(token='x', command='open', args=['file.txt'])]
+    assert len(launch.warnings) == code
+    # The profile of the running instance is left alone
+    assert os.path.isfile(launch.lock_file)
+    assert not os.path.exists(os.path.join(launch.profile_dir, 'user.js'))
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from firetron._png import write_png, read_png, quantize
+from firetron._icon import Icon
+
+
+def png_header(png):
+    # The bit depth and color type from the IHDR chunk
+    return png[24], png[25]
+
+
+def make_image(w, h, channels, colors=None):
+    if colors is None:
+        return bytes(bytearray(os.urandom(w * h * channels)))
+    pixels = [colors[(x * y + x) % len(colors)] for y in range(h) for x in range(w)]
+    return b''.join(pixels)
+
+
+@pytest.mark.parametrize('channels, color_type', [(1, 0), (2, 4), (3, 2), (4, 6)])
+def test_png_roundtrip(channels, color_type):
+    im = make_image(20, 10, channels)
+    png = write_png(im, (10, 20, channels))
+    assert png_header(png) == (8, color_type)
+    assert read_png(png) == (bytearray(im), (10, 20, channels))
+
+
+@pytest.mark.parametrize('mode, color_type, channels', [
+    ('gray', 0, 1), ('gray_alpha', 4, 2), ('rgb', 2, 3), ('rgba', 6, 4)])
+def test_png_mode_roundtrip(mode, color_type, channels):
+    # An opaque gray image can be written in any mode
+    gray = make_image(16, 16, 1)
+    rgba = b''.join(bytes([v, v, v, 255]) for v in gray)
+    png = write_png(rgba, (16, 16, 4), mode=mode)
+    assert png_header(png) == (8, color_type)
+    im, shape = read_png(png)
+    assert shape == (16, 16, channels)
+    assert im == b''.join(bytes([v, v, v, 255])[:channels] if channels > 2 else
+                          bytes([v, 255])[:channels] for v in gray)
+
+
+@pytest.mark.parametrize('ncolors, bit_depth', [(2, 1), (4, 2), (16, 4), (200, 8)])
+def test_png_palette_roundtrip(ncolors, bit_depth):
+    colors = [bytes([i, 255 - i, i // 2, 255 if i % 3 else 128]) for i in range(ncolors)]
+    im = make_image(30, 20, 4, colors)
+    png = write_png(im, (20, 30, 4), mode='palette')
+    assert png_header(png) == (bit_depth, 3)
+    assert read_png(png) == (bytearray(im), (20, 30, 4))
+    # Opaque palettes are read as RGB
+    colors = [c[:3] for c in colors]
+    im = make_image(30, 20, 3, colors)
+    assert read_png(write_png(im, (20, 30, 3), mode='palette')) == (bytearray(im), (20, 30, 3))
+
+
+def test_png_auto_mode():
+    gray = make_image(32, 32, 1)
+    rgb = b''.join(bytes([v, v, v]) for v in gray)
+    assert png_header(write_png(rgb, (32, 32, 3), mode='auto'))[1] == 0
+    colors = [b'\x00\x00\xff\xff', b'\xff\x00\x00\xff', b'\x00\x00\x00\x00']
+    im = make_image(32, 32, 4, colors)
+    png = write_png(im, (32, 32, 4), mode='auto')
+    assert png_header(png) == (2, 3)
+    assert read_png(png) == (bytearray(im), (32, 32, 4))
+
+
+def test_png_lossy_modes():
+    im = make_image(32, 32, 4)  # more than 256 colors
+    for mode in ('gray', 'gray_alpha', 'rgb', 'palette'):
+        with pytest.raises(ValueError):
+            write_png(im, (32, 32, 4), mode=mode)
+    im = make_image(32, 32, 3)
+    png = write_png(im, (32, 32, 3), colors=16)
+    assert png_header(png) == (4, 3)
+    out, shape = read_png(png)
+    assert shape == (32, 32, 3)
+    assert len({bytes(out[i:i+3]) for i in range(0, len(out), 3)}) <= 16
+    assert len(set(quantize(im, (32, 32, 3), 5)[1])) <= 5
+
+
+def test_icon_png_modes(tmpdir):
+    # An opaque gray icon: a standalone PNG gets smaller, containers keep RGBA
+    im = b''.join(bytes([v, v, v, 255]) for v in make_image(64, 64, 1))
+    icon = Icon()
+    icon.add(im)
+    ico = icon._to_ico()
+    png = ico[ico.index(b'\x89PNG'):]
+    assert png_header(png) == (8, 6)
+    filename = str(tmpdir.join('icon.png'))
+    icon.write(filename)
+    with open(str(tmpdir.join('icon64.png')), 'rb') as f:
+        assert png_header(f.read()) == (8, 0)
+    icon2 = Icon()
+    icon2.from_bytes('.ico', ico)
+    icon2.read(str(tmpdir.join('icon64.png')))
+    assert icon2._ims[64] == im
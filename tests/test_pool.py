@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from firetron._pool import AppDirPool
+
+
+def test_pool_reuses_dirs():
+    with AppDirPool(size=1) as pool:
+        with pool.lease() as lease:
+            path = lease.path
+            with open(os.path.join(lease.profile_dir, 'prefs.js'), 'wb') as f:
+                f.write(b'changed')
+        with pool.lease() as lease:
+            assert lease.path == path
+            assert not os.path.exists(os.path.join(lease.profile_dir, 'prefs.js'))
+    assert not os.path.exists(os.path.dirname(path))
+
+
+def test_pool_close_keeps_leased_dirs():
+    pool = AppDirPool(size=2)
+    lease1, lease2 = pool.lease(), pool.lease()
+    lease1.release()
+    pool.close()
+    assert not os.path.exists(lease1.path)
+    assert os.path.isdir(lease2.profile_dir)
+    with pytest.raises(RuntimeError):
+        pool.lease()
+    lease2.release()
+    assert not os.path.exists(os.path.dirname(lease2.path))
+
+
+def test_pool_lease_failure_releases_slot(monkeypatch):
+    with AppDirPool(size=1, max_concurrent=2) as pool:
+        lease = pool.lease()
+
+        def fail():
+            raise OSError('disk full')
+
+        monkeypatch.setattr(pool, '_create_slot', fail)
+        for i in range(3):
+            with pytest.raises(OSError):
+                pool.lease(timeout=0.1)
+        lease.release()
+        pool.lease(timeout=0.1).release()
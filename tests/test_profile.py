@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+
+from firetron import _profile
+from firetron._profile import create_profile_template
+
+FAKE_RUNTIME = '''#!{python}
+import os, sys, time
+path = sys.argv[sys.argv.index('-profile') + 1]
+os.makedirs(os.path.join(path, 'startupCache'))
+open(os.path.join(path, 'lock'), 'wb').close()
+time.sleep(0.3)  # the dir exists before the cache is written
+with open(os.path.join(path, 'startupCache', 'startupCache.8.little'), 'wb') as f:
+    for i in range(5):
+        f.write(b'x' * 1000)
+        f.flush()
+        time.sleep(0.2)
+if os.getenv('FIRETRON_WARMUP') and {quits}:
+    sys.exit(0)
+time.sleep(60)
+'''
+
+
+def make_runtime(tmpdir, quits):
+    filename = str(tmpdir.join('runtime'))
+    with open(filename, 'w') as f:
+        f.write(FAKE_RUNTIME.format(python=sys.executable, quits=quits))
+    os.chmod(filename, 0o755)
+    return filename
+
+
+def test_warm_profile_waits_for_startup_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(_profile, 'CACHE_SETTLE_TIME', 0.5)
+    for quits in (True, False):
+        path = str(tmpdir.join('profile%i' % quits))
+        t0 = time.time()
+        create_profile_template(path, exe=make_runtime(tmpdir, quits), timeout=20)
+        assert time.time() - t0 < 10
+        cache = os.path.join(path, 'startupCache', 'startupCache.8.little')
+        assert os.path.getsize(cache) == 5000
+        assert not os.path.exists(os.path.join(path, 'lock'))
+        assert os.path.isfile(os.path.join(path, 'user.js'))